@@ -61,6 +61,11 @@ def create_app(config_class=Config):
     app.register_blueprint(trace_bp, url_prefix='/api/trace')
     logger.info("已注册 Trace 蓝图")
     
+    # 后台预热 LLM 连接，不阻塞启动
+    if should_log_startup and not Config.validate():
+        import threading
+        threading.Thread(target=_prewarm_llm_connections, name="llm-prewarm", daemon=True).start()
+    
     # 健康检查
     @app.route('/health')
     def health():
@@ -70,3 +75,12 @@ def create_app(config_class=Config):
         logger.info("追迹 Backend 启动完成")
     
     return app
+
+
+def _prewarm_llm_connections():
+    from .utils.endpoint_pool import get_shared_pool
+    from .utils.http_pool import prewarm
+    try:
+        prewarm(e.base_url for e in get_shared_pool().endpoints)
+    except Exception as e:
+        get_logger('trace').warning(f"LLM 连接预热失败: {e}")
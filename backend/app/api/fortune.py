@@ -7,6 +7,7 @@ from flask import request, jsonify
 from . import fortune_bp
 from ..services.relationship_service import RelationshipService
 from ..utils.logger import get_logger
+from ..utils.text_ingest import UploadRejected, is_supported_upload, read_text_upload
 
 logger = get_logger('wannian.api.relationship')
 
@@ -28,7 +29,8 @@ def get_relationship_service():
 def analyze_text():
     """
     启动文本分析
-    支持 JSON {"text": "..."} 或 文件上传 multipart/form-data
+    支持 JSON {"text": "..."} 或 文件上传 multipart/form-data；
+    可选 deadline_seconds / tier 限定整个分析的最长耗时，到期返回部分结果
     """
     logger.info(f"收到分析请求: {request.method} {request.path}, Content-Type: {request.content_type}")
     try:
@@ -43,37 +45,26 @@ def analyze_text():
                 "hint": "请在项目根目录创建 .env 文件并配置 LLM_API_KEY。"
             }), 400
 
+        # 在解析表单之前按请求头拒绝超大上传，避免先把整个文件收进来
+        if request.content_length and request.content_length > Config.MAX_CONTENT_LENGTH:
+            return jsonify({"success": False, "error": "上传文件过大"}), 413
+
         text_content = ""
         
-        # 处理文件上传
+        # 处理文件上传（流式解码，支持 .txt.gz）
         if 'file' in request.files:
             file = request.files['file']
-            if file and file.filename.endswith('.txt'):
+            if file and is_supported_upload(file.filename):
                 try:
-                    # 参考“参商”优化的文件读取：支持多编码
-                    content_bytes = file.read(Config.MAX_CONTENT_LENGTH)
-                    text_content = ""
-                    encodings = ['utf-8-sig', 'utf-8', 'gbk', 'gb18030', 'latin-1']
-                    
-                    for enc in encodings:
-                        try:
-                            text_content = content_bytes.decode(enc)
-                            logger.info(f"成功使用 {enc} 编码读取文件: {file.filename}")
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                    
-                    if not text_content:
-                        # 最后的保底方案
-                        text_content = content_bytes.decode('utf-8', errors='ignore')
-                        logger.warning(f"所有指定编码均失败，使用 utf-8 (ignore) 读取文件: {file.filename}")
-                    
+                    text_content, _ = read_text_upload(file.stream, file.filename, max_chars=Config.MAX_TEXT_CHARS)
                     logger.info(f"文件读取完成, 长度: {len(text_content)}")
+                except UploadRejected as e:
+                    return jsonify({"success": False, "error": str(e)}), 400
                 except Exception as e:
                     logger.error(f"文件读取失败: {str(e)}")
                     return jsonify({"success": False, "error": f"文件读取失败: {str(e)}"}), 400
             else:
-                return jsonify({"success": False, "error": "仅支持 .txt 文件"}), 400
+                return jsonify({"success": False, "error": "仅支持 .txt 或 .txt.gz 文件"}), 400
         # 处理 JSON 文本
         elif request.is_json:
             data = request.get_json()
@@ -83,12 +74,23 @@ def analyze_text():
             return jsonify({"success": False, "error": "文本内容不能为空"}), 400
 
         # 限制文本长度（提升至 300 万字以支持长篇小说）
-        if len(text_content) > 3000000:
+        if len(text_content) > Config.MAX_TEXT_CHARS:
              return jsonify({"success": False, "error": "文本过长，目前仅支持 300 万字以内的文本"}), 400
 
+        # 可选截止时间：deadline_seconds（秒）与 tier（对应 TRACE_DEADLINE_TIERS 中的档位）
+        options = (request.get_json(silent=True) if request.is_json else request.form) or {}
+        deadline_seconds = options.get("deadline_seconds")
+        if deadline_seconds is not None and deadline_seconds != "":
+            try:
+                deadline_seconds = float(deadline_seconds)
+            except (TypeError, ValueError):
+                return jsonify({"success": False, "error": "deadline_seconds 必须是数字"}), 400
+        else:
+            deadline_seconds = None
+
         service = get_relationship_service()
-        result = service.analyze_text(text_content)
-        return jsonify(result)
+        result = service.analyze_text(text_content, deadline_seconds=deadline_seconds, tier=options.get("tier") or None)
+        return jsonify(result), (200 if result.get("success") else 400)
 
     except ValueError as ve:
         logger.error(f"配置错误: {str(ve)}")
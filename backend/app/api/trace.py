@@ -6,8 +6,10 @@
 from flask import request, jsonify
 
 from . import trace_bp
+from ..config import Config
 from ..services.trace_service import TraceService
 from ..utils.logger import get_logger
+from ..utils.text_ingest import UploadRejected, is_supported_upload, read_text_upload
 
 logger = get_logger('footprints.api.trace')
 
@@ -22,70 +24,168 @@ def get_trace_service() -> TraceService:
     return _trace_service
 
 
+def _check_config():
+    """非 Mock 模式下检查 LLM 配置，缺失时返回错误响应"""
+    import os
+    mock_mode = (os.getenv("TRACE_MOCK") or "").strip().lower() in {"1", "true", "yes"}
+    if mock_mode:
+        return None
+    config_errors = Config.validate()
+    if config_errors:
+        return jsonify({
+            "success": False,
+            "error": "配置缺失",
+            "details": config_errors,
+            "hint": "请在项目根目录创建 .env 文件并配置 LLM_API_KEY。"
+        }), 400
+    return None
+
+
+def _read_request_text():
+    """
+    从上传文件或 JSON {"text": "..."} 中读取文本
+
+    Returns:
+        (文本, 错误响应)，两者必有一个为 None
+    """
+    # 在解析表单之前按请求头拒绝超大上传，避免先把整个文件收进来
+    if request.content_length and request.content_length > Config.MAX_CONTENT_LENGTH:
+        return None, (jsonify({"success": False, "error": "上传文件过大"}), 413)
+
+    text_content = ""
+
+    if 'file' in request.files:
+        file = request.files['file']
+        if not file or not is_supported_upload(file.filename):
+            return None, (jsonify({"success": False, "error": "仅支持 .txt 或 .txt.gz 文件"}), 400)
+
+        try:
+            text_content, _ = read_text_upload(file.stream, file.filename, max_chars=Config.MAX_TEXT_CHARS)
+        except UploadRejected as e:
+            return None, (jsonify({"success": False, "error": str(e)}), 400)
+        except Exception as e:
+            logger.error(f"文件读取失败: {str(e)}")
+            return None, (jsonify({"success": False, "error": f"文件读取失败: {str(e)}"}), 400)
+    elif request.is_json:
+        data = request.get_json() or {}
+        text_content = data.get('text', '')
+
+    if not text_content or len(text_content.strip()) == 0:
+        return None, (jsonify({"success": False, "error": "文本内容不能为空"}), 400)
+
+    if len(text_content) > Config.MAX_TEXT_CHARS:
+        return None, (jsonify({"success": False, "error": "文本过长，目前仅支持 300 万字以内的文本"}), 400)
+
+    return text_content, None
+
+
+def _read_deadline_options(data=None):
+    """
+    读取可选的截止时间参数：deadline_seconds（秒）与 tier（对应 TRACE_DEADLINE_TIERS 中的档位）
+
+    Returns:
+        ((秒数, 档位), 错误响应)
+    """
+    if data is None:
+        data = request.get_json(silent=True) if request.is_json else request.form
+    data = data or {}
+    seconds = data.get("deadline_seconds")
+    tier = data.get("tier") or None
+    if seconds is not None and seconds != "":
+        try:
+            seconds = float(seconds)
+        except (TypeError, ValueError):
+            return None, (jsonify({"success": False, "error": "deadline_seconds 必须是数字"}), 400)
+    else:
+        seconds = None
+    return (seconds, tier), None
+
+
 @trace_bp.route('/analyze', methods=['POST'])
 def analyze_text():
     """
     启动文本分析
-    支持 JSON {"text": "..."} 或 文件上传 multipart/form-data
+    支持 JSON {"text": "..."} 或 文件上传 multipart/form-data；
+    可选 deadline_seconds / tier 限定整个分析的最长耗时，到期返回部分结果
     """
     logger.info(f"收到分析请求: {request.method} {request.path}, Content-Type: {request.content_type}")
     try:
-        from ..config import Config
+        error = _check_config()
+        if error:
+            return error
 
-        import os
-        mock_mode = (os.getenv("TRACE_MOCK") or "").strip().lower() in {"1", "true", "yes"}
-        if not mock_mode:
-            config_errors = Config.validate()
-            if config_errors:
-                return jsonify({
-                    "success": False,
-                    "error": "配置缺失",
-                    "details": config_errors,
-                    "hint": "请在项目根目录创建 .env 文件并配置 LLM_API_KEY。"
-                }), 400
-
-        text_content = ""
-
-        if 'file' in request.files:
-            file = request.files['file']
-            if not file or not file.filename.endswith('.txt'):
-                return jsonify({"success": False, "error": "仅支持 .txt 文件"}), 400
-
-            try:
-                content_bytes = file.read(Config.MAX_CONTENT_LENGTH)
-                # 移除 latin-1，因为它会“成功”解码所有字节导致乱码，从而掩盖真正的 GBK/UTF-8 问题
-                encodings = ['utf-8-sig', 'utf-8', 'gb18030', 'gbk', 'big5']
-                for enc in encodings:
-                    try:
-                        text_content = content_bytes.decode(enc)
-                        # 简单的启发式检查：如果解码后包含太多乱码字符（�），则认为失败
-                        if text_content.count('�') > len(text_content) * 0.1:
-                            continue
-                        logger.info(f"成功使用 {enc} 编码读取文件: {file.filename}")
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if not text_content:
-                    # 如果常见编码都失败了，再尝试使用 errors='replace' 的 utf-8，至少保证程序不崩
-                    text_content = content_bytes.decode('utf-8', errors='replace')
-                    logger.warning(f"所有指定编码均失败，使用 utf-8 (replace) 读取文件: {file.filename}")
-            except Exception as e:
-                logger.error(f"文件读取失败: {str(e)}")
-                return jsonify({"success": False, "error": f"文件读取失败: {str(e)}"}), 400
-        elif request.is_json:
-            data = request.get_json() or {}
-            text_content = data.get('text', '')
-
-        if not text_content or len(text_content.strip()) == 0:
-            return jsonify({"success": False, "error": "文本内容不能为空"}), 400
-
-        if len(text_content) > 3000000:
-            return jsonify({"success": False, "error": "文本过长，目前仅支持 300 万字以内的文本"}), 400
+        text_content, error = _read_request_text()
+        if error:
+            return error
+        (deadline_seconds, tier), error = _read_deadline_options()
+        if error:
+            return error
 
         service = get_trace_service()
-        result = service.analyze_text(text_content)
-        return jsonify(result)
+        result = service.analyze_text(text_content, deadline_seconds=deadline_seconds, tier=tier)
+        return jsonify(result), (200 if result.get("success") else 400)
+
+    except Exception as e:
+        logger.error(f"分析请求失败: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@trace_bp.route('/documents', methods=['POST'])
+def upload_document():
+    """
+    上传文本但不立即分析，返回 document_id 与章节目录
+    """
+    try:
+        text_content, error = _read_request_text()
+        if error:
+            return error
+
+        service = get_trace_service()
+        doc = service.register_document(text_content)
+        return jsonify(service.list_chapters(doc["document_id"]))
+
+    except Exception as e:
+        logger.error(f"文档上传失败: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@trace_bp.route('/documents/<document_id>/chapters', methods=['GET'])
+def list_chapters(document_id: str):
+    service = get_trace_service()
+    result = service.list_chapters(document_id)
+    return jsonify(result), (200 if result.get("success") else 404)
+
+
+@trace_bp.route('/documents/<document_id>/analyze', methods=['POST'])
+def analyze_document(document_id: str):
+    """
+    仅分析指定章节区间
+    JSON {"chapter_start": 200, "chapter_end": 260}（1 起，闭区间，均可省略），
+    可选 deadline_seconds / tier
+    """
+    try:
+        error = _check_config()
+        if error:
+            return error
+
+        data = request.get_json(silent=True) or {}
+        try:
+            chapter_start = int(data["chapter_start"]) if data.get("chapter_start") is not None else None
+            chapter_end = int(data["chapter_end"]) if data.get("chapter_end") is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "章节范围必须是整数"}), 400
+        (deadline_seconds, tier), error = _read_deadline_options(data)
+        if error:
+            return error
+
+        service = get_trace_service()
+        if document_id not in service.documents:
+            return jsonify({"success": False, "error": "Document not found"}), 404
+        result = service.analyze_document(
+            document_id, chapter_start=chapter_start, chapter_end=chapter_end,
+            deadline_seconds=deadline_seconds, tier=tier
+        )
+        return jsonify(result), (200 if result.get("success") else 400)
 
     except Exception as e:
         logger.error(f"分析请求失败: {str(e)}")
@@ -99,6 +199,20 @@ def get_status(session_id: str):
     return jsonify(result)
 
 
+@trace_bp.route('/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """LLM 端点池、共享 HTTP 连接池、JSON 修复与地点规则一致率的运行统计"""
+    from ..utils.endpoint_pool import get_shared_pool
+    from ..utils.http_pool import pool_stats
+    from ..utils.json_repair import repair_stats
+    from ..services.location_rules import rule_agreement_stats
+    try:
+        endpoints = get_shared_pool().stats()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    return jsonify({"success": True, "endpoints": endpoints, "http": pool_stats(), "json": repair_stats(), "rules": rule_agreement_stats()})
+
+
 @trace_bp.route('/sample', methods=['GET'])
 def get_sample_data():
     """
@@ -29,6 +29,9 @@ class Config:
     # 最大上传限制 (32MB)
     MAX_CONTENT_LENGTH = 32 * 1024 * 1024
     
+    # 单次分析允许的最大字符数（300 万字）
+    MAX_TEXT_CHARS = 3000000
+    
     # LLM配置（统一使用OpenAI格式）
     LLM_API_KEY = os.environ.get('LLM_API_KEY')
     LLM_BASE_URL = os.environ.get('LLM_BASE_URL', 'https://api.openai.com/v1')
@@ -39,10 +42,30 @@ class Config:
     LLM_BOOST_BASE_URL = os.environ.get('LLM_BOOST_BASE_URL')
     LLM_BOOST_MODEL_NAME = os.environ.get('LLM_BOOST_MODEL_NAME', 'gpt-4o-mini')
     
+    # 多端点池（可选）：JSON 数组，每项含 base_url / api_key / model / tier(main|boost) / weight / max_concurrency
+    # 配置后取代上面的单一主模型与加速模型配置
+    LLM_ENDPOINTS = os.environ.get('LLM_ENDPOINTS')
+    # 端点被限流（429）后的冷却时间（秒）
+    LLM_ENDPOINT_COOLDOWN = float(os.environ.get('LLM_ENDPOINT_COOLDOWN', '30'))
+    
+    # 共享 HTTP 连接池（所有 LLM 客户端复用；安装 h2 时启用 HTTP/2）
+    LLM_HTTP_SHARED = os.environ.get('LLM_HTTP_SHARED', 'True').lower() == 'true'
+    LLM_HTTP2 = os.environ.get('LLM_HTTP2', 'True').lower() == 'true'
+    LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', '128'))
+    LLM_HTTP_MAX_KEEPALIVE = int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', '64'))
+    LLM_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_HTTP_KEEPALIVE_EXPIRY', '60'))
+    # 启动时对每个服务商域名预热的连接数（0 表示不预热）
+    LLM_HTTP_PREWARM = int(os.environ.get('LLM_HTTP_PREWARM', '2'))
+    
+    # Batch API 配置（TRACE_EXECUTION_MODE=batch 时使用，适合夜间批量分析）
+    LLM_BATCH_POLL_INTERVAL = float(os.environ.get('LLM_BATCH_POLL_INTERVAL', '30'))
+    LLM_BATCH_TIMEOUT = float(os.environ.get('LLM_BATCH_TIMEOUT', str(24 * 3600)))
+    LLM_BATCH_COMPLETION_WINDOW = os.environ.get('LLM_BATCH_COMPLETION_WINDOW', '24h')
+    
     @classmethod
     def validate(cls):
         """验证必要配置"""
         errors = []
-        if not cls.LLM_API_KEY:
+        if not cls.LLM_API_KEY and not cls.LLM_ENDPOINTS:
             errors.append("LLM_API_KEY 未配置")
         return errors
@@ -0,0 +1,183 @@
+"""
+地点层级求解
+提取、LLM 分类、父级兜底、社区细化与 inside 关系都只提交 "子 -> 父" 候选边，
+最后统一挑一片最大权重森林：每个地点至多一个父级、不成环，并记录父级来自哪个来源；
+某个来源复核后否决的候选边（如分类看过提取给的父级提示后改判）不再参与求解
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 来源权重：地图阶段 LLM 明确给出的 inside 关系最可信，其次是分类、提取，
+# 基于名称/证据打分的兜底与社区划分最弱
+PARENT_SOURCE_WEIGHTS = {
+    "relation": 5.0,
+    "classifier": 4.0,
+    "extractor": 3.0,
+    "fallback": 2.0,
+    "community": 1.0,
+}
+
+# 同权重时的来源优先级（越小越优先）
+_SOURCE_ORDER = {name: i for i, name in enumerate(PARENT_SOURCE_WEIGHTS)}
+
+
+class _DisjointSet:
+    """路径减半的并查集，元素首次查询时自成一棵树"""
+
+    def __init__(self):
+        self.root: Dict[str, str] = {}
+
+    def find(self, x: str) -> str:
+        root = self.root
+        root.setdefault(x, x)
+        while root[x] != x:
+            root[x] = root[root[x]]
+            x = root[x]
+        return x
+
+    def link(self, a: str, b: str) -> None:
+        """把根 a 挂到根 b 下"""
+        self.root[a] = b
+
+
+class HierarchyResolver:
+    """
+    用法：各阶段调用 add(child, parent, source)，最后 resolve(nodes) 得到 {child: parent}
+
+    求解按 Kruskal 的思路：候选边按 (权重降序, 来源优先级, 子名, 父名) 排序后依次尝试，
+    子地点已有父级则跳过，父子已在同一棵树里则说明会成环、丢弃并记入 cycles；
+    并查集判断连通，整体 O(E log E)，结果只取决于候选集合，与提交顺序无关
+    """
+
+    def __init__(self):
+        # (child, parent) -> (weight, source)，同一条边只保留最高权重的来源
+        self._candidates: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        # (child, parent) -> 否决它的来源中的最高权重；不高于该权重的候选边一律作废
+        self._rejected: Dict[Tuple[str, str], float] = {}
+        self.parents: Dict[str, str] = {}
+        self.sources: Dict[str, str] = {}
+        self.cycles: List[Tuple[str, str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._candidates)
+
+    def add(self, child: Optional[str], parent: Optional[str], source: str, weight: Optional[float] = None) -> None:
+        if not child or not parent or child == parent:
+            return
+        if weight is None:
+            weight = PARENT_SOURCE_WEIGHTS.get(source, 1.0)
+        key = (child, parent)
+        if weight <= self._rejected.get(key, float("-inf")):
+            return
+        current = self._candidates.get(key)
+        if current is None or (weight, -_SOURCE_ORDER.get(source, len(_SOURCE_ORDER))) > (
+            current[0], -_SOURCE_ORDER.get(current[1], len(_SOURCE_ORDER))
+        ):
+            self._candidates[key] = (weight, source)
+
+    def reject(self, child: Optional[str], parent: Optional[str], source: str) -> None:
+        """
+        source 复核后否决 child -> parent：已提交的与之后提交的该候选边，
+        来源权重不高于 source 的都作废（更强的来源如 inside 关系仍可给出）
+        """
+        if not child or not parent:
+            return
+        weight = PARENT_SOURCE_WEIGHTS.get(source, 1.0)
+        key = (child, parent)
+        self._rejected[key] = max(weight, self._rejected.get(key, float("-inf")))
+        current = self._candidates.get(key)
+        if current is not None and current[0] <= weight:
+            del self._candidates[key]
+
+    def add_locations(self, locations: Iterable[Dict[str, object]], default_source: str) -> None:
+        """
+        把地点当前的 parent_id 作为候选边提交，来源取 parent_source，未标注时用 default_source；
+        rejected_parents（{父地点: 否决来源}）里记下的候选边先行作废
+        """
+        for loc in locations:
+            for parent, source in (loc.get("rejected_parents") or {}).items():
+                self.reject(loc.get("id"), parent, source)
+            self.add(loc.get("id"), loc.get("parent_id"), loc.get("parent_source") or default_source)
+
+    def resolve(self, nodes: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Args:
+            nodes: 只在这些地点之间求解（两端都在其中的候选边才参与）；为 None 时不限
+
+        Returns:
+            {子地点: 父地点}；同时更新 parents、sources 与 cycles
+        """
+        allowed: Optional[Set[str]] = set(nodes) if nodes is not None else None
+        edges = [
+            (weight, source, child, parent)
+            for (child, parent), (weight, source) in self._candidates.items()
+            if allowed is None or (child in allowed and parent in allowed)
+        ]
+        edges.sort(key=lambda e: (-e[0], _SOURCE_ORDER.get(e[1], len(_SOURCE_ORDER)), e[2], e[3]))
+
+        forest = _DisjointSet()
+        parents: Dict[str, str] = {}
+        sources: Dict[str, str] = {}
+        cycles: List[Tuple[str, str, str]] = []
+        for weight, source, child, parent in edges:
+            if child in parents:
+                continue
+            # child 尚无父级，必是所在树的根；parent 与它同树即是它的后代，连上就成环
+            rc, rp = forest.find(child), forest.find(parent)
+            if rc == rp:
+                cycles.append((child, parent, source))
+                continue
+            forest.link(rc, rp)
+            parents[child] = parent
+            sources[child] = source
+
+        self.parents, self.sources, self.cycles = parents, sources, cycles
+        return dict(parents)
+
+    def nearest_ancestor(self, anchors: Set[str]) -> Dict[str, str]:
+        """
+        每个有父级的地点沿已求解的森林向上，最近的锚点祖先（无则不出现在结果里）；
+        结果逐层记忆，整体线性
+        """
+        memo: Dict[str, Optional[str]] = {}
+
+        def lookup(start: str) -> Optional[str]:
+            path = []
+            cur = start
+            found: Optional[str] = None
+            while True:
+                if cur in memo:
+                    found = memo[cur]
+                    break
+                pid = self.parents.get(cur)
+                if pid is None:
+                    found = None
+                    break
+                path.append(cur)
+                if pid in anchors:
+                    found = pid
+                    break
+                cur = pid
+            # 路径上各点的最近锚点祖先相同：要么是找到的锚点，要么都没有
+            for node in path:
+                memo[node] = found
+            return found
+
+        result = {}
+        for child in self.parents:
+            anchor = lookup(child)
+            if anchor is not None:
+                result[child] = anchor
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        by_source: Dict[str, int] = {}
+        for source in self.sources.values():
+            by_source[source] = by_source.get(source, 0) + 1
+        return {
+            "candidates": len(self._candidates),
+            "resolved": len(self.parents),
+            "cycles_broken": len(self.cycles),
+            "rejected": len(self._rejected),
+            "sources": by_source,
+        }
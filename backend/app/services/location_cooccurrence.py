@@ -0,0 +1,162 @@
+"""
+地点共现矩阵
+按片段统计地点两两同现的次数与共同出场人物，稀疏存储（整数 id + 每行一个 dict），
+供分类上下文、父级兜底、层级细化与地图构建共用
+"""
+
+import heapq
+from collections import Counter, deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 同一片段里两个地点每有一个共同出场人物，权重额外加这么多
+CHARACTER_WEIGHT = 0.5
+
+
+class CooccurrenceMatrix:
+    """
+    对称稀疏矩阵：rows[i][j] 为地点 i 与 j 的共现权重
+    （同现片段数 + CHARACTER_WEIGHT × 片段内共同出场人物数）
+
+    Args:
+        location_ids: 地点 id，按排序后的顺序编号
+    """
+
+    def __init__(self, location_ids: Iterable[str]):
+        self.ids: List[str] = sorted(set(i for i in location_ids if i))
+        self.index: Dict[str, int] = {lid: i for i, lid in enumerate(self.ids)}
+        self.rows: List[Dict[int, float]] = [{} for _ in self.ids]
+        self.chunk_counts: List[int] = [0] * len(self.ids)
+        self.characters: List[Counter] = [Counter() for _ in self.ids]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(
+        cls,
+        location_ids: Iterable[str],
+        extracted_results: List[Dict[str, object]],
+        alias_to_id: Dict[str, str]
+    ) -> "CooccurrenceMatrix":
+        matrix = cls(location_ids)
+        for res in extracted_results:
+            matrix.add_chunk(res.get("events") or [], alias_to_id)
+        return matrix
+
+    def add_chunk(self, events: List[Dict[str, object]], alias_to_id: Dict[str, str]) -> None:
+        # 片段内每个地点 -> 该片段里在此出场的人物
+        present: Dict[int, set] = {}
+        for evt in events:
+            raw = evt.get("location")
+            lid = alias_to_id.get(raw, raw)
+            idx = self.index.get(lid) if lid else None
+            if idx is None:
+                continue
+            chars = present.setdefault(idx, set())
+            for c in (evt.get("characters") or []):
+                if c:
+                    chars.add(c)
+
+        members = sorted(present)
+        for i in members:
+            self.chunk_counts[i] += 1
+            self.characters[i].update(present[i])
+        for pos, i in enumerate(members):
+            row_i, chars_i = self.rows[i], present[i]
+            for j in members[pos + 1:]:
+                w = 1.0 + CHARACTER_WEIGHT * len(chars_i & present[j])
+                row_i[j] = row_i.get(j, 0.0) + w
+                row_j = self.rows[j]
+                row_j[i] = row_j.get(i, 0.0) + w
+
+    def weight(self, a: str, b: str) -> float:
+        i, j = self.index.get(a), self.index.get(b)
+        if i is None or j is None:
+            return 0.0
+        return self.rows[i].get(j, 0.0)
+
+    def chunk_count(self, lid: str) -> int:
+        """该地点出现过的片段数"""
+        i = self.index.get(lid)
+        return self.chunk_counts[i] if i is not None else 0
+
+    def neighbors(self, lid: str, k: Optional[int] = 6) -> List[Tuple[str, float]]:
+        """权重最高的 k 个共现地点（k 为 None 时全部）；同权重按名称排序，结果稳定"""
+        i = self.index.get(lid)
+        if i is None:
+            return []
+        # id 即名称排序位置，同权重时名称靠前者胜出
+        row = self.rows[i]
+        top = heapq.nsmallest(len(row) if k is None else k, row.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(self.ids[j], w) for j, w in top]
+
+    def top_characters(self, lid: str, k: int = 4) -> List[str]:
+        """与该地点同片段出场次数最多的 k 个人物"""
+        i = self.index.get(lid)
+        if i is None:
+            return []
+        top = heapq.nsmallest(k, self.characters[i].items(), key=lambda kv: (-kv[1], kv[0]))
+        return [c for c, _ in top]
+
+    def edges(self, min_weight: float = 0.0, restrict: Optional[Iterable[str]] = None) -> List[Tuple[str, str, float]]:
+        """上三角的全部边 (a, b, weight)，可限定在部分地点内"""
+        allowed = None
+        if restrict is not None:
+            allowed = {self.index[lid] for lid in restrict if lid in self.index}
+        result = []
+        for i, row in enumerate(self.rows):
+            if allowed is not None and i not in allowed:
+                continue
+            for j, w in row.items():
+                if j > i and w >= min_weight and (allowed is None or j in allowed):
+                    result.append((self.ids[i], self.ids[j], w))
+        return result
+
+    def max_weight(self) -> float:
+        return max((w for row in self.rows for w in row.values()), default=0.0)
+
+
+
+def group_by_neighborhood(
+    ids: List[str],
+    neighbors: Callable[[str], Iterable[str]],
+    max_size: int
+) -> List[List[str]]:
+    """
+    把地点按共现邻域分组：依次以尚未分组的地点为起点广度优先吸收邻居，
+    每组不超过 max_size；过小的相邻组再合并，减少请求数
+
+    Args:
+        ids: 待分组的地点，按起点优先级排列
+        neighbors: 地点 -> 相关地点（按相关度降序）
+        max_size: 每组上限
+    """
+    max_size = max(1, max_size)
+    wanted = set(ids)
+    assigned: set = set()
+    groups: List[List[str]] = []
+    for seed in ids:
+        if seed in assigned:
+            continue
+        group: List[str] = []
+        queue = deque([seed])
+        queued = {seed}
+        while queue and len(group) < max_size:
+            lid = queue.popleft()
+            if lid in assigned:
+                continue
+            assigned.add(lid)
+            group.append(lid)
+            for nb in neighbors(lid):
+                if nb in wanted and nb not in assigned and nb not in queued:
+                    queued.add(nb)
+                    queue.append(nb)
+        groups.append(group)
+
+    packed: List[List[str]] = []
+    for group in groups:
+        if packed and len(packed[-1]) + len(group) <= max_size:
+            packed[-1].extend(group)
+        else:
+            packed.append(list(group))
+    return packed
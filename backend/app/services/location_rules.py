@@ -0,0 +1,362 @@
+"""
+地点规则引擎
+子地点 kind、名称后缀与关键词、排除后缀、现实地名后缀的判定集中在这里，
+导入时编译一次（后缀字典树 + 关键词自动机），作用域规则、父级兜底与现实地名启发式共用
+"""
+
+import functools
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from ..utils.aho_corasick import AhoCorasick
+
+# 子地点 kind（房间、建筑、设施、交通工具等）
+SUB_KINDS = frozenset({
+    # Basic & Residential
+    "room", "hall", "courtyard", "corridor", "path", "gate", "wall", "floor", "window",
+    "kitchen", "bedroom", "bathroom", "toilet", "restroom", "stairs", "elevator",
+    "balcony", "terrace", "lobby", "reception", "pantry", "basement", "attic",
+    "apartment", "dormitory", "studio", "suite",
+
+    # Commercial & Entertainment (Modern)
+    "mall", "market", "shop", "store", "supermarket", "convenience_store",
+    "restaurant", "cafe", "bar", "pub", "club", "karaoke", "cinema", "theater", "gym",
+    "hotel", "inn", "motel", "hostel", "resort", "spa", "casino",
+
+    # Office & Institutional (Modern)
+    "office", "meeting_room", "conference_room", "workspace", "cubicle",
+    "classroom", "library", "laboratory", "auditorium", "cafeteria", "canteen",
+    "hospital", "clinic", "ward", "surgery", "pharmacy", "police_station", "fire_station",
+    "post_office", "bank", "museum", "gallery",
+
+    # Transport & Infrastructure (Modern)
+    "station", "stop", "platform", "dock", "pier", "wharf", "airport", "terminal",
+    "parking", "garage", "tunnel", "bridge", "factory", "warehouse", "plant", "workshop",
+
+    # Ancient & Fantasy
+    "palace", "temple", "shrine", "altar", "pagoda", "tower", "pavilion", "gazebo",
+    "cave", "grotto", "dungeon", "cell", "prison", "jail", "crypt", "tomb", "grave",
+    "arena", "stadium", "ring", "field", "formation", "array",
+    "sect_gate", "main_hall", "side_hall", "scripture_library", "pill_room", "weapon_room",
+    "secret_chamber", "treasure_room", "spirit_field", "medicine_garden",
+
+    # Objects/Vehicles (treated as POI/Sub)
+    "vehicle", "car", "bus", "train", "plane", "ship", "boat", "carriage", "sedan_chair",
+    "tent", "camp", "cabin"
+})
+
+POI_KINDS = frozenset({"item", "furniture", "decoration", "device", "weapon", "tool"})
+
+WORLD_KINDS = frozenset({"country", "state", "province", "continent", "ocean", "planet", "galaxy", "universe"})
+
+# 子地点名称常见的结尾字
+SUB_SUFFIXES = (
+    # Generic Building Parts
+    "室", "厅", "房", "廊", "厕", "厨", "卫", "梯", "台", "壁", "窗", "门", "柱", "底", "顶",
+    # Residential/Living
+    "寓", "舍", "宅", "邸", "窟", "洞",
+    # Ancient Architecture
+    "阁", "轩", "斋", "榭", "亭", "楼", "塔", "阙", "坛", "座", "池", "井", "墓", "冢",
+    "庵", "观", "寺", "庙", "祠", "堂", "署", "监", "狱", "牢",
+    # Commercial/Functional
+    "馆", "店", "铺", "厂", "仓", "所", "处", "局", "科", "部", "行", "社",
+    # Modern（场、院有歧义，见 LocationRuleEngine._name_rules）
+    "站", "港", "院", "园", "场"
+)
+
+# 名称中出现即视为子地点的关键词
+SUB_KEYWORDS = (
+    # --- Modern ---
+    "花园", "庭院", "别院", "小院", "园子", "公园", "植物园", "动物园", "游乐园",
+    "商场", "商城", "商厦", "市场", "集市", "商铺", "店铺", "超市", "便利店", "百货",
+    "房间", "卧室", "客房", "书房", "厨房", "餐厅", "卫生间", "浴室", "厕所", "洗手间", "淋浴间",
+    "大厅", "前厅", "后厅", "客厅", "饭厅", "走廊", "过道", "通道", "楼梯", "电梯",
+    "大楼", "写字楼", "办公楼", "教学楼", "实验楼", "宿舍楼", "住院部", "门诊部",
+    "小区", "社区", "别墅", "公寓", "宿舍", "客栈", "酒店", "饭店", "酒楼", "旅馆", "招待所",
+    "网吧", "酒吧", "咖啡", "茶馆", "电影院", "剧院", "体育馆", "健身房", "游泳池",
+    "地铁", "公交", "火车站", "机场", "航站楼", "候机", "候车", "停车场", "车库",
+    "内部", "里面", "之中", "地下室", "天台", "阳台",
+    # --- Ancient / Wuxia ---
+    "皇宫", "王府", "侯府", "官邸", "府邸", "私宅", "别苑",
+    "大门", "侧门", "后门", "山门", "城门",
+    "正殿", "偏殿", "主殿", "寝殿", "大殿", "议事厅", "聚义厅",
+    "书斋", "书库", "藏书", "经阁", "丹房", "器房", "兵器库", "库房", "仓库",
+    "牢房", "地牢", "水牢", "天牢", "刑房", "密室", "暗道", "地宫",
+    "客栈", "酒肆", "青楼", "画舫", "赌坊", "当铺", "钱庄", "镖局", "驿站",
+    "擂台", "校场", "演武", "练功",
+    # --- Xuanhuan / Fantasy ---
+    "洞府", "石室", "闭关", "修炼室",
+    "炼丹", "炼器", "制符", "阵法", "传送阵", "聚灵阵", "护山大阵",
+    "秘境入口", "禁地", "后山", "灵田", "药园", "兽栏",
+    "试炼塔", "通天塔", "藏经阁", "任务堂", "执法堂", "外门", "内门", "杂役处"
+)
+
+# 以这些结尾的多为城镇、山川、宗门等大地点（如 "天剑门" 是宗门而非大门）
+EXCLUSION_SUFFIXES = (
+    "城", "镇", "村", "国", "洲", "界", "大陆", "山", "河", "江", "湖", "海", "洋", "岛", "峰", "谷", "林", "原",
+    "宗", "派", "门", "帮", "教"
+)
+
+# 现实地名后缀（不含镇、乡、街、路、桥等武侠/玄幻里也常见的字，避免误判）
+REAL_PLACE_SUFFIXES = ("省", "市", "县", "区", "街道", "站", "机场", "港", "大学", "学院", "医院", "公园", "广场")
+
+# 歧义后缀：名称中出现这些词时，该后缀不算子地点信号
+_INSTITUTE_WORDS = ("书院", "学院", "研究院")
+_SQUARE_WORDS = ("广场", "市场", "操场")
+
+
+class SuffixTrie:
+    """按倒序字符建的字典树，一次从名称末尾向前走完即得到它匹配的全部后缀标签"""
+
+    def __init__(self):
+        self._root: Dict[str, dict] = {}
+
+    def add(self, suffix: str, tag: str) -> None:
+        node = self._root
+        for ch in reversed(suffix):
+            node = node.setdefault(ch, {})
+        node.setdefault(None, set()).add(tag)
+
+    def tags(self, name: str) -> Set[str]:
+        found: Set[str] = set()
+        node = self._root
+        for ch in reversed(name):
+            node = node.get(ch)
+            if node is None:
+                break
+            found.update(node.get(None, ()))
+        return found
+
+
+class NameRules:
+    """
+    单个名称的规则判定结果
+
+    Attributes:
+        sub_suffix: 以子地点后缀结尾（已排除 "天剑门"、"书院"、"战场" 这类歧义）
+        sub_keyword: 含子地点关键词
+        excluded: 以城镇、山川、宗门等排除后缀结尾
+        real: 以现实地名后缀结尾
+    """
+
+    __slots__ = ("sub_suffix", "sub_keyword", "excluded", "real")
+
+    def __init__(self, sub_suffix: bool, sub_keyword: bool, excluded: bool, real: bool):
+        self.sub_suffix = sub_suffix
+        self.sub_keyword = sub_keyword
+        self.excluded = excluded
+        self.real = real
+
+    @property
+    def sub_like(self) -> bool:
+        return self.sub_suffix or self.sub_keyword
+
+
+class RuleVerdict:
+    """
+    规则对一个地点 scope 的判断
+
+    Attributes:
+        scope: world / sub / poi，规则无从判断时为 None
+        confidence: 0~1，越高越可以不经 LLM 直接采用
+        reason: 命中的规则，便于调阈值时对照
+    """
+
+    __slots__ = ("scope", "confidence", "reason")
+
+    def __init__(self, scope: Optional[str], confidence: float, reason: str):
+        self.scope = scope
+        self.confidence = confidence
+        self.reason = reason
+
+
+# 各规则组合的置信度：kind 明确属于大单位/物品、名称同时命中子地点后缀与关键词最可靠；
+# 只有后缀（"台"、"池"）或只有 kind 次之；子地点信号与排除后缀冲突时最低
+RULE_CONFIDENCE = {
+    "world_kind": 0.95,
+    "poi_kind": 0.95,
+    "sub_name_and_kind": 0.95,
+    "sub_suffix_and_keyword": 0.95,
+    "sub_keyword": 0.9,
+    "excluded_suffix": 0.9,
+    "sub_suffix": 0.75,
+    "sub_kind": 0.7,
+    "conflict": 0.5,
+}
+
+
+class LocationRuleEngine:
+    def __init__(
+        self,
+        sub_kinds: Iterable[str] = SUB_KINDS,
+        sub_suffixes: Iterable[str] = SUB_SUFFIXES,
+        sub_keywords: Iterable[str] = SUB_KEYWORDS,
+        exclusion_suffixes: Iterable[str] = EXCLUSION_SUFFIXES,
+        real_suffixes: Iterable[str] = REAL_PLACE_SUFFIXES
+    ):
+        self.sub_kinds = frozenset(sub_kinds)
+        self._suffixes = SuffixTrie()
+        for s in sub_suffixes:
+            self._suffixes.add(s, "sub:" + s)
+        for s in exclusion_suffixes:
+            self._suffixes.add(s, "exclude")
+        for s in real_suffixes:
+            self._suffixes.add(s, "real")
+
+        self._keyword_set = frozenset(sub_keywords)
+        self._ambiguity = {w: "institute" for w in _INSTITUTE_WORDS}
+        self._ambiguity.update({w: "square" for w in _SQUARE_WORDS})
+        self._keywords = AhoCorasick(set(self._keyword_set) | set(self._ambiguity))
+        self.name_rules = functools.lru_cache(maxsize=65536)(self._name_rules)
+
+    def _name_rules(self, name: str) -> NameRules:
+        suffix_tags = self._suffixes.tags(name)
+        sub_keyword = False
+        found: Set[str] = set()
+        for _, _, word in self._keywords.iter_matches(name):
+            if word in self._keyword_set:
+                sub_keyword = True
+            tag = self._ambiguity.get(word)
+            if tag:
+                found.add(tag)
+
+        sub_suffix = False
+        for tag in suffix_tags:
+            if not tag.startswith("sub:"):
+                continue
+            s = tag[4:]
+            if s == "门" and len(name) > 2:
+                continue
+            if s == "院" and "institute" in found:
+                continue
+            if s == "场" and "square" not in found:
+                continue
+            sub_suffix = True
+            break
+        return NameRules(sub_suffix, sub_keyword, "exclude" in suffix_tags, "real" in suffix_tags)
+
+    def is_sub_kind(self, kind: Optional[str]) -> bool:
+        return (kind or "").strip().lower() in self.sub_kinds
+
+    def place_type(self, name: Optional[str]) -> Optional[str]:
+        """名称以现实地名后缀结尾时返回 "real"，否则 None"""
+        name = (name or "").strip()
+        if not name:
+            return None
+        return "real" if self.name_rules(name).real else None
+
+    def is_sub_location(self, loc: Dict[str, object]) -> bool:
+        """
+        父级兜底用的子地点判定：kind 属于子地点，或名称有子地点信号且不以排除后缀结尾
+        """
+        if self.is_sub_kind(loc.get("kind")):
+            return True
+        name = loc.get("id") or ""
+        if not name:
+            return False
+        rules = self.name_rules(name)
+        return rules.sub_like and not rules.excluded
+
+    def verdict(self, loc: Dict[str, object]) -> RuleVerdict:
+        """按 kind 与名称给出 scope 判断及其置信度（判断与 apply_scope 的规则一致）"""
+        kind = (loc.get("kind") or "").strip().lower()
+        name = (loc.get("id") or "").strip()
+        if kind in WORLD_KINDS:
+            return RuleVerdict("world", RULE_CONFIDENCE["world_kind"], "world_kind")
+        if kind in POI_KINDS:
+            return RuleVerdict("poi", RULE_CONFIDENCE["poi_kind"], "poi_kind")
+        sub_kind = kind in self.sub_kinds
+        rules = self.name_rules(name) if name else None
+        if rules is None or not (rules.sub_like or rules.excluded):
+            if sub_kind:
+                return RuleVerdict("sub", RULE_CONFIDENCE["sub_kind"], "sub_kind")
+            return RuleVerdict(None, 0.0, "none")
+        if rules.sub_like and rules.excluded:
+            return RuleVerdict("sub", RULE_CONFIDENCE["conflict"], "conflict")
+        if rules.excluded:
+            if sub_kind:
+                return RuleVerdict("sub", RULE_CONFIDENCE["conflict"], "conflict")
+            return RuleVerdict("world", RULE_CONFIDENCE["excluded_suffix"], "excluded_suffix")
+        if sub_kind:
+            reason = "sub_name_and_kind"
+        elif rules.sub_suffix and rules.sub_keyword:
+            reason = "sub_suffix_and_keyword"
+        else:
+            reason = "sub_keyword" if rules.sub_keyword else "sub_suffix"
+        return RuleVerdict("sub", RULE_CONFIDENCE[reason], reason)
+
+    def apply_scope(self, loc: Dict[str, object]) -> None:
+        """按 kind 与名称修正 scope（原地修改）"""
+        kind = (loc.get("kind") or "").strip().lower()
+        scope = (loc.get("scope") or "").strip().lower()
+        name = (loc.get("id") or "").strip()
+
+        # Rule 1: 子地点 kind 不应挂在世界地图上；物品类一律为 poi
+        if kind in self.sub_kinds and scope == "world":
+            loc["scope"] = "sub"
+        if kind in POI_KINDS:
+            loc["scope"] = "poi"
+
+        # Rule 2: 国家、大洲、海洋等大单位总是 world
+        if kind in WORLD_KINDS and scope != "world":
+            loc["scope"] = "world"
+
+        # Rule 3: 名称后缀/关键词；这里信任关键词，以排除后缀结尾也照样降为 sub
+        if name and scope == "world" and self.name_rules(name).sub_like:
+            loc["scope"] = "sub"
+
+
+class AgreementReport:
+    """
+    规则判断与 LLM 标注的一致率，按置信度分档累计，用于调整跳过 LLM 的阈值
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Dict[str, int]] = {}
+        self._disagreements: Dict[str, int] = {}
+
+    def record(self, verdict: RuleVerdict, llm_scope: Optional[str]) -> None:
+        llm_scope = (llm_scope or "").strip().lower()
+        if verdict.scope is None or not llm_scope:
+            return
+        key = f"{verdict.confidence:.2f}"
+        with self._lock:
+            bucket = self._buckets.setdefault(key, {"total": 0, "agree": 0})
+            bucket["total"] += 1
+            if verdict.scope == llm_scope:
+                bucket["agree"] += 1
+            else:
+                pair = f"{verdict.reason}:{verdict.scope}->{llm_scope}"
+                self._disagreements[pair] = self._disagreements.get(pair, 0) + 1
+
+    def merge(self, other: "AgreementReport") -> None:
+        with other._lock:
+            buckets = {k: dict(v) for k, v in other._buckets.items()}
+            disagreements = dict(other._disagreements)
+        with self._lock:
+            for key, b in buckets.items():
+                mine = self._buckets.setdefault(key, {"total": 0, "agree": 0})
+                mine["total"] += b["total"]
+                mine["agree"] += b["agree"]
+            for pair, n in disagreements.items():
+                self._disagreements[pair] = self._disagreements.get(pair, 0) + n
+
+    def to_dict(self) -> Dict[str, object]:
+        with self._lock:
+            buckets = {
+                key: dict(b, rate=round(b["agree"] / b["total"], 4))
+                for key, b in sorted(self._buckets.items(), reverse=True)
+            }
+            return {"buckets": buckets, "disagreements": dict(self._disagreements)}
+
+
+LOCATION_RULES = LocationRuleEngine()
+
+# 进程内累计的一致率（各会话结束分类后并入）
+RULE_AGREEMENT = AgreementReport()
+
+
+def rule_agreement_stats() -> Dict[str, object]:
+    return RULE_AGREEMENT.to_dict()
+
@@ -0,0 +1,74 @@
+"""
+虚构地图构建共用的邻接结构
+轨迹片段只遍历一次，得到整数 id 的片段表、度数与邻居；
+关系/路线边与事件按层级分组一次，世界地图与各子地图直接取各自的分组
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# 世界地图的分组键（地点 id 不会是空串）
+WORLD_GROUP = ""
+
+
+class MapGraph:
+    """
+    Args:
+        location_ids: 参与本次地图构建的全部地点
+    """
+
+    def __init__(self, location_ids: Iterable[str]):
+        self.ids: List[str] = list(dict.fromkeys(location_ids))
+        self.index: Dict[str, int] = {lid: i for i, lid in enumerate(self.ids)}
+        self.degree: List[int] = [0] * len(self.ids)
+        self.adjacency: List[Set[int]] = [set() for _ in self.ids]
+        # (起点, 终点, 人物, 证据)，只收两端都已知且不同的片段，保持轨迹原顺序
+        self.segments: List[Tuple[int, int, Optional[str], str]] = []
+
+    def add_tracks(self, tracks: List[Dict[str, Any]]) -> None:
+        index = self.index
+        for track in tracks:
+            character = track.get("character")
+            for seg in track.get("segments") or []:
+                a = index.get(seg.get("from_location"))
+                b = index.get(seg.get("to_location"))
+                if a is None or b is None or a == b:
+                    continue
+                self.segments.append((a, b, character, seg.get("evidence") or ""))
+                self.degree[a] += 1
+                self.degree[b] += 1
+                self.adjacency[a].add(b)
+                self.adjacency[b].add(a)
+
+    def degree_of(self, lid: str) -> int:
+        i = self.index.get(lid)
+        return self.degree[i] if i is not None else 0
+
+    def neighbors(self, lid: str) -> List[str]:
+        i = self.index.get(lid)
+        if i is None:
+            return []
+        return [self.ids[j] for j in self.adjacency[i]]
+
+    def route_edges(self, keep: Set[str]) -> List[Dict[str, Any]]:
+        """两端都在 keep 内的轨迹片段，作为 route_to 边"""
+        ids = self.ids
+        edges = []
+        for a, b, _, evidence in self.segments:
+            if ids[a] in keep and ids[b] in keep:
+                edges.append({"a": ids[a], "b": ids[b], "type": "route_to", "evidence": evidence})
+        return edges
+
+    def iter_segments(self) -> Iterable[Tuple[str, str, Optional[str]]]:
+        ids = self.ids
+        for a, b, character, _ in self.segments:
+            yield ids[a], ids[b], character
+
+    @staticmethod
+    def group_edges(edges: List[Dict[str, Any]], group_of: Dict[str, str]) -> Dict[str, List[Dict[str, Any]]]:
+        """两端属于同一分组的边按分组归类（一次遍历，组内保持原顺序）"""
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for e in edges:
+            g = group_of.get(e["a"])
+            if g is not None and g == group_of.get(e["b"]):
+                grouped.setdefault(g, []).append(e)
+        return grouped
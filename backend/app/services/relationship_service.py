@@ -4,15 +4,18 @@
 """
 
 import threading
-import concurrent.futures
 import json
 import uuid
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 from datetime import datetime
 
+from ..utils.deadline import Deadline, DeadlineExceeded, resolve_deadline
 from ..utils.llm_client import LLMClient
 from ..utils.logger import get_logger
+from ..utils.retry import RetryableAPIClient, RetryBudget
+from ..utils.chunker import TextChunker
+from ..utils.text_view import TextView, normalize_text
 from .relationship_agents import get_extractor_prompt, get_aggregator_prompt
 
 logger = get_logger('silverfish.relationship_service')
@@ -25,58 +28,15 @@ class RelationshipService:
         # 简单的内存存储，生产环境应使用 Redis
         self.sessions: Dict[str, Dict[str, Any]] = {}
         
-    def _chunk_text(self, text: str, chunk_size: int = 2000, overlap: int = 400) -> List[str]:
+    def _chunk_text(self, text: Union[str, TextView], chunk_size: int = 2000, overlap: int = 400) -> List[TextView]:
         """
         参考“参商”优化的文本分块策略
         1. 寻找句子结束符
         2. 减小 chunk_size 以提升单次提取的召回率（对标“参商”的 1500-2000 字）
         3. 增加重叠以保持上下文连贯
-        4. 优化查找效率，避免重复切片
+        分块逻辑与 TraceService 共用 utils.chunker
         """
-        if len(text) <= chunk_size:
-            return [text] if text.strip() else []
-
-        chunks = []
-        start = 0
-        text_len = len(text)
-        
-        separators = ['\n\n', '。', '！', '？', '.\n', '!\n', '?\n', '. ', '! ', '? ']
-        
-        while start < text_len:
-            end = start + chunk_size
-            
-            # 尝试在句子边界处分割
-            if end < text_len:
-                # 优化：限制搜索范围，只在最后 50% 区域查找，且倒序查找
-                # 使用 rfind 查找最近的句子结束符
-                search_text = text[start:end]
-                found_sep = False
-                
-                # 优先查找段落分隔符
-                last_sep = search_text.rfind('\n\n')
-                if last_sep != -1 and last_sep > chunk_size * 0.5:
-                     end = start + last_sep + 2
-                     found_sep = True
-                else:
-                    # 其次查找句子分隔符
-                    for sep in separators[1:]:
-                        last_sep = search_text.rfind(sep)
-                        if last_sep != -1 and last_sep > chunk_size * 0.5:
-                            end = start + last_sep + len(sep)
-                            found_sep = True
-                            break
-            
-            chunk = text[start:end].strip()
-            # 过滤过短的垃圾块（如仅包含页码或空字符）
-            if chunk and len(chunk) > 10:
-                chunks.append(chunk)
-            
-            # 下一个块从重叠位置开始
-            if end >= text_len:
-                break
-            start = end - overlap
-            
-        return chunks
+        return TextChunker(chunk_size=chunk_size, overlap=overlap).chunk(text)
 
     def _normalize_result(self, data: Dict[str, Any]) -> Dict[str, Any]:
         if not data:
@@ -177,23 +137,33 @@ class RelationshipService:
         预处理文本
         - 移除多余空白
         - 标准化换行
+        单遍完成，避免多次整本拷贝
         """
-        import re
-        # 标准化换行
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        # 移除连续空行（保留最多两个换行）
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        # 移除行首行尾空白
-        lines = [line.strip() for line in text.split('\n')]
-        return '\n'.join(lines).strip()
-
-    def analyze_text(self, text: str, session_id: Optional[str] = None, run_async: bool = True) -> Dict[str, Any]:
+        return normalize_text(text)
+
+    def analyze_text(
+        self,
+        text: str,
+        session_id: Optional[str] = None,
+        run_async: bool = True,
+        deadline_seconds: Optional[float] = None,
+        tier: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         启动文本分析任务
+        截止时间默认取 RELATION_DEADLINE（秒，0 为不限时），从此刻起算，到期时返回已完成部分的结果
         """
         logger.info(f"收到分析请求，文本长度: {len(text)}")
+        try:
+            deadline = resolve_deadline(deadline_seconds, tier, env="RELATION_DEADLINE")
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+
         if not session_id:
             session_id = f"rel_{uuid.uuid4().hex[:12]}"
+
+        # 0. 预处理（在后台线程启动前完成，原始文本可随请求释放）
+        text = self.preprocess_text(text)
             
         # 初始化会话
         self.sessions[session_id] = {
@@ -201,6 +171,8 @@ class RelationshipService:
             "status_msg": "正在解析文本...",
             "progress": 0,
             "created_at": datetime.now().isoformat(),
+            "deadline": deadline,
+            "partial": False,
             "result": None,
             "error": None
         }
@@ -215,6 +187,7 @@ class RelationshipService:
         return {
             "success": True,
             "session_id": session_id,
+            "deadline_seconds": deadline.seconds,
             "status_url": f"/api/fortune/status/{session_id}"  # 保持 API 路径一致性，或稍后修改路由
         }
 
@@ -743,8 +716,12 @@ class RelationshipService:
             "relationships": final_relationships
         }
 
-    def _single_pass_aggregate(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """单次聚合：调用 LLM 合并结果"""
+    def _single_pass_aggregate(
+        self,
+        results: List[Dict[str, Any]],
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """单次聚合：调用 LLM 合并结果；请求失败时抛出异常，由批执行器重试或兜底"""
         if not results:
             return {"entities": [], "relationships": []}
         if len(results) == 1:
@@ -765,15 +742,66 @@ class RelationshipService:
             {"role": "user", "content": f"请合并以下提取结果：\n{combined_input}"}
         ]
         
+        # 重试交给批执行器调度，不在工作线程里睡眠
+        return self.llm.chat_json(messages, temperature=0.1, use_boost=True, max_retries=0, deadline=deadline)
+
+    def _aggregate_fallback(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """聚合失败时的保底：返回第一个非空结果，避免崩溃"""
+        results = [self._compact_result(r) for r in results if r]
+        results = [r for r in results if r.get('entities') or r.get('relationships')]
+        return results[0] if results else {}
+
+    def _aggregate_batches(
+        self,
+        batches: List[List[Dict[str, Any]]],
+        session_id: Optional[str] = None,
+        level: int = 0,
+        deadline: Optional[Deadline] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        并发聚合多个批次，按批次下标返回非空结果；重试耗尽的批次用保底结果，
+        截止时间到了的批次改用代码快速合并，不丢已提取的内容
+        """
+        # 降低并发数，避免 API 速率限制
+        max_workers_env = os.getenv("RELATION_AGG_MAX_WORKERS")
         try:
-            return self.llm.chat_json(messages, temperature=0.1, use_boost=True)
-        except Exception as e:
-            logger.error(f"Aggregation failed: {e}")
-            # 如果聚合失败，返回第一个结果作为保底，避免崩溃
-            return results[0] if results else {}
+            max_workers = int(max_workers_env) if max_workers_env else 5
+        except ValueError:
+            max_workers = 5
+
+        completed_batches = 0
+        # 按批次下标收集，保证下一轮的输入顺序与完成先后无关
+        results_by_batch: Dict[int, Dict[str, Any]] = {}
+        for index, res, error in RetryableAPIClient(max_retries=1).iter_batch(
+            batches, lambda batch: self._single_pass_aggregate(batch, deadline), max_workers=max(1, max_workers),
+            deadline=deadline
+        ):
+            if isinstance(error, DeadlineExceeded):
+                self._mark_partial(session_id)
+                res = self._fast_merge_results(batches[index])
+            elif error is not None:
+                logger.error(f"Aggregation failed: {error}")
+                res = self._aggregate_fallback(batches[index])
+            if res and (res.get('entities') or res.get('relationships')):
+                results_by_batch[index] = res
+
+            completed_batches += 1
+            if session_id and session_id in self.sessions and len(batches) > 1:
+                self.sessions[session_id]["status_msg"] = f"第 {level + 1} 轮聚合中: 已完成 {completed_batches}/{len(batches)} 批次..."
+        return [results_by_batch[i] for i in sorted(results_by_batch)]
+
+    def _mark_partial(self, session_id: Optional[str]) -> None:
+        if session_id and session_id in self.sessions:
+            self.sessions[session_id]["partial"] = True
 
-    def _recursive_aggregate(self, results: List[Dict[str, Any]], session_id: Optional[str] = None, level: int = 0) -> Dict[str, Any]:
-        """递归分层聚合"""
+    def _recursive_aggregate(
+        self,
+        results: List[Dict[str, Any]],
+        session_id: Optional[str] = None,
+        level: int = 0,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """递归分层聚合；截止时间已到时剩余各层都改用代码快速合并"""
         if not results:
             return {"entities": [], "relationships": []}
 
@@ -784,6 +812,10 @@ class RelationshipService:
             return {"entities": [], "relationships": []}
         if len(results) == 1:
             return results[0]
+        if deadline is not None and deadline.expired():
+            logger.warning(f"Session {session_id}: deadline reached at aggregation level {level}, merging {len(results)} items without LLM")
+            self._mark_partial(session_id)
+            return self._fast_merge_results(results)
             
         # 进度反馈
         if session_id and session_id in self.sessions:
@@ -818,7 +850,8 @@ class RelationshipService:
         # 降低阈值以确保 LLM 不会因为输入过长而忽略细节
         if total_chars < 80000 and len(results) <= 8:
             logger.info(f"Level {level} aggregation: {len(results)} items, {total_chars} chars -> Direct LLM Aggregate")
-            return self._single_pass_aggregate(results)
+            aggregated = self._aggregate_batches([results], session_id, level, deadline)
+            return aggregated[0] if aggregated else {"entities": [], "relationships": []}
             
         # 否则，分批处理
         # 增大 batch_size，减少递归深度，防止在每一层都丢失细节
@@ -826,40 +859,15 @@ class RelationshipService:
         batches = [results[i:i + batch_size] for i in range(0, len(results), batch_size)]
         logger.info(f"Level {level} aggregation: {len(results)} items -> {len(batches)} batches (size {batch_size})")
         
-        intermediate_results = []
-        completed_batches = 0
-        
         # 并行执行中间聚合
-        # 降低并发数，避免 API 速率限制
-        max_workers_env = os.getenv("RELATION_AGG_MAX_WORKERS")
-        try:
-            max_workers = int(max_workers_env) if max_workers_env else 5
-        except ValueError:
-            max_workers = 5
-            
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(self._single_pass_aggregate, batch) for batch in batches]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    res = future.result()
-                    if res and (res.get('entities') or res.get('relationships')):
-                        intermediate_results.append(res)
-                except Exception as e:
-                    logger.error(f"Intermediate aggregation failed: {e}")
-                
-                completed_batches += 1
-                if session_id and session_id in self.sessions:
-                    self.sessions[session_id]["status_msg"] = f"第 {level + 1} 轮聚合中: 已完成 {completed_batches}/{len(batches)} 批次..."
+        intermediate_results = self._aggregate_batches(batches, session_id, level, deadline)
         
         # 递归下一层
-        return self._recursive_aggregate(intermediate_results, session_id, level + 1)
+        return self._recursive_aggregate(intermediate_results, session_id, level + 1, deadline)
 
     def _run_analysis(self, session_id: str, text: str):
         """后台执行分析逻辑"""
         try:
-            # 0. 预处理
-            text = self.preprocess_text(text)
-            
             # 并行提取
             # 进一步降低 chunk_size 以获取极致的召回率
             chunk_size_env = os.getenv("RELATION_CHUNK_SIZE")
@@ -882,18 +890,24 @@ class RelationshipService:
             if total_chunks == 0:
                 raise ValueError("文本内容为空或无法分割")
 
-            extracted_results = []
             completed_chunks = 0
+            # 提取阶段提前到期，给聚合留出时间
+            deadline = self.sessions[session_id].get("deadline") or Deadline()
+            reserve = min(max(self._env_float("RELATION_DEADLINE_RESERVE", 0.2), 0.0), 0.9)
+            extraction_deadline = deadline.reserve(deadline.seconds * reserve) if deadline.seconds else deadline
             
             # 2. 并行提取
-            def process_chunk(index, chunk_text):
+            def process_chunk(index, chunk):
+                chunk_text = chunk.text
                 prompt = get_extractor_prompt()
                 messages = [
                     {"role": "system", "content": prompt},
                     {"role": "user", "content": f"请深度分析以下文本片段（片段 {index+1}/{total_chunks}），不放过任何一个有名字的人物：\n\n{chunk_text}"}
                 ]
-                # 使用 boost 模型加速并行提取，并设置超时保护
-                return self.llm.chat_json(messages, temperature=0.1, use_boost=True)
+                # 使用 boost 模型加速并行提取；重试交给批执行器调度
+                return self.llm.chat_json(
+                    messages, temperature=0.1, use_boost=True, max_retries=0, deadline=extraction_deadline
+                )
 
             # 并行提取
             # 动态调整并发数：
@@ -921,30 +935,39 @@ class RelationshipService:
             
             logger.info(f"Session {session_id}: Starting parallel extraction with {max_workers} workers for {total_chunks} chunks")
 
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {executor.submit(process_chunk, i, chunk): i for i, chunk in enumerate(chunks)}
-                
-                for future in concurrent.futures.as_completed(futures):
-                    index = futures.get(future)
-                    try:
-                        result = future.result()
-                        normalized = self._normalize_result(result)
-                        if normalized.get('entities') or normalized.get('relationships'):
-                            extracted_results.append(normalized)
-                        
-                        completed_chunks += 1
-                        # 确保进度能稳步推进，即使卡在提取阶段也能看到变化
-                        progress = min(int((completed_chunks / total_chunks) * 90), 89)
-                        self.sessions[session_id]["progress"] = progress
-                        self.sessions[session_id]["status_msg"] = f"正在提取关系: 已完成 {completed_chunks}/{total_chunks} 个片段..."
-                        
-                        # 每完成 5 个片段打印一次日志
-                        if completed_chunks % 5 == 0:
-                            logger.info(f"Session {session_id}: Progress {progress}%, {completed_chunks}/{total_chunks} chunks")
-                    except Exception as e:
-                        logger.error(f"Chunk {index} processing failed: {e}")
-                        # 即使失败也增加计数，防止进度条卡死
-                        completed_chunks += 1
+            # 失败的片段排到新片段之后重试，不在工作线程里睡眠等待
+            results_by_index: Dict[int, Dict[str, Any]] = {}
+            deadline_skipped = 0
+            for index, result, error in RetryableAPIClient(max_retries=3).iter_batch(
+                list(enumerate(chunks)), lambda item: process_chunk(*item), max_workers=max_workers,
+                budget=RetryBudget(), deadline=extraction_deadline
+            ):
+                completed_chunks += 1
+                if isinstance(error, DeadlineExceeded):
+                    deadline_skipped += 1
+                    continue
+                if error is not None:
+                    logger.error(f"Chunk {index} processing failed: {error}")
+                    continue
+                normalized = self._normalize_result(result)
+                if normalized.get('entities') or normalized.get('relationships'):
+                    results_by_index[index] = normalized
+
+                # 确保进度能稳步推进，即使卡在提取阶段也能看到变化
+                progress = min(int((completed_chunks / total_chunks) * 90), 89)
+                self.sessions[session_id]["progress"] = progress
+                self.sessions[session_id]["status_msg"] = f"正在提取关系: 已完成 {completed_chunks}/{total_chunks} 个片段..."
+
+                # 每完成 5 个片段打印一次日志
+                if completed_chunks % 5 == 0:
+                    logger.info(f"Session {session_id}: Progress {progress}%, {completed_chunks}/{total_chunks} chunks")
+            extracted_results = [results_by_index[i] for i in sorted(results_by_index)]
+            if deadline_skipped:
+                self._mark_partial(session_id)
+                logger.warning(
+                    f"Session {session_id}: deadline reached, {deadline_skipped}/{total_chunks} chunks "
+                    f"not extracted, continuing with partial results"
+                )
             
             if not extracted_results:
                 raise Exception("未能从文本中提取出有效信息")
@@ -955,7 +978,7 @@ class RelationshipService:
             self.sessions[session_id]["progress"] = 90
             
             # 使用新的递归聚合替代旧的单次聚合
-            final_result = self._recursive_aggregate(extracted_results, session_id)
+            final_result = self._recursive_aggregate(extracted_results, session_id, deadline=deadline)
             final_result = self._normalize_result(final_result)
             
             # 3.5 后处理：确保角色完整性
@@ -963,10 +986,12 @@ class RelationshipService:
             
             # 4. 完成
             final_result["overview"] = self._build_overview(final_result)
+            final_result["partial"] = self.sessions[session_id]["partial"]
+            final_result["deadline"] = deadline.stats()
             self.sessions[session_id]["result"] = final_result
             self.sessions[session_id]["status"] = "completed"
             self.sessions[session_id]["progress"] = 100
-            self.sessions[session_id]["status_msg"] = "梳理完成"
+            self.sessions[session_id]["status_msg"] = "梳理完成（已到截止时间，结果不完整）" if final_result["partial"] else "梳理完成"
             
         except Exception as e:
             logger.error(f"Analysis failed for session {session_id}: {str(e)}")
@@ -974,6 +999,13 @@ class RelationshipService:
             self.sessions[session_id]["error"] = str(e)
             self.sessions[session_id]["status_msg"] = "分析过程中发生错误"
 
+    def _env_float(self, name: str, default: float) -> float:
+        try:
+            value = os.getenv(name)
+            return float(value) if value else default
+        except Exception:
+            return default
+
     def get_session_status(self, session_id: str) -> Dict[str, Any]:
         """查询任务状态"""
         session = self.sessions.get(session_id)
@@ -0,0 +1,138 @@
+"""
+追迹已知实体词典
+把前几波提取、合并后的地点与人物编成短编号（L1/C1），注入后续片段的提取 Prompt，
+模型对已知实体只需引用编号，不再重复生成描述、别名与证据
+"""
+
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from .trace_signals import KnownNameIndex
+
+
+class EntityDictionary:
+    """
+    已规范化的地点、人物及其短编号
+
+    Args:
+        locations: 合并后的地点（含 id / aliases / place_type）
+        characters: 人物名，按重要程度排列
+    """
+
+    def __init__(self, locations: List[Dict[str, Any]], characters: List[str]):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._sid_by_name: Dict[str, str] = {}
+        self._index = KnownNameIndex()
+
+        for i, loc in enumerate(sorted(locations, key=lambda l: l.get("id") or ""), start=1):
+            sid = f"L{i}"
+            aliases = [a for a in (loc.get("aliases") or []) if a and a != loc.get("id")]
+            self.entries[sid] = {"name": loc["id"], "aliases": aliases, "place_type": loc.get("place_type") or "uncertain"}
+            for name in [loc["id"]] + aliases:
+                self._sid_by_name.setdefault(name, sid)
+        for i, name in enumerate(characters, start=1):
+            sid = f"C{i}"
+            self.entries[sid] = {"name": name}
+            self._sid_by_name.setdefault(name, sid)
+        self._index.add(self._sid_by_name.keys())
+
+    @classmethod
+    def build(
+        cls,
+        merged_locations: List[Dict[str, Any]],
+        results: List[Dict[str, Any]],
+        max_characters: int = 300
+    ) -> "EntityDictionary":
+        counts: Counter = Counter()
+        for r in results:
+            for evt in r.get("events") or []:
+                counts.update(c for c in evt.get("characters") or [] if c)
+        characters = [name for name, _ in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:max_characters]]
+        return cls([l for l in merged_locations if l.get("id")], characters)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def for_chunk(self, text: str) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+        """
+        只挑出在本片段中出现过的实体
+
+        Returns:
+            (注入 Prompt 的词典文本, {编号: 实体})；片段中没有已知实体时文本为空
+        """
+        sids = {self._sid_by_name[name] for name in self._index.find_in(text)}
+        if not sids:
+            return "", {}
+        refs = {sid: self.entries[sid] for sid in sorted(sids, key=lambda s: (s[0] != "L", int(s[1:])))}
+
+        loc_parts: List[str] = []
+        char_parts: List[str] = []
+        for sid, entry in refs.items():
+            if sid.startswith("L"):
+                alias_text = f"（{'、'.join(entry['aliases'][:3])}）" if entry["aliases"] else ""
+                loc_parts.append(f"{sid} {entry['name']}{alias_text}")
+            else:
+                char_parts.append(f"{sid} {entry['name']}")
+
+        lines = ["已知实体（前文已提取）："]
+        if loc_parts:
+            lines.append("地点：" + "；".join(loc_parts))
+        if char_parts:
+            lines.append("人物：" + "；".join(char_parts))
+        lines.append(
+            '对已知地点，locations 中只需输出 {"ref": "编号"}（发现新别名时可附 aliases）；'
+            "events 的 location 与 characters 可直接填写编号。新地点、新人物照常输出完整记录。"
+        )
+        return "\n".join(lines) + "\n\n", refs
+
+
+def expand_entity_refs(raw: Any, refs: Dict[str, Dict[str, Any]]) -> int:
+    """
+    把模型返回中的实体编号还原为名称（原地修改）
+
+    Returns:
+        还原的引用数
+    """
+    if not refs or not isinstance(raw, dict):
+        return 0
+    expanded = 0
+
+    def resolve(value: Any) -> Any:
+        nonlocal expanded
+        if isinstance(value, str) and value.strip() in refs:
+            expanded += 1
+            return refs[value.strip()]["name"]
+        return value
+
+    locations = raw.get("locations")
+    if isinstance(locations, list):
+        for i, loc in enumerate(locations):
+            if not isinstance(loc, dict):
+                continue
+            # 模型偶尔把编号包成列表等非字符串，当作普通记录保留，不能让整段结果作废
+            sid = next(
+                (v.strip() for v in (loc.get("ref"), loc.get("id")) if isinstance(v, str) and v.strip() in refs),
+                None
+            )
+            if sid is None:
+                continue
+            expanded += 1
+            entry = refs[sid]
+            locations[i] = {
+                "id": entry["name"],
+                "aliases": loc.get("aliases") or [],
+                "place_type": entry.get("place_type") or "uncertain",
+                "description": "",
+                "evidence": ""
+            }
+
+    events = raw.get("events")
+    if isinstance(events, list):
+        for evt in events:
+            if not isinstance(evt, dict):
+                continue
+            evt["location"] = resolve(evt.get("location"))
+            chars = evt.get("characters")
+            if isinstance(chars, list):
+                evt["characters"] = [resolve(c) for c in chars]
+    return expanded
@@ -3,7 +3,9 @@
 负责文本分块、并行提取、结果聚合与轨迹生成
 """
 
-import concurrent.futures
+import bisect
+import copy
+import hashlib
 import json
 import math
 import os
@@ -11,25 +13,69 @@ import random
 import re
 import threading
 import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import networkx as nx
 from networkx.algorithms import community
 
 from ..utils.llm_client import LLMClient
+from ..utils.retry import RetryableAPIClient, RetryBudget
+from ..utils.deadline import Deadline, DeadlineExceeded, resolve_deadline
+from ..utils.batch_client import BatchClient, BatchTimeout
+from ..utils.json_repair import parse_json
+from ..utils.json_cache import JsonFileCache
 from ..utils.logger import get_logger
 from ..utils.geocoder import NominatimGeocoder
+from ..utils.aho_corasick import AhoCorasick
+from ..utils.chunker import BoundaryIndex, TextChunker, chunk_digest
+from ..utils.dedup import DuplicateDetector
+from ..utils.text_view import TextView, normalize_text
+from .trace_signals import (
+    CHARACTER_PATTERN,
+    CHARACTER_STOPWORDS,
+    FICTIONAL_LOCATION_PATTERN,
+    REAL_LOCATION_PATTERN,
+    LocationSignalScorer,
+    prefilter_report,
+    select_focus_windows,
+    validate_extraction,
+)
+from .trace_entities import EntityDictionary, expand_entity_refs
+from .location_cooccurrence import CooccurrenceMatrix, group_by_neighborhood
+from .hierarchy import HierarchyResolver
+from .map_graph import MapGraph, WORLD_GROUP
+from .location_rules import LOCATION_RULES, RULE_AGREEMENT, AgreementReport
 from .trace_agents import get_trace_extractor_prompt, get_trace_aggregator_prompt, get_fictional_relation_prompt
 
 logger = get_logger('footprints.trace_service')
 
 
+# 父级证据模式的得分：名称包含（Rule A）与文中的位置/归属表述（Rule B）
+_PARENT_EVIDENCE_SCORES = {
+    "contains": 20,
+    "located": 15,
+    "belongs": 15,
+    "possessive": 10,
+    "located_inside": 15,
+    "in_interior": 15,
+    "inside": 8
+}
+
+
 class TraceService:
-    def __init__(self, llm_client: Optional[LLMClient] = None):
+    def __init__(self, llm_client: Optional[LLMClient] = None, batch_client: Optional[BatchClient] = None):
         self.llm = llm_client or LLMClient()
+        self._batch_client = batch_client
         self.sessions: Dict[str, Dict[str, Any]] = {}
         self._geocoder: Optional[NominatimGeocoder] = None
+        # 已上传文档（规范化文本 + 章节目录），按最近使用淘汰
+        self.documents: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 片段提取结果缓存：(模式, 章节标题, 内容哈希) -> 规范化后的提取结果
+        self._chunk_cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._classification_cache: Optional[JsonFileCache] = None
 
     def _get_geocoder(self) -> Optional[NominatimGeocoder]:
         disable = (os.getenv("GEOCODE_DISABLE") or "").strip().lower() in {"1", "true", "yes"}
@@ -44,13 +90,7 @@ class TraceService:
         return self._geocoder
 
     def _heuristic_place_type(self, name: str) -> Optional[str]:
-        name = (name or '').strip()
-        if not name:
-            return None
-        # Removed common wuxia/fantasy suffixes like 镇, 乡, 街, 路, 桥 to avoid false positives
-        if re.search(r'(省|市|县|区|街道|站|机场|港|大学|学院|医院|公园|广场)$', name):
-            return "real"
-        return None
+        return LOCATION_RULES.place_type(name)
 
     def _geocode_locations(self, locations: List[Dict[str, Any]], session_id: Optional[str] = None) -> None:
         geocoder = self._get_geocoder()
@@ -71,47 +111,44 @@ class TraceService:
         if total == 0:
             return
 
+        deadline = self._session_deadline(session_id)
         for idx, loc in enumerate(targets, start=1):
+            remaining = deadline.remaining() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                # 截止时间已到：未定位的地点保留原样，不再等待外部服务
+                logger.warning(f"Session {session_id}: deadline reached, skipped geocoding {total - idx + 1}/{total} locations")
+                self.sessions[session_id]["stats"]["geocode_skipped"] = total - idx + 1
+                break
             if session_id and session_id in self.sessions:
                 self.sessions[session_id]["status_msg"] = f"正在定位现实地名: {idx}/{total}..."
                 self.sessions[session_id]["progress"] = 90 + min(int((idx / total) * 5), 5)
 
             name = loc.get("id") or ""
-            geo = geocoder.geocode(name)
+            geo = geocoder.geocode(name, timeout=15.0 if remaining is None else min(15.0, remaining))
             if geo:
                 loc["geo"] = geo
                 if loc.get("place_type") == "uncertain":
                     loc["place_type"] = "real"
 
-    def _compute_location_context(self, locations: List[Dict[str, Any]], extracted_results: List[Dict[str, Any]], alias_to_id: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
-        context: Dict[str, Dict[str, Any]] = {}
-        for loc in locations:
-            context[loc["id"]] = {"related": set(), "chars": set()}
-
-        for res in extracted_results:
-            events = res.get("events") or []
-            chunk_locs = set()
-            
-            # Resolve locations in this chunk
-            for evt in events:
-                raw = evt.get("location")
-                lid = alias_to_id.get(raw, raw)
-                if lid and lid in context:
-                    chunk_locs.add(lid)
-                    for c in (evt.get("characters") or []):
-                        if c:
-                            context[lid]["chars"].add(c)
-            
-            # Add co-occurrences
-            for lid in chunk_locs:
-                for other in chunk_locs:
-                    if lid != other:
-                        context[lid]["related"].add(other)
+    def _compute_location_context(
+        self,
+        locations: List[Dict[str, Any]],
+        extracted_results: List[Dict[str, Any]],
+        alias_to_id: Dict[str, str],
+        cooccurrence: Optional[CooccurrenceMatrix] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        每个地点按共现权重取前 6 个相关地点、按同场次数取前 4 个常见人物
+        传入已建好的共现矩阵时直接复用
+        """
+        if cooccurrence is None:
+            cooccurrence = CooccurrenceMatrix.build((l["id"] for l in locations), extracted_results, alias_to_id)
 
         final_context = {}
-        for lid, data in context.items():
-            related = sorted(list(data["related"]))[:6]
-            chars = sorted(list(data["chars"]))[:4]
+        for loc in locations:
+            lid = loc["id"]
+            related = [other for other, _ in cooccurrence.neighbors(lid, 6)]
+            chars = cooccurrence.top_characters(lid, 4)
             if related or chars:
                 final_context[lid] = {
                     "related_locations": related,
@@ -120,179 +157,80 @@ class TraceService:
         return final_context
 
     def _enforce_scope_rules(self, loc: Dict[str, Any]) -> None:
-        kind = (loc.get("kind") or "").strip().lower()
-        scope = (loc.get("scope") or "").strip().lower()
-        name = (loc.get("id") or "").strip()
-        
-        # Rule 1: Exhaustive list of Sub-location Kinds
-        sub_kinds = {
-            # Basic & Residential
-            "room", "hall", "courtyard", "corridor", "path", "gate", "wall", "floor", "window", 
-            "kitchen", "bedroom", "bathroom", "toilet", "restroom", "stairs", "elevator", 
-            "balcony", "terrace", "lobby", "reception", "pantry", "basement", "attic", 
-            "apartment", "dormitory", "studio", "suite",
-            
-            # Commercial & Entertainment (Modern)
-            "mall", "market", "shop", "store", "supermarket", "convenience_store",
-            "restaurant", "cafe", "bar", "pub", "club", "karaoke", "cinema", "theater", "gym",
-            "hotel", "inn", "motel", "hostel", "resort", "spa", "casino",
-            
-            # Office & Institutional (Modern)
-            "office", "meeting_room", "conference_room", "workspace", "cubicle",
-            "classroom", "library", "laboratory", "auditorium", "cafeteria", "canteen",
-            "hospital", "clinic", "ward", "surgery", "pharmacy", "police_station", "fire_station",
-            "post_office", "bank", "museum", "gallery",
-            
-            # Transport & Infrastructure (Modern)
-            "station", "stop", "platform", "dock", "pier", "wharf", "airport", "terminal",
-            "parking", "garage", "tunnel", "bridge", "factory", "warehouse", "plant", "workshop",
-            
-            # Ancient & Fantasy
-            "palace", "temple", "shrine", "altar", "pagoda", "tower", "pavilion", "gazebo",
-            "cave", "grotto", "dungeon", "cell", "prison", "jail", "crypt", "tomb", "grave",
-            "arena", "stadium", "ring", "field", "formation", "array",
-            "sect_gate", "main_hall", "side_hall", "scripture_library", "pill_room", "weapon_room",
-            "secret_chamber", "treasure_room", "spirit_field", "medicine_garden",
-            
-            # Objects/Vehicles (treated as POI/Sub)
-            "vehicle", "car", "bus", "train", "plane", "ship", "boat", "carriage", "sedan_chair",
-            "tent", "camp", "cabin"
-        }
-        
-        if kind in sub_kinds:
-            if scope == "world":
-                loc["scope"] = "sub"
-        
-        if kind in {"item", "furniture", "decoration", "device", "weapon", "tool"}:
-            loc["scope"] = "poi"
-            
-        # Rule 2: Large administrative/geographical units are typically WORLD
-        if kind in {"country", "state", "province", "continent", "ocean", "planet", "galaxy", "universe"}:
-            if scope != "world":
-                loc["scope"] = "world"
+        LOCATION_RULES.apply_scope(loc)
 
-        if name:
-            # Rule 3: Fuzzy Keyword Recognition (Suffixes & Keywords)
-            
-            # 1. Suffixes (Characters that typically end a sub-location name)
-            sub_suffixes = [
-                # Generic Building Parts
-                "室", "厅", "房", "廊", "厕", "厨", "卫", "梯", "台", "壁", "窗", "门", "柱", "底", "顶",
-                
-                # Residential/Living
-                "寓", "舍", "宅", "邸", "窟", "洞",
-                
-                # Ancient Architecture
-                "阁", "轩", "斋", "榭", "亭", "楼", "塔", "阙", "坛", "座", "池", "井", "墓", "冢",
-                "庵", "观", "寺", "庙", "祠", "堂", "署", "监", "狱", "牢",
-                
-                # Commercial/Functional
-                "馆", "店", "铺", "厂", "仓", "所", "处", "局", "科", "部", "行", "社",
-                
-                # Modern
-                "站", "港", "院", "园", "场" # Be careful with 场 (Field/Square) and 院 (Courtyard/Institute)
-            ]
-            
-            # 2. Keywords (Substrings that imply sub-location)
-            sub_keywords = [
-                # --- Modern ---
-                "花园", "庭院", "别院", "小院", "园子", "公园", "植物园", "动物园", "游乐园",
-                "商场", "商城", "商厦", "市场", "集市", "商铺", "店铺", "超市", "便利店", "百货",
-                "房间", "卧室", "客房", "书房", "厨房", "餐厅", "卫生间", "浴室", "厕所", "洗手间", "淋浴间",
-                "大厅", "前厅", "后厅", "客厅", "饭厅", "走廊", "过道", "通道", "楼梯", "电梯",
-                "大楼", "写字楼", "办公楼", "教学楼", "实验楼", "宿舍楼", "住院部", "门诊部",
-                "小区", "社区", "别墅", "公寓", "宿舍", "客栈", "酒店", "饭店", "酒楼", "旅馆", "招待所",
-                "网吧", "酒吧", "咖啡", "茶馆", "电影院", "剧院", "体育馆", "健身房", "游泳池",
-                "地铁", "公交", "火车站", "机场", "航站楼", "候机", "候车", "停车场", "车库",
-                "内部", "里面", "之中", "地下室", "天台", "阳台",
-                
-                # --- Ancient / Wuxia ---
-                "皇宫", "王府", "侯府", "官邸", "府邸", "私宅", "别苑",
-                "大门", "侧门", "后门", "山门", "城门", # Gates are usually sub/poi
-                "正殿", "偏殿", "主殿", "寝殿", "大殿", "议事厅", "聚义厅",
-                "书斋", "书库", "藏书", "经阁", "丹房", "器房", "兵器库", "库房", "仓库",
-                "牢房", "地牢", "水牢", "天牢", "刑房", "密室", "暗道", "地宫",
-                "客栈", "酒肆", "青楼", "画舫", "赌坊", "当铺", "钱庄", "镖局", "驿站",
-                "擂台", "校场", "演武", "练功",
-                
-                # --- Xuanhuan / Fantasy ---
-                "洞府", "石室", "闭关", "修炼室",
-                "炼丹", "炼器", "制符", "阵法", "传送阵", "聚灵阵", "护山大阵",
-                "秘境入口", "禁地", "后山", "灵田", "药园", "兽栏",
-                "试炼塔", "通天塔", "藏经阁", "任务堂", "执法堂", "外门", "内门", "杂役处"
-            ]
-            
-            # Exclusions (If name contains these, do NOT force to sub based on suffixes/keywords alone, unless very sure)
-            # e.g. "天剑门" (Sect) ends with "门", but shouldn't be sub.
-            # e.g. "青云山" ends with "山", not in suffix list, but good to be safe.
-            # e.g. "凤凰城" ends with "城".
-            exclusion_suffixes = ["城", "镇", "村", "国", "洲", "界", "大陆", "山", "河", "江", "湖", "海", "洋", "岛", "峰", "谷", "林", "原", "宗", "派", "门", "帮", "教"]
-            
-            # Specific logic for single-character suffixes that might be ambiguous
-            # "门" (Gate vs Sect): If "天剑门", likely Sect. If "大门", Gate.
-            # "殿" (Hall): Almost always sub.
-            # "宫" (Palace): "移花宫" (Sect) vs "储秀宫" (Room).
-            
-            is_sub = False
-            
-            # Check Suffixes
-            for s in sub_suffixes:
-                if name.endswith(s):
-                    # Ambiguity check
-                    if s == "门" and len(name) > 2: # e.g. "天剑门"
-                         continue # Skip, likely a sect
-                    if s == "院" and ("书院" in name or "学院" in name or "研究院" in name):
-                         continue # Institutes might be large
-                    if s == "场" and ("广场" not in name and "市场" not in name and "操场" not in name):
-                         # "战场" (Battlefield) -> World?
-                         continue
-                    is_sub = True
-                    break
-            
-            if not is_sub:
-                 if any(k in name for k in sub_keywords):
-                     is_sub = True
-                     
-            if is_sub:
-                # Double check exclusions
-                # If it ends with an exclusion suffix, override strict sub (unless it's in the keyword whitelist)
-                # e.g. "药园" (Garden) ends with "园" (Sub), but "桃源" (Place)?
-                # Actually, exclusion_suffixes are for things like "City", "Mountain".
-                if any(name.endswith(ex) for ex in exclusion_suffixes):
-                    # But wait, "山门" (Gate) ends with "门" (Exclusion).
-                    # "后山" (Back Mountain) ends with "山".
-                    # If the Keyword match was strong (e.g. "山门" is in sub_keywords), we keep it as sub.
-                    # If it was only a Suffix match, we might revert.
-                    
-                    # Let's trust Keywords more than Suffixes.
-                    # If matched via Keyword, keep as Sub.
-                    # If matched via Suffix ONLY, and also ends with Exclusion, then ignore.
-                    pass 
-                
-                if scope == "world":
-                    loc["scope"] = "sub"
+    def _get_classification_cache(self) -> Optional[JsonFileCache]:
+        """跨会话的地点分类缓存；TRACE_CLASSIFY_CACHE=0 时关闭"""
+        if (os.getenv("TRACE_CLASSIFY_CACHE") or "").strip().lower() in {"0", "false", "no"}:
+            return None
+        if self._classification_cache is not None:
+            return self._classification_cache
+        cache_path = os.getenv("TRACE_CLASSIFY_CACHE_PATH")
+        if not cache_path:
+            cache_path = os.path.join(os.path.dirname(__file__), "../../../.cache/classification_cache.json")
+        max_entries = max(1, self._env_int("TRACE_CLASSIFY_CACHE_SIZE", 50000))
+        # 整个缓存可达数万条，不在收集批结果的线程里反复整体重写，分类结束后统一 flush
+        self._classification_cache = JsonFileCache(cache_path=cache_path, max_entries=max_entries, save_every=0)
+        return self._classification_cache
+
+    @staticmethod
+    def _classification_key(item: Dict[str, Any], namespace: str = "") -> str:
+        """
+        分类缓存键：地点名 + 上下文指纹（place_type、相关地点、已有父级提示）+ 模型与 Prompt 指纹
+        描述与证据随片段划分变化较大，不计入指纹，反复出现的宗门、城池才能命中；
+        换模型或改 Prompt 后 namespace 随之变化，旧标注不再命中
+        """
+        basis = json.dumps(
+            [item.get("place_type"), sorted(item.get("related") or []), item.get("parent_location_hint"), namespace],
+            ensure_ascii=False
+        )
+        return f"{item['id']}\t{hashlib.sha1(basis.encode('utf-8')).hexdigest()[:16]}"
+
+    def _classification_namespace(self, prompt: str) -> str:
+        """分类所用的模型名与 Prompt 摘要"""
+        model = getattr(self.llm, "model", None) or ""
+        return f"{model}:{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}"
 
     def _classify_locations_with_llm(
         self, 
         locations: List[Dict[str, Any]], 
         session_id: Optional[str] = None,
-        context_map: Optional[Dict[str, Any]] = None
+        context_map: Optional[Dict[str, Any]] = None,
+        cooccurrence: Optional[CooccurrenceMatrix] = None
     ) -> List[Dict[str, Any]]:
+        """
+        按共现邻域把地点分成若干批并发分类（相关地点在同一批里，互为上下文），
+        结果按 (地点名, 上下文指纹) 缓存到磁盘，跨会话复用
+
+        规则置信度不低于 TRACE_RULE_CONFIDENCE（默认 0.9）的地点直接按规则定 scope，不进 LLM；
+        TRACE_RULE_AUDIT=1 时仍全部交给 LLM，只统计规则与 LLM 的一致率用于调阈值
+        """
         # Allow all locations to be classified (including real ones, for scope/kind)
-        targets = locations
+        targets = [l for l in locations if l.get("id")]
         if not targets:
             return locations
-            
-        # Increase limit for DeepSeek/modern LLMs
-        targets_slice = targets[:300]
-        
-        payload_items = []
-        for l in targets_slice:
+
+        threshold = self._env_float("TRACE_RULE_CONFIDENCE", 0.9)
+        audit = (os.getenv("TRACE_RULE_AUDIT") or "").strip().lower() in {"1", "true", "yes"}
+        verdicts = {l["id"]: LOCATION_RULES.verdict(l) for l in targets}
+        local: Dict[str, Dict[str, Any]] = {}
+        for l in targets:
+            v = verdicts[l["id"]]
+            if v.scope and v.confidence >= threshold:
+                # 只定 scope；kind 与父级提示保持提取阶段的结果，父级交给后面的兜底
+                local[l["id"]] = {
+                    "id": l["id"], "scope": v.scope, "kind": l.get("kind"), "parent_id": l.get("parent_id"), "_local": True
+                }
+
+        items: Dict[str, Dict[str, Any]] = {}
+        for l in targets:
+            if l["id"] in local and not audit:
+                continue
             item = {
                 "id": l["id"],
                 "place_type": l.get("place_type", "uncertain"),
-                "description": l.get("description", "")[:100],
-                "evidence": l.get("evidence", "")[:100],
+                "description": (l.get("description") or "")[:100],
+                "evidence": (l.get("evidence") or "")[:100],
                 "parent_location_hint": l.get("parent_id")  # Pass existing parent hint to LLM
             }
             # Add context if available
@@ -302,59 +240,158 @@ class TraceService:
                     item["related"] = ctx["related_locations"]
                 if ctx.get("common_characters"):
                     item["chars"] = ctx["common_characters"]
-            payload_items.append(item)
+            items[l["id"]] = item
 
-        payload = {"locations": payload_items}
-        
         prompt = get_trace_aggregator_prompt()
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"请对以下地点列表进行分类（scope, kind, parent_id），并修正 place_type，仅返回 JSON：\n{json.dumps(payload, ensure_ascii=False)}"}
-        ]
-        
-        try:
+        namespace = self._classification_namespace(prompt)
+        cache = self._get_classification_cache()
+        c_map: Dict[str, Dict[str, Any]] = {}
+        pending: List[str] = []
+        for lid, item in items.items():
+            cached = cache.get(self._classification_key(item, namespace)) if cache is not None else None
+            if cached is not None:
+                c_map[lid] = dict(cached, id=lid)
+            else:
+                pending.append(lid)
+
+        # 出现片段多的地点（宗门、城池）优先做起点，它的子地点随之归入同一批
+        if cooccurrence is not None:
+            pending.sort(key=lambda lid: (-cooccurrence.chunk_count(lid), lid))
+            neighbors = lambda lid: [nb for nb, _ in cooccurrence.neighbors(lid, None)]
+        else:
+            neighbors = lambda lid: (context_map or {}).get(lid, {}).get("related_locations") or []
+        batch_size = max(1, self._env_int("TRACE_CLASSIFY_BATCH_SIZE", 60))
+        shards = group_by_neighborhood(pending, neighbors, batch_size)
+
+        retry_budget = self._session_retry_budget(session_id)
+        deadline = self._session_deadline(session_id)
+
+        def classify_shard(shard: List[str]) -> Dict[str, Any]:
+            payload = {"locations": [items[lid] for lid in shard]}
+            messages = [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": f"请对以下地点列表进行分类（scope, kind, parent_id），并修正 place_type，仅返回 JSON：\n{json.dumps(payload, ensure_ascii=False)}"}
+            ]
+            return self.llm.chat_json(
+                messages, temperature=0.1, max_retries=0, retry_budget=retry_budget, deadline=deadline
+            )
+
+        failed_batches = 0
+        if shards:
             if session_id and session_id in self.sessions:
                 self.sessions[session_id]["status_msg"] = "正在智能构建地点层级..."
-                logger.info(f"Session {session_id}: Starting LLM classification for {len(targets_slice)} locations")
-                
-            resp = self.llm.chat_json(messages, temperature=0.1)
+            logger.info(
+                f"Session {session_id}: Starting LLM classification for {len(pending)} locations "
+                f"in {len(shards)} batches ({len(c_map)} cached)"
+            )
+            runner = RetryableAPIClient(max_retries=2, initial_delay=2.0, max_delay=30.0)
+            done = 0
+            for idx, resp, error in runner.iter_batch(
+                shards, classify_shard, max_workers=max(1, self._env_int("TRACE_CLASSIFY_CONCURRENCY", 4)),
+                budget=retry_budget, deadline=deadline
+            ):
+                done += 1
+                if session_id and session_id in self.sessions:
+                    self.sessions[session_id]["status_msg"] = f"正在智能构建地点层级: {done}/{len(shards)} 批..."
+                if error is not None:
+                    failed_batches += 1
+                    logger.error(f"Classification error: {error}")
+                    continue
+                shard = set(shards[idx])
+                for c in (resp.get("locations") if isinstance(resp, dict) else None) or []:
+                    if not isinstance(c, dict) or c.get("id") not in shard:
+                        continue
+                    c_map[c["id"]] = c
+                    if cache is not None:
+                        cache.put(self._classification_key(items[c["id"]], namespace), {
+                            k: c.get(k) for k in ("scope", "kind", "parent_id", "place_type")
+                        })
             logger.info(f"Session {session_id}: LLM classification response received")
-            classified_list = resp.get("locations") or []
-            
-            c_map = {c["id"]: c for c in classified_list if c.get("id")}
-            
-            # 2024-05: LLM Alias Resolution
-            # If LLM suggests that 'A' is actually 'B' (via aliases), we should note it.
-            # However, for now we just trust the prompt's `aliases` output in the extraction phase more.
-            # But we can look at if LLM changed the ID in the response (though prompt didn't explicitly ask for ID change).
-            
-            for loc in locations:
-                if loc["id"] in c_map:
-                    c = c_map[loc["id"]]
-                    loc["scope"] = c.get("scope")
-                    loc["kind"] = c.get("kind")
-                    loc["parent_id"] = c.get("parent_id")
-                    
-                    # Update place_type if LLM provides a better one
-                    if c.get("place_type") and c.get("place_type") in {"real", "fictional"}:
-                        loc["place_type"] = c.get("place_type")
-                    
-                    # If LLM returns aliases here (though aggregation prompt doesn't explicitly emphasize it, but we can add it)
-                    if c.get("aliases"):
-                         current_aliases = set(loc.get("aliases") or [])
-                         current_aliases.update(c.get("aliases"))
-                         loc["aliases"] = list(current_aliases)
+            if cache is not None:
+                cache.flush()
+
+        # LLM（含缓存）给出的标注与规则判断对照
+        agreement = AgreementReport()
+        for lid, c in c_map.items():
+            agreement.record(verdicts[lid], c.get("scope"))
+        RULE_AGREEMENT.merge(agreement)
+        if audit:
+            # 审计模式下仍采用 LLM 的结果，LLM 未返回的再用规则结论
+            c_map = dict(local, **c_map)
+        else:
+            c_map.update(local)
+
+        if session_id and session_id in self.sessions:
+            stats = self.sessions[session_id].setdefault("stats", {})
+            stats["classify_batches"] = len(shards)
+            stats["classify_failed_batches"] = failed_batches
+            stats["classify_cache_hits"] = len(items) - len(pending)
+            stats["classify_local"] = 0 if audit else len(local)
+            stats["rule_agreement"] = dict(agreement.to_dict(), threshold=threshold, audit=audit)
+
+        # 2024-05: LLM Alias Resolution
+        # If LLM suggests that 'A' is actually 'B' (via aliases), we should note it.
+        # However, for now we just trust the prompt's `aliases` output in the extraction phase more.
+        # But we can look at if LLM changed the ID in the response (though prompt didn't explicitly ask for ID change).
+
+        for loc in locations:
+            if loc.get("id") in c_map:
+                c = c_map[loc["id"]]
+                hinted = loc.get("parent_id")
+                loc["scope"] = c.get("scope")
+                loc["kind"] = c.get("kind")
+                loc["parent_id"] = c.get("parent_id")
+                # 记下父级来源，层级求解时按来源定权重
+                if not c.get("_local"):
+                    # LLM 看过父级提示后改判或置空，提取给的那条父级不能再被采用
+                    if hinted and hinted != loc["parent_id"]:
+                        loc.setdefault("rejected_parents", {})[hinted] = "classifier"
+                    if loc["parent_id"]:
+                        loc["parent_source"] = "classifier"
+                    else:
+                        loc.pop("parent_source", None)
                 
-                # Apply rules
-                self._enforce_scope_rules(loc)
+                # Update place_type if LLM provides a better one
+                if c.get("place_type") and c.get("place_type") in {"real", "fictional"}:
+                    loc["place_type"] = c.get("place_type")
                 
-                if loc.get("parent_id") and loc.get("scope") == "world":
-                     loc["scope"] = "sub"
+                # If LLM returns aliases here (though aggregation prompt doesn't explicitly emphasize it, but we can add it)
+                if c.get("aliases"):
+                     current_aliases = set(loc.get("aliases") or [])
+                     current_aliases.update(c.get("aliases"))
+                     loc["aliases"] = list(current_aliases)
             
-            return locations
-        except Exception as e:
-            logger.error(f"Classification error: {e}")
-            return locations
+            # Apply rules
+            self._enforce_scope_rules(loc)
+            
+            if loc.get("parent_id") and loc.get("scope") == "world":
+                 loc["scope"] = "sub"
+        
+        return locations
+
+    @staticmethod
+    def _parent_evidence_rules(text: str, start: int, end: int) -> set:
+        """
+        候选父级名称在 text[start:end] 处出现一次时命中的证据模式：
+        位于X / 在X、属于X / inside X、X的、位于X内 / 在X内、在X之中 / 里面 / 内部、X内 / X中
+        """
+        rules = set()
+        before2, before1 = text[max(0, start - 2):start], text[start - 1:start] if start else ""
+        after1, after2 = text[end:end + 1], text[end:end + 2]
+        located = before2 == "位于" or before1 == "在"
+        if located:
+            rules.add("located")
+        if before2 == "属于" or text[max(0, start - 7):start] == "inside ":
+            rules.add("belongs")
+        if after1 == "的":
+            rules.add("possessive")
+        if located and after1 == "内":
+            rules.add("located_inside")
+        if before1 == "在" and after2 in {"之中", "里面", "内部"}:
+            rules.add("in_interior")
+        if after1 in {"内", "中"}:
+            rules.add("inside")
+        return rules
 
     def _assign_parent_fallback(
         self,
@@ -369,6 +406,8 @@ class TraceService:
         potential_parents = [l for l in locations if self._get_rank(l) >= 2 or (l.get("scope") == "world" and self._get_rank(l) >= 1)]
         potential_parents.sort(key=lambda x: len(x["id"]), reverse=True)
         parent_ids = {p["id"] for p in potential_parents}
+        # 所有候选父级名称建一个自动机，每个地点的名称、描述与证据只扫描一遍
+        parent_matcher = AhoCorasick(parent_ids)
 
         for loc in locations:
             # Skip if already has parent
@@ -381,109 +420,8 @@ class TraceService:
 
             loc_id = loc.get("id")
             text = f"{loc_id} {loc.get('description','')} {loc.get('evidence','')}"
-            sub_like = False
-            # Exhaustive Sub-location Kinds (synced with _enforce_scope_rules)
-            sub_kinds = {
-                # Basic & Residential
-                "room", "hall", "courtyard", "corridor", "path", "gate", "wall", "floor", "window", 
-                "kitchen", "bedroom", "bathroom", "toilet", "restroom", "stairs", "elevator", 
-                "balcony", "terrace", "lobby", "reception", "pantry", "basement", "attic", 
-                "apartment", "dormitory", "studio", "suite",
-                
-                # Commercial & Entertainment (Modern)
-                "mall", "market", "shop", "store", "supermarket", "convenience_store",
-                "restaurant", "cafe", "bar", "pub", "club", "karaoke", "cinema", "theater", "gym",
-                "hotel", "inn", "motel", "hostel", "resort", "spa", "casino",
-                
-                # Office & Institutional (Modern)
-                "office", "meeting_room", "conference_room", "workspace", "cubicle",
-                "classroom", "library", "laboratory", "auditorium", "cafeteria", "canteen",
-                "hospital", "clinic", "ward", "surgery", "pharmacy", "police_station", "fire_station",
-                "post_office", "bank", "museum", "gallery",
-                
-                # Transport & Infrastructure (Modern)
-                "station", "stop", "platform", "dock", "pier", "wharf", "airport", "terminal",
-                "parking", "garage", "tunnel", "bridge", "factory", "warehouse", "plant", "workshop",
-                
-                # Ancient & Fantasy
-                "palace", "temple", "shrine", "altar", "pagoda", "tower", "pavilion", "gazebo",
-                "cave", "grotto", "dungeon", "cell", "prison", "jail", "crypt", "tomb", "grave",
-                "arena", "stadium", "ring", "field", "formation", "array",
-                "sect_gate", "main_hall", "side_hall", "scripture_library", "pill_room", "weapon_room",
-                "secret_chamber", "treasure_room", "spirit_field", "medicine_garden",
-                
-                # Objects/Vehicles (treated as POI/Sub)
-                "vehicle", "car", "bus", "train", "plane", "ship", "boat", "carriage", "sedan_chair",
-                "tent", "camp", "cabin"
-            }
-            if (loc.get("kind") or "").lower() in sub_kinds:
-                sub_like = True
-            
-            if not sub_like:
-                # Fuzzy Keyword Recognition (Suffixes & Keywords)
-                sub_suffixes = [
-                    # Generic Building Parts
-                    "室", "厅", "房", "廊", "厕", "厨", "卫", "梯", "台", "壁", "窗", "门", "柱", "底", "顶",
-                    # Residential/Living
-                    "寓", "舍", "宅", "邸", "窟", "洞",
-                    # Ancient Architecture
-                    "阁", "轩", "斋", "榭", "亭", "楼", "塔", "阙", "坛", "座", "池", "井", "墓", "冢",
-                    "庵", "观", "寺", "庙", "祠", "堂", "署", "监", "狱", "牢",
-                    # Commercial/Functional
-                    "馆", "店", "铺", "厂", "仓", "所", "处", "局", "科", "部", "行", "社",
-                    # Modern
-                    "站", "港", "院", "园", "场" 
-                ]
-                sub_keywords = [
-                    # --- Modern ---
-                    "花园", "庭院", "别院", "小院", "园子", "公园", "植物园", "动物园", "游乐园",
-                    "商场", "商城", "商厦", "市场", "集市", "商铺", "店铺", "超市", "便利店", "百货",
-                    "房间", "卧室", "客房", "书房", "厨房", "餐厅", "卫生间", "浴室", "厕所", "洗手间", "淋浴间",
-                    "大厅", "前厅", "后厅", "客厅", "饭厅", "走廊", "过道", "通道", "楼梯", "电梯",
-                    "大楼", "写字楼", "办公楼", "教学楼", "实验楼", "宿舍楼", "住院部", "门诊部",
-                    "小区", "社区", "别墅", "公寓", "宿舍", "客栈", "酒店", "饭店", "酒楼", "旅馆", "招待所",
-                    "网吧", "酒吧", "咖啡", "茶馆", "电影院", "剧院", "体育馆", "健身房", "游泳池",
-                    "地铁", "公交", "火车站", "机场", "航站楼", "候机", "候车", "停车场", "车库",
-                    "内部", "里面", "之中", "地下室", "天台", "阳台",
-                    # --- Ancient / Wuxia ---
-                    "皇宫", "王府", "侯府", "官邸", "府邸", "私宅", "别苑",
-                    "大门", "侧门", "后门", "山门", "城门", 
-                    "正殿", "偏殿", "主殿", "寝殿", "大殿", "议事厅", "聚义厅",
-                    "书斋", "书库", "藏书", "经阁", "丹房", "器房", "兵器库", "库房", "仓库",
-                    "牢房", "地牢", "水牢", "天牢", "刑房", "密室", "暗道", "地宫",
-                    "客栈", "酒肆", "青楼", "画舫", "赌坊", "当铺", "钱庄", "镖局", "驿站",
-                    "擂台", "校场", "演武", "练功",
-                    # --- Xuanhuan / Fantasy ---
-                    "洞府", "石室", "闭关", "修炼室",
-                    "炼丹", "炼器", "制符", "阵法", "传送阵", "聚灵阵", "护山大阵",
-                    "秘境入口", "禁地", "后山", "灵田", "药园", "兽栏",
-                    "试炼塔", "通天塔", "藏经阁", "任务堂", "执法堂", "外门", "内门", "杂役处"
-                ]
-                
-                # Exclusions
-                exclusion_suffixes = ["城", "镇", "村", "国", "洲", "界", "大陆", "山", "河", "江", "湖", "海", "洋", "岛", "峰", "谷", "林", "原", "宗", "派", "门", "帮", "教"]
-
-                is_sub = False
-                for s in sub_suffixes:
-                    if loc_id.endswith(s):
-                        if s == "门" and len(loc_id) > 2: continue
-                        if s == "院" and ("书院" in loc_id or "学院" in loc_id or "研究院" in loc_id): continue
-                        if s == "场" and ("广场" not in loc_id and "市场" not in loc_id and "操场" not in loc_id): continue
-                        is_sub = True
-                        break
-                
-                if not is_sub:
-                    if any(k in loc_id for k in sub_keywords):
-                        is_sub = True
-                
-                if is_sub:
-                     if any(loc_id.endswith(ex) for ex in exclusion_suffixes):
-                         # Trust keyword whitelist over exclusion suffix
-                         # But since we don't know which matched, we only revert if it was a weak match?
-                         # For now, just keep simple: if exclusion matches, we are cautious.
-                         pass
-                     else:
-                         sub_like = True
+            # 子地点：kind 属于子地点，或名称有子地点后缀/关键词且不以城镇、山川、宗门等结尾
+            sub_like = LOCATION_RULES.is_sub_location(loc)
             
             best_parent = None
             best_score = 0
@@ -501,37 +439,23 @@ class TraceService:
                 if rid in loc_map and rid in parent_ids and rid != loc_id:
                     candidates.add(rid)
             
-            # 2. From Name Containment (Prefix/Suffix)
-            for p in potential_parents:
-                pid = p["id"]
-                if pid == loc_id: continue
-                if pid in loc_id: # e.g. "Tianjian Sect" in "Tianjian Sect Side Hall"
-                    candidates.add(pid)
-                if loc_id in pid: # e.g. "Side Hall" in "Tianjian Sect Side Hall" (Unlikely parent)
-                    pass
-            
-            # 3. From Text Mention
-            for p in potential_parents:
-                if p["id"] in text and p["id"] != loc_id:
-                    candidates.add(p["id"])
-
-            # Evaluate Candidates
-            for cid in candidates:
+            # 2. Name Containment + 3. Text Mention: 名称出现在 loc_id 段内即为包含关系，
+            # 同时从每处出现的前后文判定证据模式
+            evidence_rules: Dict[str, set] = {}
+            for start, end, pid in parent_matcher.iter_matches(text):
+                if pid == loc_id:
+                    continue
+                candidates.add(pid)
+                rules = evidence_rules.setdefault(pid, set())
+                if end <= len(loc_id):
+                    rules.add("contains")
+                rules.update(self._parent_evidence_rules(text, start, end))
+
+            # Evaluate Candidates（长名优先，分数相同时结果稳定）
+            for cid in sorted(candidates, key=lambda c: (-len(c), c)):
                 cand = loc_map[cid]
-                score = 0
-                
-                # Rule A: Name Containment (Very Strong)
-                # "Tianjian Sect Side Hall" (loc) contains "Tianjian Sect" (cand) -> Parent is Cand
-                if cid in loc_id:
-                    score += 20
-                
-                # Rule B: Explicit Evidence
-                if f"位于{cid}" in text or f"在{cid}" in text: score += 15
-                if f"属于{cid}" in text or f"inside {cid}" in text: score += 15
-                if f"{cid}的" in text: score += 10
-                if f"位于{cid}内" in text or f"在{cid}内" in text: score += 15
-                if f"在{cid}之中" in text or f"在{cid}里面" in text or f"在{cid}内部" in text: score += 15
-                if f"{cid}内" in text or f"{cid}中" in text: score += 8
+                rules = evidence_rules.get(cid, set())
+                score = sum(_PARENT_EVIDENCE_SCORES[r] for r in rules)
                 
                 # Rule C: Co-occurrence
                 if cid in related_ids: score += 2
@@ -569,6 +493,7 @@ class TraceService:
             # Apply
             if best_parent:
                 loc["parent_id"] = best_parent["id"]
+                loc["parent_source"] = "fallback"
                 if loc.get("scope") == "world":
                     loc["scope"] = "sub"
 
@@ -703,7 +628,12 @@ class TraceService:
         if k in {"city", "town", "sect", "mountain", "forest", "island", "valley", "plain", "desert", "swamp", "palace_group", "estate", "fortress"}: return 2
         return 1
 
-    def _refine_hierarchy_with_communities(self, locations: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> None:
+    def _refine_hierarchy_with_communities(
+        self,
+        locations: List[Dict[str, Any]],
+        edges: List[Dict[str, Any]],
+        cooccurrence: Optional[CooccurrenceMatrix] = None
+    ) -> None:
         try:
             G = nx.Graph()
             loc_map = {l["id"]: l for l in locations}
@@ -713,10 +643,21 @@ class TraceService:
                 
             for e in edges:
                 if e["a"] in loc_map and e["b"] in loc_map:
-                    G.add_edge(e["a"], e["b"])
+                    G.add_edge(e["a"], e["b"], weight=1.0)
+
+            # 共现边按最大权重归一化到 (0, 1]，叠加在路线/关系边上；只在共现里出现的地点对也连上
+            if cooccurrence is not None:
+                top = cooccurrence.max_weight()
+                for a, b, w in cooccurrence.edges(restrict=loc_map):
+                    if top <= 0:
+                        break
+                    if G.has_edge(a, b):
+                        G[a][b]["weight"] += w / top
+                    else:
+                        G.add_edge(a, b, weight=w / top)
                 
             # Detect communities
-            communities = community.greedy_modularity_communities(G)
+            communities = community.greedy_modularity_communities(G, weight="weight")
             
             for comm in communities:
                 comm_list = list(comm)
@@ -747,6 +688,7 @@ class TraceService:
                     
                     if child_rank <= parent_rank:
                         node["parent_id"] = best_parent_id
+                        node["parent_source"] = "community"
                         if node.get("scope") == "world":
                             node["scope"] = "sub"
         except Exception as e:
@@ -757,7 +699,9 @@ class TraceService:
         locations: List[Dict[str, Any]],
         tracks: List[Dict[str, Any]],
         events: List[Dict[str, Any]] = None,
-        session_id: Optional[str] = None
+        session_id: Optional[str] = None,
+        cooccurrence: Optional[CooccurrenceMatrix] = None,
+        hierarchy: Optional[HierarchyResolver] = None
     ) -> Optional[Dict[str, Any]]:
         locs_all = [l for l in locations if l.get("id")]
         if not locs_all:
@@ -772,14 +716,9 @@ class TraceService:
                 if lid in loc_map_all:
                     event_counts[lid] = event_counts.get(lid, 0) + 1
 
-        degree_counts: Dict[str, int] = {}
-        for track in tracks:
-            for seg in track.get("segments") or []:
-                a = seg.get("from_location")
-                b = seg.get("to_location")
-                if a in loc_map_all and b in loc_map_all and a != b:
-                    degree_counts[a] = degree_counts.get(a, 0) + 1
-                    degree_counts[b] = degree_counts.get(b, 0) + 1
+        # 轨迹片段只遍历这一次：度数、邻居、路线边与轨迹折线都从 graph 取
+        graph = MapGraph(loc_map_all)
+        graph.add_tracks(tracks)
 
         children_by_parent: Dict[str, List[str]] = {}
         for l in locs_all:
@@ -796,7 +735,7 @@ class TraceService:
             return False
 
         def is_high_traffic(lid: str) -> bool:
-            if degree_counts.get(lid, 0) >= 3:
+            if graph.degree_of(lid) >= 3:
                 return True
             if event_counts.get(lid, 0) >= 2:
                 return True
@@ -812,7 +751,7 @@ class TraceService:
             fallback = sorted(
                 loc_map_all.keys(),
                 key=lambda lid: (
-                    degree_counts.get(lid, 0),
+                    graph.degree_of(lid),
                     event_counts.get(lid, 0),
                     self._get_rank(loc_map_all.get(lid) or {}),
                     len(lid)
@@ -840,20 +779,11 @@ class TraceService:
         for lid in list(keep_ids):
             add_ancestors(lid)
 
-        neighbors: Dict[str, set] = {}
-        for track in tracks:
-            for seg in track.get("segments") or []:
-                a = seg.get("from_location")
-                b = seg.get("to_location")
-                if a in loc_map_all and b in loc_map_all and a != b:
-                    neighbors.setdefault(a, set()).add(b)
-                    neighbors.setdefault(b, set()).add(a)
-
         frontier = list(keep_ids)
         for _ in range(2):
             nxt = []
             for lid in frontier:
-                for nb in neighbors.get(lid, set()):
+                for nb in graph.neighbors(lid):
                     if nb not in keep_ids:
                         keep_ids.add(nb)
                         nxt.append(nb)
@@ -873,7 +803,7 @@ class TraceService:
             loc = loc_map_all.get(lid) or {}
             rank = self._get_rank(loc)
             is_world = 1 if (loc.get("scope") or "").lower() == "world" else 0
-            deg = degree_counts.get(lid, 0)
+            deg = graph.degree_of(lid)
             evc = event_counts.get(lid, 0)
             childc = len(children_by_parent.get(lid, []))
             return (is_world, rank, deg, evc, childc)
@@ -888,13 +818,7 @@ class TraceService:
         loc_map = {l["id"]: l for l in map_locs}
 
         # Route edges (raw connectivity from tracks)
-        route_edges = []
-        for track in tracks:
-            for seg in track.get("segments") or []:
-                a = seg.get("from_location")
-                b = seg.get("to_location")
-                if a in loc_set and b in loc_set and a != b:
-                    route_edges.append({"a": a, "b": b, "type": "route_to", "evidence": seg.get("evidence") or ""})
+        route_edges = graph.route_edges(loc_set)
 
         # LLM Relation Inference
         relations = []
@@ -927,7 +851,10 @@ class TraceService:
                     self.sessions[session_id]["status_msg"] = "正在推断虚构地点空间关系..."
                     self.sessions[session_id]["progress"] = 96
                     logger.info(f"Session {session_id}: Starting LLM relation inference for {len(payload['locations'])} locations")
-                resp = self.llm.chat_json(messages, temperature=0.1, use_boost=False)
+                resp = self.llm.chat_json(
+                    messages, temperature=0.1, use_boost=False,
+                    retry_budget=self._session_retry_budget(session_id), deadline=self._session_deadline(session_id)
+                )
                 logger.info(f"Session {session_id}: LLM relation inference response received")
                 raw_relations = resp.get("relations") if isinstance(resp, dict) else None
                 if isinstance(raw_relations, list):
@@ -963,7 +890,7 @@ class TraceService:
         # --- Refine Hierarchy using Communities (Graph Theory) ---
         # This catches "orphaned" small locations and assigns them to the cluster leader
         all_edges = relations + route_edges
-        self._refine_hierarchy_with_communities(map_locs, all_edges)
+        self._refine_hierarchy_with_communities(map_locs, all_edges, cooccurrence=cooccurrence)
 
         post_children_by_parent: Dict[str, List[str]] = {}
         for l in map_locs:
@@ -976,60 +903,36 @@ class TraceService:
         # If they are top-level, they will be world nodes anyway.
         # If they are nested, they should be sub-nodes.
 
-        # 3. Build initial parent map
-        parent_map = {}
-        for l in map_locs:
-            pid = l.get("parent_id")
-            if pid and pid in loc_set and pid != l["id"]:
-                parent_map[l["id"]] = pid
-
+        # 3. 层级求解：各来源的父级都是候选边，取最大权重森林（无环、每个地点至多一个父级）
+        if hierarchy is None:
+            hierarchy = HierarchyResolver()
+        hierarchy.add_locations(map_locs, "extractor")
         for r in relations:
-            if r["type"] != "inside":
-                continue
-            child, parent = r["a"], r["b"]
-            if parent in loc_set and parent != child:
-                parent_map[child] = parent
-                if child in loc_map:
-                    loc_map[child]["parent_id"] = parent
-                    loc_map[child]["scope"] = "sub"
+            if r["type"] == "inside":
+                hierarchy.add(r["a"], r["b"], "relation")
+        parent_map = hierarchy.resolve(loc_set)
 
-        for child, pid in list(parent_map.items()):
-            if pid not in loc_set or pid == child:
-                del parent_map[child]
-
-        for child in list(parent_map.keys()):
-            seen = {child}
-            cur = child
-            while cur in parent_map:
-                cur = parent_map[cur]
-                if cur in seen:
-                    del parent_map[child]
-                    break
-                seen.add(cur)
-
-        flattened: Dict[str, str] = {}
-        for child, pid in parent_map.items():
-            if child in world_anchor_ids:
-                continue
-            if pid in world_anchor_ids:
-                flattened[child] = pid
-                continue
-            cur = pid
-            seen = {child, pid}
-            root = None
-            while cur in parent_map:
-                cur = parent_map[cur]
-                if cur in seen:
-                    root = None
-                    break
-                seen.add(cur)
-                if cur in world_anchor_ids:
-                    root = cur
-                    break
-            if root and root != child:
-                flattened[child] = root
-
-        parent_map = flattened
+        for l in map_locs:
+            lid = l["id"]
+            if lid in parent_map:
+                l["parent_id"] = parent_map[lid]
+                l["parent_source"] = hierarchy.sources[lid]
+                if l["parent_source"] == "relation":
+                    l["scope"] = "sub"
+            elif l.get("parent_id") in loc_set:
+                # 成环被舍弃的父级
+                l["parent_id"] = None
+                l.pop("parent_source", None)
+        if hierarchy.cycles:
+            logger.info(f"Session {session_id}: broke {len(hierarchy.cycles)} parent cycles: {hierarchy.cycles[:5]}")
+        if session_id and session_id in self.sessions:
+            self.sessions[session_id].setdefault("stats", {})["hierarchy"] = hierarchy.stats()
+
+        # 扁平化：子地点直接挂到最近的世界锚点祖先下
+        parent_map = {
+            child: anchor for child, anchor in hierarchy.nearest_ancestor(world_anchor_ids).items()
+            if child not in world_anchor_ids
+        }
         for child, pid in parent_map.items():
             if child in loc_map:
                 loc_map[child]["parent_id"] = pid
@@ -1040,6 +943,7 @@ class TraceService:
             if lid in loc_map:
                 loc_map[lid]["scope"] = "world"
                 loc_map[lid]["parent_id"] = None
+                loc_map[lid].pop("parent_source", None)
 
         world_ids = []
         sub_groups: Dict[str, List[str]] = {}
@@ -1057,8 +961,22 @@ class TraceService:
                     continue
                 world_ids.append(lid)
 
+        # 关系/路线边与事件各按分组归类一次（世界地图一组，每个子地图一组）
+        group_of: Dict[str, str] = {lid: WORLD_GROUP for lid in world_ids}
+        for pid, children in sub_groups.items():
+            for cid in children:
+                group_of[cid] = pid
+        relation_groups = MapGraph.group_edges(relations, group_of)
+        route_groups = MapGraph.group_edges(route_edges, group_of)
+        events_by_group: Dict[str, List[Dict[str, Any]]] = {}
+        for ev in events or []:
+            g = group_of.get(ev.get("location_id"))
+            if g is not None and g != WORLD_GROUP:
+                events_by_group.setdefault(g, []).append(ev)
+
         # Layout World
-        world_constraints = [r for r in relations + route_edges if r["a"] in world_ids and r["b"] in world_ids]
+        world_edges = relation_groups.get(WORLD_GROUP, [])
+        world_constraints = world_edges + route_groups.get(WORLD_GROUP, [])
         world_layout = self._layout_nodes(world_ids, world_constraints, width, height)
         
         final_nodes = []
@@ -1073,6 +991,7 @@ class TraceService:
                 "kind": loc_map[lid].get("kind"),
                 "type": loc_map[lid].get("kind"),
                 "parent_id": loc_map[lid].get("parent_id"),
+                "parent_source": loc_map[lid].get("parent_source"),
                 "description": loc_map[lid].get("description"),
                 "desc": loc_map[lid].get("description")
             }
@@ -1080,8 +999,7 @@ class TraceService:
             # Sub-map
             children = sub_groups.get(lid, [])
             if children:
-                child_set = set(children)
-                child_constraints = [r for r in relations + route_edges if r["a"] in child_set and r["b"] in child_set]
+                child_constraints = relation_groups.get(lid, []) + route_groups.get(lid, [])
                 child_layout = self._layout_nodes(children, child_constraints, 1000, 1000)
                 
                 sub_nodes = []
@@ -1097,6 +1015,7 @@ class TraceService:
                         "kind": loc_map[child_id].get("kind"),
                         "type": loc_map[child_id].get("kind"),
                         "parent_id": loc_map[child_id].get("parent_id"),
+                        "parent_source": loc_map[child_id].get("parent_source"),
                         "description": loc_map[child_id].get("description"),
                         "desc": loc_map[child_id].get("description")
                     })
@@ -1105,14 +1024,12 @@ class TraceService:
                 
                 # Collect events for this sub-map
                 sub_events = []
-                if events:
-                    for ev in events:
-                        if ev.get("location_id") in child_set:
-                            # Ensure description field exists for frontend compatibility
-                            ev_copy = ev.copy()
-                            if "summary" in ev_copy and "description" not in ev_copy:
-                                ev_copy["description"] = ev_copy["summary"]
-                            sub_events.append(ev_copy)
+                for ev in events_by_group.get(lid, []):
+                    # Ensure description field exists for frontend compatibility
+                    ev_copy = ev.copy()
+                    if "summary" in ev_copy and "description" not in ev_copy:
+                        ev_copy["description"] = ev_copy["summary"]
+                    sub_events.append(ev_copy)
 
                 node["sub_map"] = {
                     "nodes": sub_nodes,
@@ -1133,91 +1050,50 @@ class TraceService:
             return None
 
         polylines = []
-        for track in tracks:
-            character = track.get("character")
-            for seg in track.get("segments") or []:
-                a = seg.get("from_location")
-                b = seg.get("to_location")
-                pos_a = get_world_pos(a)
-                pos_b = get_world_pos(b)
-                if pos_a and pos_b and pos_a != pos_b:
-                    polylines.append({
-                        "character": character,
-                        "from_location": a,
-                        "to_location": b,
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": [[pos_a[0], pos_a[1]], [pos_b[0], pos_b[1]]]
-                        }
-                    })
+        for a, b, character in graph.iter_segments():
+            pos_a = get_world_pos(a)
+            pos_b = get_world_pos(b)
+            if pos_a and pos_b and pos_a != pos_b:
+                polylines.append({
+                    "character": character,
+                    "from_location": a,
+                    "to_location": b,
+                    "geometry": {
+                        "type": "LineString",
+                        "coordinates": [[pos_a[0], pos_a[1]], [pos_b[0], pos_b[1]]]
+                    }
+                })
 
         return {
             "world": {"name": world_name, "width": width, "height": height},
             "nodes": final_nodes,
-            "edges": [r for r in relations if r["a"] in world_ids and r["b"] in world_ids],
+            "edges": world_edges,
             "polylines": polylines
         }
 
     def preprocess_text(self, text: str) -> str:
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        lines = [line.strip() for line in text.split('\n')]
-        return '\n'.join(lines).strip()
-
-    def _chunk_text(self, text: str, chunk_size: int = 2000, overlap: int = 400) -> List[str]:
-        if len(text) <= chunk_size:
-            return [text] if text.strip() else []
-
-        chunks: List[str] = []
-        start = 0
-        text_len = len(text)
-        separators = ['\n\n', '。', '！', '？', '.\n', '!\n', '?\n', '. ', '! ', '? ']
-
-        while start < text_len:
-            end = min(start + chunk_size, text_len)
-            if end < text_len:
-                search_text = text[start:end]
-                last_sep = search_text.rfind('\n\n')
-                if last_sep != -1 and last_sep > chunk_size * 0.5:
-                    end = start + last_sep + 2
-                else:
-                    for sep in separators[1:]:
-                        last_sep = search_text.rfind(sep)
-                        if last_sep != -1 and last_sep > chunk_size * 0.5:
-                            end = start + last_sep + len(sep)
-                            break
+        return normalize_text(text)
 
-            chunk = text[start:end].strip()
-            if chunk and len(chunk) > 10:
-                chunks.append(chunk)
-
-            if end >= text_len:
-                break
-            start = max(0, end - overlap)
+    def _chunk_text(self, text: Union[str, TextView], chunk_size: int = 2000, overlap: int = 400,
+                    index: Optional[BoundaryIndex] = None) -> List[TextView]:
+        return TextChunker(chunk_size=chunk_size, overlap=overlap).chunk(text, index)
 
-        return chunks
-
-    def _split_chapters(self, text: str) -> List[Tuple[str, str]]:
-        lines = text.split('\n')
-        chapter_header = re.compile(r'^\s*(第[0-9零一二三四五六七八九十百千万]+[章节卷回部].*|Chapter\s+\d+.*)\s*$',
-                                   re.IGNORECASE)
-
-        positions: List[Tuple[int, str]] = []
-        for idx, line in enumerate(lines):
-            if chapter_header.match(line):
-                positions.append((idx, line.strip()))
+    def _split_chapters(self, text: str) -> List[Tuple[str, TextView]]:
+        chapter_header = re.compile(r'^[^\S\n]*(第[0-9零一二三四五六七八九十百千万]+[章节卷回部].*|Chapter\s+\d+.*?)[^\S\n]*$',
+                                   re.IGNORECASE | re.MULTILINE)
 
+        positions = [(m.start(), m.end(), m.group(1).strip()) for m in chapter_header.finditer(text)]
         if len(positions) < 2:
-            return [("全文", text)]
+            return [("全文", TextView(text))]
 
-        chapters: List[Tuple[str, str]] = []
-        for i, (start_idx, title) in enumerate(positions):
-            end_idx = positions[i + 1][0] if i + 1 < len(positions) else len(lines)
-            body = '\n'.join(lines[start_idx + 1:end_idx]).strip()
-            if body:
+        chapters: List[Tuple[str, TextView]] = []
+        for i, (_, header_end, title) in enumerate(positions):
+            body_end = positions[i + 1][0] if i + 1 < len(positions) else len(text)
+            body = TextView(text, header_end, body_end).strip()
+            if len(body):
                 chapters.append((title, body))
 
-        return chapters if chapters else [("全文", text)]
+        return chapters if chapters else [("全文", TextView(text))]
 
     def _normalize_location_name(self, value: Any) -> Optional[str]:
         if not isinstance(value, str):
@@ -1315,26 +1191,14 @@ class TraceService:
         return {"locations": norm_locations, "events": norm_events}
 
     def _mock_extract_chunk(self, chapter_title: str, text: str) -> Dict[str, Any]:
-        # Optimized regex patterns for richer extraction
-        real_suffixes = r"(?:省|市|县|区|镇|乡|路|街|道|站|机场|港|口岸|大学|学院|医院|公园|广场|桥|大厦|中心|村|胡同|里|弄)"
-        real_pat = re.compile(rf'([\u4e00-\u9fff]{2,12}{real_suffixes})')
-        
-        fictional_suffixes = r"(?:山|宗|门|派|城|谷|殿|宫|岛|界|国|林|洞|峰|海|原|域|府|寨|庄|阁|塔|观|寺|庙|祠|墓|陵|关|隘)"
-        fictional_pat = re.compile(rf'([\u4e00-\u9fff]{2,12}{fictional_suffixes})')
+        real_hits = REAL_LOCATION_PATTERN.findall(text)
+        fic_hits = FICTIONAL_LOCATION_PATTERN.findall(text)
+        char_hits = CHARACTER_PATTERN.findall(text)
 
-        real_hits = real_pat.findall(text)
-
-        fic_hits = fictional_pat.findall(text)
-        
-        # 简单的人名提取正则：匹配“xx说”、“xx道”、“xx想”前面的2-4字中文
-        char_pat = re.compile(r'([\u4e00-\u9fff]{2,4})(?:说|道|想|看|听|问|答|笑|哭|叫|喊|走|跑|飞|跳)')
-        char_hits = char_pat.findall(text)
-        
-        # 过滤掉常见非人名（可以是停用词表，这里简单过滤）
-        stopwords = {"自己", "什么", "怎么", "哪里", "虽然", "但是", "因为", "所以", "如果", "突然", "只见", "听见", "看见", "感觉", "觉得", "以为", "正在", "已经", "开始"}
+        # 过滤掉常见非人名
         char_set = []
         for c in char_hits:
-            if c not in stopwords and c not in char_set:
+            if c not in CHARACTER_STOPWORDS and c not in char_set:
                 char_set.append(c)
         if not char_set:
             char_set = ["主角"]
@@ -1358,7 +1222,7 @@ class TraceService:
         paras = [p.strip() for p in re.split(r'\n{2,}', text) if p.strip()]
         order = 0
         for p in paras:
-            m = real_pat.search(p) or fictional_pat.search(p)
+            m = REAL_LOCATION_PATTERN.search(p) or FICTIONAL_LOCATION_PATTERN.search(p)
             if not m:
                 continue
             order += 1
@@ -1383,6 +1247,156 @@ class TraceService:
 
         return self._normalize_extraction_result({"locations": locations, "events": events})
 
+    def _extraction_user_prompt(self, chapter_title: str, chunk_id: str, chunk_text: str, context: str = "") -> str:
+        return f"章节信息：{chapter_title}\n\n{context}请分析以下文本片段（{chunk_id}）：\n\n{chunk_text}"
+
+    def _run_batch_extraction(
+        self,
+        session_id: str,
+        work: List[Dict[str, Any]],
+        cache_mode: str,
+        extractor_prompt: str,
+        stats: Dict[str, Any],
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        通过 Batch API 一次性提交所有未命中缓存的片段，等待完成后解析结果
+
+        只使用基础提取 Prompt（不含聚焦窗口、前文提要、实体词典与模型路由，这些都依赖逐片段的同步调用）；
+        批任务在截止时间前没有完成时，只返回命中缓存的结果；远端批任务不取消，
+        其 id 记入 stats["batch_pending_id"] 与会话的 batch_pending_id，之后可再取回结果
+
+        Returns:
+            {chunk_id: 规范化后的提取结果}；单条失败的片段不在其中
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        requests: Dict[str, List[Dict[str, str]]] = {}
+        pending: Dict[str, Tuple[Tuple[str, str, str], Dict[str, Any]]] = {}
+        for chunk in work:
+            cache_key = (cache_mode, chunk["chapter_title"], chunk["digest"])
+            cached = self._get_cached_chunk(cache_key)
+            if cached is not None:
+                stats["cache_hits"] += 1
+                cached["_chunk_id"] = chunk["chunk_id"]
+                results[chunk["chunk_id"]] = cached
+                continue
+            user_content = self._extraction_user_prompt(chunk["chapter_title"], chunk["chunk_id"], chunk["view"].text)
+            requests[chunk["chunk_id"]] = [
+                {"role": "system", "content": extractor_prompt},
+                {"role": "user", "content": user_content}
+            ]
+            stats["prompt_chars"] += len(extractor_prompt) + len(user_content)
+            pending[chunk["chunk_id"]] = (cache_key, chunk)
+
+        if not requests:
+            return results
+
+        def on_progress(done: int, total: int) -> None:
+            if total:
+                self.sessions[session_id]["progress"] = min(int(done / total * 90), 89)
+            self.sessions[session_id]["status_msg"] = f"批量任务处理中: 已完成 {done}/{total} 个片段..."
+
+        if self._batch_client is None:
+            self._batch_client = BatchClient()
+        self.sessions[session_id]["status_msg"] = f"已提交 {len(requests)} 个片段到批量任务，等待完成..."
+        stats["batch_requests"] = len(requests)
+        timeout = deadline.remaining() if deadline is not None else None
+        try:
+            outputs = self._batch_client.run(requests, temperature=0.1, on_progress=on_progress, timeout=timeout)
+        except BatchTimeout as e:
+            if deadline is None or not deadline.expired():
+                raise
+            logger.warning(
+                f"Session {session_id}: batch {e.batch_id} did not finish before the deadline, "
+                f"left running so its results can be fetched later"
+            )
+            stats["deadline_skipped"] = stats.get("deadline_skipped", 0) + len(requests)
+            stats["batch_pending_id"] = e.batch_id
+            self.sessions[session_id]["batch_pending_id"] = e.batch_id
+            return results
+
+        failed = 0
+        for chunk_id, content in outputs.items():
+            cache_key, chunk = pending[chunk_id]
+            try:
+                if content is None:
+                    raise ValueError("no result")
+                raw, how = parse_json(content)
+                if how == "repaired":
+                    stats["json_salvaged"] = stats.get("json_salvaged", 0) + 1
+                normalized = self._normalize_extraction_result(raw)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Batch result for {chunk_id} unusable: {e}")
+                continue
+            self._put_cached_chunk(cache_key, normalized)
+            normalized["_chunk_id"] = chunk_id
+            results[chunk_id] = normalized
+        stats["batch_failed"] = failed
+        return results
+
+    def _build_running_context(self, previous: List[Dict[str, Any]], max_characters: int = 8) -> str:
+        """
+        把同章前序片段的提取结果压缩成一段上下文：最近出场的人物及其最后所在地点
+
+        Args:
+            previous: 按原文顺序排列的前序片段提取结果
+        """
+        last_location: Dict[str, str] = {}
+        for result in previous:
+            events = sorted(result.get("events") or [], key=lambda e: int(e.get("order_in_chunk") or 0))
+            for evt in events:
+                loc = evt.get("location")
+                for c in evt.get("characters") or []:
+                    # 重新插入，使字典顺序反映最近出场
+                    last_location.pop(c, None)
+                    if loc:
+                        last_location[c] = loc
+        if not last_location:
+            return ""
+        recent = list(last_location.items())[-max_characters:]
+        lines = "\n".join(f"- {c}：{loc}" for c, loc in reversed(recent))
+        return f"本章前文提要（在场人物：最后所在地点，仅供参考，不要据此生成事件）：\n{lines}\n\n"
+
+    def _format_focus_windows(self, text: str, windows: List[Tuple[int, int]]) -> str:
+        return "\n\n".join(f"【@{a}】\n{text[a:b]}" for a, b in windows)
+
+    def _order_focus_events(self, raw: Any, windows: List[Tuple[int, int]], text: str) -> None:
+        """
+        聚焦窗口模式下按事件在原片段中的位置重排并重新编号 order_in_chunk
+
+        位置优先取模型返回的 window 偏移，其次在原文中查找 evidence，
+        都没有时沿用上一个事件所在的窗口
+        """
+        if not isinstance(raw, dict) or not isinstance(raw.get("events"), list):
+            return
+        starts = [a for a, _ in windows]
+        keyed = []
+        last_window = 0
+        for idx, evt in enumerate(raw["events"]):
+            if not isinstance(evt, dict):
+                continue
+            pos: Optional[int] = None
+            try:
+                pos = int(evt.get("window"))
+            except (TypeError, ValueError):
+                evidence = evt.get("evidence")
+                if isinstance(evidence, str) and evidence.strip():
+                    found = text.find(evidence.strip()[:20])
+                    pos = found if found >= 0 else None
+            window = max(0, bisect.bisect_right(starts, pos) - 1) if pos is not None else last_window
+            last_window = window
+            try:
+                order = int(evt.get("order_in_chunk") or 0)
+            except (TypeError, ValueError):
+                order = 0
+            keyed.append(((window, order, idx), evt))
+        keyed.sort(key=lambda item: item[0])
+        for order, (_, evt) in enumerate(keyed, start=1):
+            evt["order_in_chunk"] = order
+            evt.pop("window", None)
+        raw["events"] = [evt for _, evt in keyed]
+
     def _merge_locations(self, results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
         # 1. Flatten results
         raw_locations = []
@@ -1508,16 +1522,25 @@ class TraceService:
         return merged_locations, alias_to_id
 
     def _merge_events(self, results: List[Dict[str, Any]], alias_to_id: Dict[str, str], chunk_order: List[str]) -> List[Dict[str, Any]]:
+        """
+        按原文片段顺序合并各片段的事件并去重
+
+        片段结果先按 chunk_id 建索引（同一片段有多份结果时取第一份），
+        排序键用预先算好的片段位置，整体随片段数线性增长
+        """
         merged_events: List[Dict[str, Any]] = []
         seen_keys: set = set()
 
         def norm_text(s: str) -> str:
-            s = (s or '').strip().lower()
-            s = re.sub(r'\s+', ' ', s)
-            return s
+            return ' '.join((s or '').lower().split())
+
+        by_chunk: Dict[str, Dict[str, Any]] = {}
+        for r in results:
+            by_chunk.setdefault(r.get("_chunk_id"), r)
+        position = {chunk_id: i for i, chunk_id in enumerate(chunk_order)}
 
         for chunk_id in chunk_order:
-            r = next((x for x in results if x.get("_chunk_id") == chunk_id), None)
+            r = by_chunk.get(chunk_id)
             if not r:
                 continue
             for evt in r.get("events") or []:
@@ -1543,7 +1566,7 @@ class TraceService:
                     "_chunk_id": chunk_id
                 })
 
-        merged_events.sort(key=lambda e: (chunk_order.index(e["_chunk_id"]), int(e.get("order_in_chunk") or 0)))
+        merged_events.sort(key=lambda e: (position[e["_chunk_id"]], int(e.get("order_in_chunk") or 0)))
         for idx, e in enumerate(merged_events, start=1):
             e["order"] = idx
         return merged_events
@@ -1591,7 +1614,134 @@ class TraceService:
 
         return tracks
 
-    def analyze_text(self, text: str, session_id: Optional[str] = None, run_async: bool = True) -> Dict[str, Any]:
+    def _session_retry_budget(self, session_id: Optional[str]) -> Optional[RetryBudget]:
+        session = self.sessions.get(session_id) if session_id else None
+        return session.get("retry_budget") if session else None
+
+    def _session_deadline(self, session_id: Optional[str]) -> Optional[Deadline]:
+        session = self.sessions.get(session_id) if session_id else None
+        return session.get("deadline") if session else None
+
+    def _resolve_deadline(self, seconds: Optional[float] = None, tier: Optional[str] = None) -> Deadline:
+        """
+        会话截止时间，默认取 TRACE_DEADLINE，规则见 utils.deadline.resolve_deadline
+
+        Raises:
+            ValueError: tier 未配置，或 seconds 不是正数
+        """
+        return resolve_deadline(seconds, tier, env="TRACE_DEADLINE")
+
+    def _env_int(self, name: str, default: int) -> int:
+        try:
+            value = os.getenv(name)
+            return int(value) if value else default
+        except Exception:
+            return default
+
+    def _env_float(self, name: str, default: float) -> float:
+        try:
+            value = os.getenv(name)
+            return float(value) if value else default
+        except Exception:
+            return default
+
+    def register_document(self, text: str) -> Dict[str, Any]:
+        """
+        规范化文本并登记为文档，记录章节目录（标题与偏移）
+
+        相同内容重复上传会命中同一个 document_id
+        """
+        text = self.preprocess_text(text)
+        document_id = f"doc_{hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()}"
+        with self._cache_lock:
+            doc = self.documents.get(document_id)
+            if doc is not None:
+                self.documents.move_to_end(document_id)
+                return doc
+
+        chapters = []
+        for idx, (title, body) in enumerate(self._split_chapters(text), start=1):
+            chapters.append({
+                "index": idx,
+                "title": title,
+                "start": body.start,
+                "end": body.end,
+                "chars": len(body)
+            })
+        doc = {
+            "document_id": document_id,
+            "text": text,
+            "chapters": chapters,
+            "boundaries": None,
+            "created_at": datetime.now().isoformat()
+        }
+
+        max_docs = max(1, self._env_int("TRACE_DOCUMENT_CACHE_SIZE", 16))
+        with self._cache_lock:
+            self.documents[document_id] = doc
+            while len(self.documents) > max_docs:
+                self.documents.popitem(last=False)
+        return doc
+
+    def list_chapters(self, document_id: str) -> Dict[str, Any]:
+        doc = self.documents.get(document_id)
+        if not doc:
+            return {"success": False, "error": "Document not found"}
+        return {
+            "success": True,
+            "document_id": document_id,
+            "chapter_count": len(doc["chapters"]),
+            "total_chars": len(doc["text"]),
+            "chapters": doc["chapters"]
+        }
+
+    def analyze_text(
+        self,
+        text: str,
+        session_id: Optional[str] = None,
+        run_async: bool = True,
+        deadline_seconds: Optional[float] = None,
+        tier: Optional[str] = None
+    ) -> Dict[str, Any]:
+        # 在启动后台线程之前完成规范化，原始上传文本随请求结束即可释放，
+        # 分析过程中只保留这一份缓冲区，章节与片段都是它上面的视图
+        doc = self.register_document(text)
+        return self.analyze_document(
+            doc["document_id"], session_id=session_id, run_async=run_async,
+            deadline_seconds=deadline_seconds, tier=tier
+        )
+
+    def analyze_document(
+        self,
+        document_id: str,
+        chapter_start: Optional[int] = None,
+        chapter_end: Optional[int] = None,
+        session_id: Optional[str] = None,
+        run_async: bool = True,
+        deadline_seconds: Optional[float] = None,
+        tier: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        对已登记文档的某个章节区间（1 起，闭区间）启动分析
+
+        已缓存的片段结果会被直接复用，不再调用 LLM；
+        截止时间从此刻起算，到期时返回已完成部分的结果
+        """
+        doc = self.documents.get(document_id)
+        if not doc:
+            return {"success": False, "error": "Document not found"}
+
+        total = len(doc["chapters"])
+        first = chapter_start if chapter_start is not None else 1
+        last = chapter_end if chapter_end is not None else total
+        if first < 1 or last > total or first > last:
+            return {"success": False, "error": f"章节范围无效，应在 1-{total} 之间"}
+
+        try:
+            deadline = self._resolve_deadline(deadline_seconds, tier)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+
         if not session_id:
             session_id = f"trace_{uuid.uuid4().hex[:12]}"
 
@@ -1600,46 +1750,116 @@ class TraceService:
             "status_msg": "正在解析文本...",
             "progress": 0,
             "created_at": datetime.now().isoformat(),
+            "document_id": document_id,
+            "chapter_range": [first, last],
+            "deadline": deadline,
+            "stats": {},
             "result": None,
             "error": None
         }
 
         if run_async:
-            threading.Thread(target=self._run_analysis, args=(session_id, text), daemon=True).start()
+            threading.Thread(target=self._run_analysis, args=(session_id, doc, (first, last)), daemon=True).start()
         else:
-            self._run_analysis(session_id, text)
+            self._run_analysis(session_id, doc, (first, last))
 
         return {
             "success": True,
             "session_id": session_id,
+            "document_id": document_id,
+            "chapter_range": [first, last],
+            "deadline_seconds": deadline.seconds,
             "status_url": f"/api/trace/status/{session_id}"
         }
 
-    def _run_analysis(self, session_id: str, text: str) -> None:
+    def _get_cached_chunk(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            cached = self._chunk_cache.get(key)
+            if cached is None:
+                return None
+            self._chunk_cache.move_to_end(key)
+        # 下游合并阶段会原地修改结果，缓存里的副本不能外借
+        return copy.deepcopy(cached)
+
+    def _put_cached_chunk(self, key: Tuple[str, str, str], result: Dict[str, Any]) -> None:
+        max_entries = max(0, self._env_int("TRACE_CHUNK_CACHE_SIZE", 20000))
+        if max_entries == 0:
+            return
+        stored = copy.deepcopy({k: v for k, v in result.items() if not k.startswith("_")})
+        with self._cache_lock:
+            self._chunk_cache[key] = stored
+            self._chunk_cache.move_to_end(key)
+            while len(self._chunk_cache) > max_entries:
+                self._chunk_cache.popitem(last=False)
+
+    def _dedupe_chunks(
+        self,
+        chunks: List[Dict[str, Any]],
+        stats: Dict[str, Any]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Returns:
+            (需要实际提取的代表片段, {重复片段 chunk_id: 代表片段 chunk_id})
+        """
+        if (os.getenv("TRACE_DEDUP") or "1").strip().lower() in {"0", "false", "no"}:
+            return chunks, {}
         try:
-            mock_mode = (os.getenv("TRACE_MOCK") or "").strip().lower() in {"1", "true", "yes"}
-            text = self.preprocess_text(text)
-            chapters = self._split_chapters(text)
+            threshold = float(os.getenv("TRACE_DEDUP_THRESHOLD") or 0.9)
+        except ValueError:
+            threshold = 0.9
+
+        detector = DuplicateDetector(threshold=threshold)
+        work: List[Dict[str, Any]] = []
+        aliases: Dict[str, str] = {}
+        for chunk in chunks:
+            rep = detector.find(chunk["chunk_id"], chunk["digest"], chunk["view"].text)
+            if rep is None:
+                work.append(chunk)
+            else:
+                aliases[chunk["chunk_id"]] = rep
 
-            chunk_size_env = os.getenv("TRACE_CHUNK_SIZE")
-            overlap_env = os.getenv("TRACE_CHUNK_OVERLAP")
-            try:
-                chunk_size = int(chunk_size_env) if chunk_size_env else 2000
-            except Exception:
-                chunk_size = 2000
-            try:
-                overlap = int(overlap_env) if overlap_env else 200
-            except Exception:
-                overlap = 200
+        stats["dedup_exact"] = detector.exact
+        stats["dedup_near"] = detector.near
+        stats["dedup_saved_calls"] = len(aliases)
+        if aliases:
+            logger.info(f"Dedup: {detector.exact} exact + {detector.near} near-duplicate chunks reuse existing results")
+        return work, aliases
 
+    def _run_analysis(self, session_id: str, doc: Dict[str, Any], chapter_range: Optional[Tuple[int, int]] = None) -> None:
+        try:
+            mock_mode = (os.getenv("TRACE_MOCK") or "").strip().lower() in {"1", "true", "yes"}
+            text = doc["text"]
+            chapters = doc["chapters"]
+            if chapter_range:
+                chapters = chapters[chapter_range[0] - 1:chapter_range[1]]
+
+            chunk_size = self._env_int("TRACE_CHUNK_SIZE", 2000)
+            # running 模式：片段之间不（或极少）重叠，改为把同章前序片段的提取结果压缩成上下文带入
+            running_mode = (os.getenv("TRACE_CONTEXT_MODE") or "").strip().lower() == "running"
+            if running_mode:
+                overlap = self._env_int("TRACE_RUNNING_OVERLAP", 0)
+            else:
+                overlap = self._env_int("TRACE_CHUNK_OVERLAP", 200)
+
+            # 边界索引对整本文本只建一次，随文档保存，各章节、各次区间分析共用
+            if doc.get("boundaries") is None:
+                doc["boundaries"] = BoundaryIndex(text)
+            boundaries = doc["boundaries"]
             chunks: List[Dict[str, Any]] = []
-            for chapter_idx, (title, body) in enumerate(chapters, start=1):
-                sub_chunks = self._chunk_text(body, chunk_size=chunk_size, overlap=overlap)
+            overlap_chars = 0
+            for chapter in chapters:
+                body = TextView(text, chapter["start"], chapter["end"])
+                sub_chunks = self._chunk_text(body, chunk_size=chunk_size, overlap=overlap, index=boundaries)
                 for part_idx, sub in enumerate(sub_chunks, start=1):
+                    if part_idx > 1:
+                        overlap_chars += max(0, sub_chunks[part_idx - 2].end - sub.start)
                     chunks.append({
-                        "chunk_id": f"ch{chapter_idx:04d}_p{part_idx:03d}",
-                        "chapter_title": title,
-                        "text": sub
+                        "chunk_id": f"ch{chapter['index']:04d}_p{part_idx:03d}",
+                        "digest": chunk_digest(sub),
+                        "chapter_title": chapter["title"],
+                        "chapter_index": chapter["index"],
+                        "part": part_idx,
+                        "view": sub
                     })
 
             total_chunks = len(chunks)
@@ -1650,18 +1870,145 @@ class TraceService:
             logger.info(f"Session {session_id}: Split into {total_chunks} chunks")
 
             extractor_prompt = get_trace_extractor_prompt()
+            # 聚焦窗口模式：只把含地点/移动信号的段落（及前后若干句）送入提取 Prompt
+            focus_mode = not mock_mode and (os.getenv("TRACE_FOCUS_WINDOWS") or "").strip().lower() in {"1", "true", "yes"}
+            focus_neighbors = max(0, self._env_int("TRACE_FOCUS_NEIGHBORS", 1))
+            cache_mode = "mock" if mock_mode else ("llm-focus" if focus_mode else "llm")
+            stats = self.sessions[session_id].setdefault("stats", {})
+            stats.update({
+                "chunks": total_chunks,
+                "llm_calls": 0,
+                "cache_hits": 0,
+                "context_mode": "running" if running_mode else "overlap",
+                "overlap_chars": overlap_chars,
+                "prompt_chars": 0
+            })
+            stats_lock = threading.Lock()
+            # 会话级重试预算：重试次数不超过调用次数的一定比例
+            retry_budget = RetryBudget(ratio=self._env_float("TRACE_RETRY_BUDGET", 0.2))
+            self.sessions[session_id]["retry_budget"] = retry_budget
+            # 提取阶段提前到期，给合并、分类与地理编码留出时间
+            deadline = self._session_deadline(session_id) or Deadline()
+            reserve = min(max(self._env_float("TRACE_DEADLINE_RESERVE", 0.2), 0.0), 0.9)
+            extraction_deadline = deadline.reserve(deadline.seconds * reserve) if deadline.seconds else deadline
+
+            def bump(key: str, n: int = 1) -> None:
+                with stats_lock:
+                    stats[key] = stats.get(key, 0) + n
+
+            # 本地预过滤：地点信号（候选地名、移动动词、已识别地名）低于阈值的片段不调用 LLM。
+            # 审计模式下不跳过，只记录每个片段的分数与是否产出结果，用于评估阈值
+            prefilter_threshold = self._env_float("TRACE_PREFILTER_THRESHOLD", 0.0)
+            prefilter_audit = (os.getenv("TRACE_PREFILTER_AUDIT") or "").strip().lower() in {"1", "true", "yes"}
+            # 难度路由：简单片段走加速模型，困难片段直接走主模型；加速模型结果校验不通过时改走主模型重提
+            routing = not mock_mode and (os.getenv("TRACE_ROUTING") or "").strip().lower() in {"1", "true", "yes"}
+            route_threshold = self._env_float("TRACE_ROUTE_THRESHOLD", 8.0)
+            route_validate = (os.getenv("TRACE_ROUTE_VALIDATE") or "1").strip().lower() not in {"0", "false", "no"}
+            if routing:
+                stats["routing"] = {"boost": 0, "main": 0, "rerouted": 0, "reasons": {}}
+            scorer = LocationSignalScorer() if (prefilter_threshold > 0 or prefilter_audit or focus_mode or routing) else None
+            prefilter_records: List[Dict[str, Any]] = []
+
+            def record_signal(score: Optional[float], result: Dict[str, Any]) -> None:
+                if scorer is None:
+                    return
+                scorer.learn(result)
+                if prefilter_audit:
+                    productive = bool((result.get("locations") or []) or (result.get("events") or []))
+                    with stats_lock:
+                        prefilter_records.append({"score": score, "productive": productive})
+
+            def process_chunk(
+                chunk: Dict[str, Any],
+                context: str = "",
+                entities: Optional[EntityDictionary] = None
+            ) -> Dict[str, Any]:
+                # 片段只在此处切成字符串，调用结束即释放
+                chunk_text = chunk["view"].text
+                score = scorer.score(chunk_text) if (prefilter_threshold > 0 or prefilter_audit) else None
+
+                refs: Dict[str, Dict[str, Any]] = {}
+                if entities is not None and not mock_mode:
+                    dict_text, refs = entities.for_chunk(chunk_text)
+                    context = dict_text + context
+
+                # 上下文不同则 Prompt 不同，缓存键带上上下文哈希
+                digest = f"{chunk['digest']}+{chunk_digest(context)}" if context else chunk["digest"]
+                cache_key = (cache_mode, chunk["chapter_title"], digest)
+                cached = self._get_cached_chunk(cache_key)
+                if cached is not None:
+                    bump("cache_hits")
+                    record_signal(score, cached)
+                    cached["_chunk_id"] = chunk["chunk_id"]
+                    return cached
+
+                if score is not None and not prefilter_audit and score < prefilter_threshold:
+                    # 不写入缓存，降低阈值后重新分析时仍会提取
+                    bump("prefilter_skipped")
+                    return {"locations": [], "events": [], "_chunk_id": chunk["chunk_id"]}
 
-            def process_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
                 if mock_mode:
-                    normalized = self._mock_extract_chunk(chunk.get("chapter_title") or "", chunk.get("text") or "")
-                    normalized["_chunk_id"] = chunk["chunk_id"]
-                    return normalized
-                messages = [
-                    {"role": "system", "content": extractor_prompt},
-                    {"role": "user", "content": f"章节信息：{chunk['chapter_title']}\n\n请分析以下文本片段（{chunk['chunk_id']}）：\n\n{chunk['text']}"}
-                ]
-                raw = self.llm.chat_json(messages, temperature=0.1, use_boost=True)
-                normalized = self._normalize_extraction_result(raw)
+                    normalized = self._mock_extract_chunk(chunk.get("chapter_title") or "", chunk_text)
+                else:
+                    windows: List[Tuple[int, int]] = []
+                    if focus_mode:
+                        windows = select_focus_windows(chunk_text, scorer.known, focus_neighbors)
+                        if not windows:
+                            bump("focus_empty")
+                            return {"locations": [], "events": [], "_chunk_id": chunk["chunk_id"]}
+                        bump("focus_input_chars", len(chunk_text))
+                        bump("focus_sent_chars", sum(b - a for a, b in windows))
+                        user_content = (
+                            f"章节信息：{chunk['chapter_title']}\n\n{context}"
+                            f"请分析以下文本片段（{chunk['chunk_id']}）。片段只保留了与地点相关的窗口，"
+                            f"【@n】表示窗口在原片段中的起始位置；每个事件请在 window 字段填写所在窗口的 n，"
+                            f"order_in_chunk 按原文先后编号：\n\n{self._format_focus_windows(chunk_text, windows)}"
+                        )
+                    else:
+                        user_content = self._extraction_user_prompt(chunk["chapter_title"], chunk["chunk_id"], chunk_text, context)
+                    messages = [
+                        {"role": "system", "content": extractor_prompt},
+                        {"role": "user", "content": user_content}
+                    ]
+
+                    def extract(use_boost: bool) -> Dict[str, Any]:
+                        bump("llm_calls")
+                        bump("prompt_chars", len(extractor_prompt) + len(user_content))
+                        usage: Dict[str, int] = {}
+                        # 不在调用内重试：失败的片段由批执行器排到新片段之后再试
+                        raw = self.llm.chat_json(
+                            messages, temperature=0.1, use_boost=use_boost, usage=usage, max_retries=0,
+                            deadline=extraction_deadline
+                        )
+                        for key, value in usage.items():
+                            bump(key, value)
+                        if refs:
+                            bump("entity_refs", expand_entity_refs(raw, refs))
+                        if windows:
+                            self._order_focus_events(raw, windows, chunk_text)
+                        return self._normalize_extraction_result(raw)
+
+                    if not routing:
+                        normalized = extract(True)
+                    else:
+                        use_boost = scorer.difficulty(chunk_text) < route_threshold
+                        with stats_lock:
+                            stats["routing"]["boost" if use_boost else "main"] += 1
+                        normalized = extract(use_boost)
+                        known_aliases = {e["name"]: e.get("aliases") or [] for e in refs.values()}
+                        reason = (
+                            validate_extraction(normalized, chunk_text, known_aliases)
+                            if (use_boost and route_validate) else None
+                        )
+                        if reason:
+                            logger.info(f"Chunk {chunk['chunk_id']} re-routed to main model: {reason}")
+                            with stats_lock:
+                                stats["routing"]["rerouted"] += 1
+                                reasons = stats["routing"]["reasons"]
+                                reasons[reason] = reasons.get(reason, 0) + 1
+                            normalized = extract(False)
+                self._put_cached_chunk(cache_key, normalized)
+                record_signal(score, normalized)
                 normalized["_chunk_id"] = chunk["chunk_id"]
                 return normalized
 
@@ -1685,31 +2032,123 @@ class TraceService:
                     max_workers = 64  # 避免过高导致系统资源耗尽或严重的 429
             max_workers = max(1, max_workers)
 
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {executor.submit(process_chunk, c): c for c in chunks}
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        res = future.result()
+            # 完全重复/近似重复的片段不单独调用 LLM，直接复用代表片段的结果
+            work, aliases = self._dedupe_chunks(chunks, stats)
+            results_by_chunk: Dict[str, Dict[str, Any]] = {}
+
+            # 已知实体词典模式：按原文顺序分波，波次大小逐波翻倍；每波结束后用已合并的地点与人物
+            # 重建词典注入后续片段，模型对已知实体只需引用编号
+            entity_mode = not mock_mode and (os.getenv("TRACE_ENTITY_DICT") or "").strip().lower() in {"1", "true", "yes"}
+
+            # running 模式按片段序号分波：第 k 波处理各章第 k 个片段，此时同章前序片段均已完成
+            if running_mode:
+                waves_by_part: Dict[int, List[Dict[str, Any]]] = {}
+                for c in work:
+                    waves_by_part.setdefault(c["part"], []).append(c)
+                waves = [waves_by_part[k] for k in sorted(waves_by_part)]
+            elif entity_mode:
+                waves = []
+                size = max(1, self._env_int("TRACE_ENTITY_FIRST_WAVE", 8))
+                pos = 0
+                while pos < len(work):
+                    waves.append(work[pos:pos + size])
+                    pos += size
+                    size *= 2
+            else:
+                waves = [work]
+            entity_dict: Optional[EntityDictionary] = None
+
+            chapter_chunk_ids: Dict[int, List[str]] = {}
+            for c in chunks:
+                chapter_chunk_ids.setdefault(c["chapter_index"], []).append(c["chunk_id"])
+
+            def running_context(chunk: Dict[str, Any]) -> str:
+                if not running_mode or chunk["part"] == 1:
+                    return ""
+                earlier = chapter_chunk_ids[chunk["chapter_index"]][:chunk["part"] - 1]
+                previous = [results_by_chunk.get(aliases.get(cid, cid)) for cid in earlier]
+                return self._build_running_context([r for r in previous if r])
+
+            batch_mode = not mock_mode and (os.getenv("TRACE_EXECUTION_MODE") or "").strip().lower() == "batch"
+            if batch_mode:
+                results_by_chunk.update(self._run_batch_extraction(
+                    session_id, work, cache_mode, extractor_prompt, stats, deadline=extraction_deadline
+                ))
+                extracted_results.extend(
+                    r for r in results_by_chunk.values()
+                    if (r.get("locations") or []) or (r.get("events") or [])
+                )
+                waves = []
+
+            # 失败的片段由批执行器排到新片段之后重试，重试次数受会话级预算约束
+            chunk_runner = RetryableAPIClient(
+                max_retries=max(0, self._env_int("TRACE_CHUNK_RETRIES", 2)), initial_delay=2.0, max_delay=30.0
+            )
+
+            for wave in waves:
+                if entity_mode and extracted_results:
+                    entity_dict = EntityDictionary.build(self._merge_locations(extracted_results)[0], extracted_results)
+                    stats["entity_dict_size"] = len(entity_dict)
+                jobs = [(c, running_context(c), entity_dict) for c in wave]
+                for idx, res, error in chunk_runner.iter_batch(
+                    jobs, lambda job: process_chunk(*job), max_workers=max_workers,
+                    budget=retry_budget, on_retry=lambda *_: bump("chunk_retries"), deadline=extraction_deadline
+                ):
+                    if error is None:
+                        results_by_chunk[jobs[idx][0]["chunk_id"]] = res
                         if (res.get("locations") or []) or (res.get("events") or []):
                             extracted_results.append(res)
-                    except Exception as e:
-                        logger.error(f"Chunk processing failed: {e}")
-                    finally:
-                        completed += 1
-                        progress = min(int((completed / total_chunks) * 90), 89)
-                        self.sessions[session_id]["progress"] = progress
-                        self.sessions[session_id]["status_msg"] = f"正在提取足迹: 已完成 {completed}/{total_chunks} 个片段..."
+                    elif isinstance(error, DeadlineExceeded):
+                        bump("deadline_skipped")
+                    else:
+                        bump("chunk_failures")
+                        logger.error(f"Chunk processing failed: {error}")
+                    completed += 1
+                    progress = min(int((completed / len(work)) * 90), 89)
+                    self.sessions[session_id]["progress"] = progress
+                    self.sessions[session_id]["status_msg"] = f"正在提取足迹: 已完成 {completed}/{len(work)} 个片段..."
+            stats["retry_budget"] = retry_budget.stats()
+            partial = bool(stats.get("deadline_skipped"))
+            if partial:
+                logger.warning(
+                    f"Session {session_id}: deadline reached, {stats['deadline_skipped']}/{len(work)} chunks "
+                    f"not extracted, continuing with partial results"
+                )
+
+            for alias_id, rep_id in aliases.items():
+                rep = results_by_chunk.get(rep_id)
+                if rep and ((rep.get("locations") or []) or (rep.get("events") or [])):
+                    reused = copy.deepcopy(rep)
+                    reused["_chunk_id"] = alias_id
+                    extracted_results.append(reused)
+
+            if prefilter_audit:
+                thresholds = sorted({0.5, 1.0, 1.5, 2.0, 3.0} | ({prefilter_threshold} if prefilter_threshold > 0 else set()))
+                stats["prefilter_report"] = prefilter_report(prefilter_records, thresholds)
+            elif scorer is not None:
+                stats["prefilter_threshold"] = prefilter_threshold
+                logger.info(f"Session {session_id}: prefilter skipped {stats.get('prefilter_skipped', 0)}/{len(work)} chunks")
+
+            if focus_mode and stats.get("focus_input_chars"):
+                stats["focus_ratio"] = round(stats.get("focus_sent_chars", 0) / stats["focus_input_chars"], 4)
 
             if not extracted_results:
+                if stats.get("batch_pending_id"):
+                    raise RuntimeError(
+                        f"批量任务 {stats['batch_pending_id']} 未在截止时间前完成，任务仍在运行，结果可稍后取回"
+                    )
                 raise RuntimeError("未能从文本中提取出有效信息")
 
             self.sessions[session_id]["status"] = "aggregating"
-            self.sessions[session_id]["status_msg"] = "正在合并地点与事件..."
+            self.sessions[session_id]["status_msg"] = "已到截止时间，正在合并已完成的部分..." if partial else "正在合并地点与事件..."
             self.sessions[session_id]["progress"] = 90
 
             chunk_order = [c["chunk_id"] for c in chunks]
 
             merged_locations, alias_to_id = self._merge_locations(extracted_results)
+            # 提取阶段给出的父级先作为候选，后续各阶段改写的父级再各自提交
+            hierarchy = HierarchyResolver()
+            hierarchy.add_locations(merged_locations, "extractor")
             for loc in merged_locations:
                 if loc.get("place_type") == "uncertain":
                     heuristic = self._heuristic_place_type(loc.get("id") or "")
@@ -1717,11 +2156,19 @@ class TraceService:
                         loc["place_type"] = heuristic
 
             # LLM Classification for Scope/Kind/Parent
-            context_map = self._compute_location_context(merged_locations, extracted_results, alias_to_id)
-            merged_locations = self._classify_locations_with_llm(merged_locations, session_id=session_id, context_map=context_map)
+            cooccurrence = CooccurrenceMatrix.build((l["id"] for l in merged_locations), extracted_results, alias_to_id)
+            context_map = self._compute_location_context(merged_locations, extracted_results, alias_to_id, cooccurrence)
+            merged_locations = self._classify_locations_with_llm(
+                merged_locations, session_id=session_id, context_map=context_map, cooccurrence=cooccurrence
+            )
             self._assign_parent_fallback(merged_locations, context_map, alias_to_id)
+            hierarchy.add_locations(merged_locations, "extractor")
 
             merged_events = self._merge_events(extracted_results, alias_to_id, chunk_order)
+            raw_events = sum(len(r.get("events") or []) for r in extracted_results)
+            stats["raw_events"] = raw_events
+            stats["merged_events"] = len(merged_events)
+            stats["duplicate_event_rate"] = round(1 - len(merged_events) / raw_events, 4) if raw_events else 0.0
             tracks = self._build_tracks(merged_events)
 
             self._geocode_locations(merged_locations, session_id=session_id)
@@ -1732,9 +2179,14 @@ class TraceService:
             real_map = self._build_real_map(merged_locations, tracks)
             
             # Pass merged_events to include event data in sub-maps
-            fictional_map = self._build_fictional_map(merged_locations, tracks, events=merged_events, session_id=session_id)
+            fictional_map = self._build_fictional_map(
+                merged_locations, tracks, events=merged_events, session_id=session_id,
+                cooccurrence=cooccurrence, hierarchy=hierarchy
+            )
 
+            stats["deadline"] = deadline.stats()
             result = {
+                "partial": partial,
                 "locations": merged_locations,
                 "events": [
                     {k: v for k, v in e.items() if not k.startswith("_")}
@@ -1755,7 +2207,7 @@ class TraceService:
             self.sessions[session_id]["result"] = result
             self.sessions[session_id]["status"] = "completed"
             self.sessions[session_id]["progress"] = 100
-            self.sessions[session_id]["status_msg"] = "分析完成"
+            self.sessions[session_id]["status_msg"] = "分析完成（已到截止时间，结果不完整）" if partial else "分析完成"
 
         except Exception as e:
             logger.error(f"Analysis failed for session {session_id}: {str(e)}")
@@ -1774,6 +2226,11 @@ class TraceService:
             "progress": session["progress"],
             "message": session["status_msg"]
         }
+        if session.get("document_id"):
+            response["document_id"] = session["document_id"]
+            response["chapter_range"] = session.get("chapter_range")
+        if session.get("stats"):
+            response["stats"] = session["stats"]
         if session["status"] == "completed":
             response["data"] = session["result"]
         if session["status"] == "failed":
@@ -0,0 +1,237 @@
+"""
+追迹本地信号检测
+不调用 LLM，用地名后缀、移动动词与已知地名给片段打分，
+供预过滤、上下文窗口选择与模型路由使用
+"""
+
+import bisect
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..utils.chunker import BoundaryIndex
+
+REAL_SUFFIXES = r"(?:省|市|县|区|镇|乡|路|街|道|站|机场|港|口岸|大学|学院|医院|公园|广场|桥|大厦|中心|村|胡同|里|弄)"
+FICTIONAL_SUFFIXES = r"(?:山|宗|门|派|城|谷|殿|宫|岛|界|国|林|洞|峰|海|原|域|府|寨|庄|阁|塔|观|寺|庙|祠|墓|陵|关|隘)"
+
+REAL_LOCATION_PATTERN = re.compile(rf'([一-鿿]{{2,12}}{REAL_SUFFIXES})')
+FICTIONAL_LOCATION_PATTERN = re.compile(rf'([一-鿿]{{2,12}}{FICTIONAL_SUFFIXES})')
+
+# 简单的人名提取：匹配"xx说"、"xx道"、"xx想"前面的 2-4 字中文
+CHARACTER_PATTERN = re.compile(r'([一-鿿]{2,4})(?:说|道|想|看|听|问|答|笑|哭|叫|喊|走|跑|飞|跳)')
+CHARACTER_STOPWORDS = frozenset({
+    "自己", "什么", "怎么", "哪里", "虽然", "但是", "因为", "所以", "如果", "突然",
+    "只见", "听见", "看见", "感觉", "觉得", "以为", "正在", "已经", "开始"
+})
+
+MOVEMENT_VERBS = (
+    "来到", "到了", "抵达", "前往", "赶往", "去往", "走进", "走出", "进入", "离开",
+    "回到", "返回", "出发", "动身", "启程", "赶到", "飞往", "飞向", "逃往", "逃到",
+    "穿过", "路过", "经过", "途经", "登上", "踏入", "踏上", "下山", "上山", "出城",
+    "进城", "入城", "出海", "渡过", "御剑", "传送", "直奔", "奔向", "搬到", "住进",
+    "落脚", "投宿", "迁往", "回府", "回宫", "回京"
+)
+MOVEMENT_PATTERN = re.compile('|'.join(MOVEMENT_VERBS))
+
+
+def find_location_candidates(text: str) -> List[str]:
+    """按出现顺序返回去重后的候选地名（现实在前、虚构在后）"""
+    seen: Set[str] = set()
+    result: List[str] = []
+    for pat in (REAL_LOCATION_PATTERN, FICTIONAL_LOCATION_PATTERN):
+        for name in pat.findall(text):
+            if name not in seen:
+                seen.add(name)
+                result.append(name)
+    return result
+
+
+class KnownNameIndex:
+    """
+    已识别地名（含别名）的索引，按前两个字分桶
+
+    在片段中查找已知地名只需一次逐字扫描，而不是对每个地名做一次子串查找
+    """
+
+    def __init__(self):
+        self._by_prefix: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, names: Iterable[str]) -> None:
+        with self._lock:
+            for name in names:
+                if not isinstance(name, str) or len(name) < 2:
+                    continue
+                bucket = self._by_prefix.setdefault(name[:2], set())
+                if name not in bucket:
+                    bucket.add(name)
+                    self.size += 1
+
+    def find_in(self, text: str) -> Set[str]:
+        hits: Set[str] = set()
+        by_prefix = self._by_prefix
+        if not by_prefix:
+            return hits
+        for i in range(len(text) - 1):
+            bucket = by_prefix.get(text[i:i + 2])
+            if bucket:
+                for name in tuple(bucket):
+                    if text.startswith(name, i):
+                        hits.add(name)
+        return hits
+
+
+class LocationSignalScorer:
+    """
+    片段的"地点信号"打分
+
+    score = 候选地名数 + 1.5 × 已知地名数 + 0.5 × min(移动动词数, 5)
+    """
+
+    def __init__(self):
+        self.known = KnownNameIndex()
+
+    def signals(self, text: str) -> Dict[str, int]:
+        return {
+            "candidates": len(find_location_candidates(text)),
+            "known": len(self.known.find_in(text)),
+            "movement": len(MOVEMENT_PATTERN.findall(text))
+        }
+
+    def score(self, text: str) -> float:
+        s = self.signals(text)
+        return s["candidates"] + 1.5 * s["known"] + 0.5 * min(s["movement"], 5)
+
+    def difficulty(self, text: str) -> float:
+        """
+        片段的提取难度，用于选择模型
+
+        difficulty = 每千字候选/已知地名数 + 0.5 × min(移动动词数, 10) + 千字数
+        （不足千字的片段按千字计密度，避免短片段密度虚高）
+        """
+        s = self.signals(text)
+        kchars = len(text) / 1000
+        return (s["candidates"] + s["known"]) / max(kchars, 1.0) + 0.5 * min(s["movement"], 10) + kchars
+
+    def learn(self, result: Dict) -> None:
+        """把一个片段的提取结果中的地名与别名加入已知地名"""
+        names: List[str] = []
+        for loc in result.get("locations") or []:
+            names.append(loc.get("id"))
+            names.extend(loc.get("aliases") or [])
+        for evt in result.get("events") or []:
+            names.append(evt.get("location"))
+        self.known.add(n for n in names if n)
+
+
+def select_focus_windows(
+    text: str,
+    known: Optional[KnownNameIndex] = None,
+    neighbors: int = 1
+) -> List[Tuple[int, int]]:
+    """
+    选出片段中与地点相关的窗口
+
+    含候选地名、已知地名或移动动词的段落整段保留，并向前后各扩展 neighbors 个句子；
+    相邻或重叠的部分合并为一个窗口
+
+    Returns:
+        按原文顺序排列的 [(start, end), ...]，为片段内偏移
+    """
+    if not text:
+        return []
+    index = BoundaryIndex(text)
+    paragraph_starts = [0] + list(index.paragraphs)
+    cuts = sorted(set(index.sentences) | set(index.paragraphs) | {0, len(text)})
+    # 段落之间的空白不算作句子，否则会占掉相邻句子的名额
+    sentences = [(a, b) for a, b in zip(cuts, cuts[1:]) if text[a:b].strip()]
+
+    para_ids = [bisect.bisect_right(paragraph_starts, a) - 1 for a, _ in sentences]
+    signal_paras: Set[int] = set()
+    for pid, start in enumerate(paragraph_starts):
+        end = paragraph_starts[pid + 1] if pid + 1 < len(paragraph_starts) else len(text)
+        para = text[start:end]
+        if (MOVEMENT_PATTERN.search(para) or REAL_LOCATION_PATTERN.search(para)
+                or FICTIONAL_LOCATION_PATTERN.search(para) or (known is not None and known.find_in(para))):
+            signal_paras.add(pid)
+    if not signal_paras:
+        return []
+
+    selected = [False] * len(sentences)
+    for i, pid in enumerate(para_ids):
+        if pid in signal_paras:
+            lo = max(0, i - neighbors)
+            hi = min(len(sentences) - 1, i + neighbors)
+            for j in range(lo, hi + 1):
+                selected[j] = True
+
+    windows: List[Tuple[int, int]] = []
+    for (a, b), keep in zip(sentences, selected):
+        if not keep:
+            continue
+        if windows and not text[windows[-1][1]:a].strip():
+            windows[-1] = (windows[-1][0], b)
+        else:
+            windows.append((a, b))
+
+    # 去掉窗口首尾空白，保持偏移指向原文
+    result: List[Tuple[int, int]] = []
+    for a, b in windows:
+        while a < b and text[a].isspace():
+            a += 1
+        while b > a and text[b - 1].isspace():
+            b -= 1
+        if b > a:
+            result.append((a, b))
+    return result
+
+
+def validate_extraction(result: Dict, text: str, aliases: Optional[Dict[str, List[str]]] = None) -> Optional[str]:
+    """
+    对加速模型的提取结果做事后检查
+
+    Args:
+        aliases: 规范名 -> 别名；实体编号还原成规范名后，原文里出现的可能只是别名
+
+    Returns:
+        不可信的原因；结果看起来合理时返回 None
+    """
+    events = result.get("events") or []
+    if not events:
+        if len(find_location_candidates(text)) >= 2 and MOVEMENT_PATTERN.search(text):
+            return "empty_with_signal"
+        return None
+    names_in_text = 0
+    for evt in events:
+        loc = evt.get("location") or ""
+        if not loc:
+            continue
+        if loc in text or any(a and a in text for a in (aliases or {}).get(loc, ())):
+            names_in_text += 1
+    if names_in_text * 2 < len(events):
+        return "locations_not_in_text"
+    return None
+
+
+def prefilter_report(records: List[Dict], thresholds: Iterable[float]) -> Dict[str, Dict[str, float]]:
+    """
+    根据完整运行记录（每个片段的分数与是否产出结果）评估各阈值的召回与节省
+
+    Args:
+        records: [{"score": float, "productive": bool}, ...]
+        thresholds: 待评估的阈值
+    """
+    total = len(records)
+    productive = sum(1 for r in records if r["productive"])
+    report: Dict[str, Dict[str, float]] = {}
+    for t in thresholds:
+        skipped = [r for r in records if r["score"] < t]
+        missed = sum(1 for r in skipped if r["productive"])
+        report[f"{t:g}"] = {
+            "skipped": len(skipped),
+            "missed_productive": missed,
+            "recall": round((productive - missed) / productive, 4) if productive else 1.0,
+            "savings": round(len(skipped) / total, 4) if total else 0.0
+        }
+    return report
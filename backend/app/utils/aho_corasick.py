@@ -0,0 +1,78 @@
+"""
+Aho-Corasick 多模式匹配
+一次扫描找出文本中所有模式（含重叠）的出现位置，代替对每个模式分别做子串查找
+"""
+
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class AhoCorasick:
+    """
+    Args:
+        patterns: 模式串（空串与重复项会被忽略）
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 以该节点结尾的模式（至多一个）
+        self._word: List[Optional[str]] = [None]
+        # 沿失败链最近的、有模式结尾的节点
+        self._dict_link: List[int] = [0]
+        self._size = 0
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, pattern: str) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._word.append(None)
+                self._dict_link.append(0)
+            node = nxt
+        if self._word[node] is None:
+            self._word[node] = pattern
+            self._size += 1
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                fail = self._fail[child]
+                self._dict_link[child] = fail if self._word[fail] is not None else self._dict_link[fail]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """按结束位置依次产出 (起点, 终点, 模式)，终点不含"""
+        goto, fail, word, dict_link = self._goto, self._fail, self._word, self._dict_link
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if word[node] is not None else dict_link[node]
+            while hit:
+                pattern = word[hit]
+                yield i + 1 - len(pattern), i + 1, pattern
+                hit = dict_link[hit]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        return list(self.iter_matches(text))
@@ -0,0 +1,162 @@
+"""
+Batch API 客户端
+通过 OpenAI 兼容的 /files 与 /batches 接口批量提交聊天请求：
+写 JSONL -> 上传 -> 创建批任务 -> 轮询 -> 下载结果
+"""
+
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from openai import OpenAI
+
+from ..config import Config
+from .http_pool import get_shared_http_client
+from .logger import get_logger
+
+logger = get_logger('footprints.batch')
+
+_TERMINAL_FAILURES = {"failed", "expired", "cancelled", "cancelling"}
+
+
+class BatchTimeout(RuntimeError):
+    """等待超时时批任务仍在远端运行；保留 batch_id，之后可用 wait / fetch_results 取回结果"""
+
+    def __init__(self, batch_id: str, message: str):
+        super().__init__(message)
+        self.batch_id = batch_id
+
+
+class BatchClient:
+    """
+    Args:
+        poll_interval: 轮询间隔（秒）
+        timeout: 等待批任务完成的最长时间（秒）
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.api_key = api_key or Config.LLM_API_KEY
+        self.base_url = base_url or Config.LLM_BASE_URL
+        self.model = model or Config.LLM_MODEL_NAME
+        self.poll_interval = Config.LLM_BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.timeout = Config.LLM_BATCH_TIMEOUT if timeout is None else timeout
+
+        if not self.api_key:
+            raise ValueError("LLM_API_KEY 未配置")
+
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=300.0,
+            http_client=get_shared_http_client()
+        )
+
+    def build_jsonl(
+        self,
+        requests: Dict[str, List[Dict[str, str]]],
+        temperature: float = 0.1,
+        max_tokens: int = 4096
+    ) -> bytes:
+        """每个 custom_id 一行 /v1/chat/completions 请求"""
+        lines = []
+        for custom_id, messages in requests.items():
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "response_format": {"type": "json_object"}
+                }
+            }, ensure_ascii=False))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def submit(self, jsonl: bytes) -> str:
+        uploaded = self.client.files.create(file=("batch_input.jsonl", jsonl), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window=Config.LLM_BATCH_COMPLETION_WINDOW
+        )
+        logger.info(f"Batch {batch.id} submitted (input file {uploaded.id})")
+        return batch.id
+
+    def wait(
+        self,
+        batch_id: str,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        轮询直到批任务完成；失败、过期或取消时抛出 RuntimeError，
+        等待超时抛出 BatchTimeout（远端任务不取消，已计费的结果仍可取回）
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = getattr(batch, "request_counts", None)
+            if on_progress and counts is not None:
+                on_progress(int(counts.completed or 0) + int(counts.failed or 0), int(counts.total or 0))
+            if batch.status == "completed":
+                return batch
+            if batch.status in _TERMINAL_FAILURES:
+                raise RuntimeError(f"Batch {batch_id} 结束于状态 {batch.status}")
+            if time.monotonic() >= deadline:
+                raise BatchTimeout(batch_id, f"Batch {batch_id} 等待超时（{timeout:.0f}s）")
+            time.sleep(self.poll_interval)
+
+    def fetch_results(self, batch: Any) -> Dict[str, Optional[str]]:
+        """
+        Returns:
+            {custom_id: 模型返回的文本}；单条请求失败时值为 None
+        """
+        results: Dict[str, Optional[str]] = {}
+        for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                custom_id = item.get("custom_id")
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results.setdefault(custom_id, None)
+                    continue
+                try:
+                    results[custom_id] = body["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    results.setdefault(custom_id, None)
+        return results
+
+    def run(
+        self,
+        requests: Dict[str, List[Dict[str, str]]],
+        temperature: float = 0.1,
+        max_tokens: int = 4096,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Optional[str]]:
+        """提交并等待一批请求，返回 {custom_id: 文本或 None}；timeout 可进一步缩短等待时间"""
+        if not requests:
+            return {}
+        batch_id = self.submit(self.build_jsonl(requests, temperature=temperature, max_tokens=max_tokens))
+        batch = self.wait(batch_id, on_progress=on_progress, timeout=timeout)
+        results = self.fetch_results(batch)
+        missing = [cid for cid in requests if cid not in results]
+        if missing:
+            logger.warning(f"Batch {batch_id}: {len(missing)} requests have no result")
+        return {cid: results.get(cid) for cid in requests}
@@ -0,0 +1,96 @@
+"""
+文本分块引擎
+TraceService 与 RelationshipService 共用
+
+整本文本的段落/句子边界只用编译好的正则扫描一次，切分时对边界索引做二分查找，
+不再为每个窗口切片并逐个分隔符 rfind
+"""
+
+import bisect
+import hashlib
+import re
+from array import array
+from typing import List, Optional, Union
+
+from .text_view import TextView
+
+_PARAGRAPH_BREAK = re.compile(r'\n\n')
+# 中文句末标点（连同紧随其后的右引号），以及英文句点后接空格/换行
+_SENTENCE_END = re.compile(r'[。！？]+[”’」』"\']?|[.!?][\n ]')
+
+
+def chunk_digest(text: Union[str, TextView]) -> str:
+    """片段内容哈希，作为与位置无关的片段 ID（缓存/去重的键）"""
+    if isinstance(text, TextView):
+        text = text.text
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class BoundaryIndex:
+    """一段文本中所有段落、句子边界（分隔符之后的绝对偏移），升序存放"""
+
+    __slots__ = ('source', 'paragraphs', 'sentences')
+
+    def __init__(self, source: str, start: int = 0, end: Optional[int] = None):
+        end = len(source) if end is None else end
+        self.source = source
+        self.paragraphs = array('q', (m.end() for m in _PARAGRAPH_BREAK.finditer(source, start, end)))
+        self.sentences = array('q', (m.end() for m in _SENTENCE_END.finditer(source, start, end)))
+
+    @staticmethod
+    def _last_in(positions: array, lo: int, hi: int) -> int:
+        """positions 中落在 (lo, hi] 内的最大值，没有则返回 -1"""
+        i = bisect.bisect_right(positions, hi) - 1
+        if i >= 0 and positions[i] > lo:
+            return positions[i]
+        return -1
+
+    def cut_point(self, start: int, end: int, min_end: int) -> int:
+        """在 (min_end, end] 内优先找段落边界，其次找句子边界，都没有就硬切在 end"""
+        pos = self._last_in(self.paragraphs, min_end, end)
+        if pos == -1:
+            pos = self._last_in(self.sentences, min_end, end)
+        return pos if pos != -1 else end
+
+
+class TextChunker:
+    """
+    滑动窗口分块
+
+    Args:
+        chunk_size: 每块最大字符数
+        overlap: 相邻块的重叠字符数
+        min_chars: 去除首尾空白后短于此长度的块会被丢弃（页码、空行等）
+    """
+
+    def __init__(self, chunk_size: int = 2000, overlap: int = 400, min_chars: int = 10):
+        self.chunk_size = max(1, chunk_size)
+        self.overlap = max(0, overlap)
+        self.min_chars = min_chars
+
+    def chunk(self, text: Union[str, TextView], index: Optional[BoundaryIndex] = None) -> List[TextView]:
+        view = text if isinstance(text, TextView) else TextView(text)
+        if len(view) <= self.chunk_size:
+            return [view] if view.strip() else []
+
+        if index is None or index.source is not view.source:
+            index = BoundaryIndex(view.source, view.start, view.end)
+
+        chunks: List[TextView] = []
+        start = view.start
+        stop = view.end
+        while start < stop:
+            end = min(start + self.chunk_size, stop)
+            if end < stop:
+                # 边界必须落在窗口后半段，避免切出过小的块
+                end = index.cut_point(start, end, start + int(self.chunk_size * 0.5))
+
+            chunk = TextView(view.source, start, end).strip()
+            if len(chunk) > self.min_chars:
+                chunks.append(chunk)
+
+            if end >= stop:
+                break
+            start = end - self.overlap if end - self.overlap > start else end
+
+        return chunks
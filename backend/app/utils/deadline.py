@@ -0,0 +1,105 @@
+"""
+会话截止时间
+一次分析从开始就确定最晚结束时间，剩余时间逐级传给每个 LLM 调用、重试等待与地理编码请求；
+时间快到时各阶段放弃未开始的工作，返回已有的部分结果
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """截止时间已到，不再发起新的调用（不可重试）"""
+
+
+class Deadline:
+    """
+    Args:
+        seconds: 从现在起的可用秒数；None 或 <= 0 表示不限时
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.started_at = time.monotonic()
+        self.expires_at: Optional[float] = self.started_at + self.seconds if self.seconds else None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.expires_at is None
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数（不小于 0）；不限时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, what: str = "调用") -> None:
+        """已到期时抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded(f"已超过 {self.seconds:.0f} 秒截止时间，放弃{what}")
+
+    def allows(self, seconds: float) -> bool:
+        """再等 seconds 秒后是否仍在截止时间之内"""
+        remaining = self.remaining()
+        return remaining is None or remaining > seconds
+
+    def timeout(self, cap: float) -> float:
+        """单次请求的超时：不超过 cap，也不超过剩余时间；已到期时抛出 DeadlineExceeded"""
+        self.check()
+        remaining = self.remaining()
+        return cap if remaining is None else min(cap, remaining)
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """提前 seconds 秒到期的子截止时间，给后续阶段留出时间"""
+        child = Deadline()
+        child.started_at = self.started_at
+        if self.expires_at is not None:
+            child.seconds = max(0.0, self.seconds - seconds)
+            child.expires_at = self.expires_at - seconds
+        return child
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "elapsed": round(time.monotonic() - self.started_at, 2),
+            "expired": self.expired()
+        }
+
+
+def resolve_deadline(
+    seconds: Optional[float] = None,
+    tier: Optional[str] = None,
+    env: str = "TRACE_DEADLINE",
+    default: float = 0.0
+) -> Deadline:
+    """
+    会话截止时间：默认取环境变量 env（秒，0 为不限时），未配置时不限时；
+    TRACE_DEADLINE_TIERS 为 JSON 对象（如 {"fast": 120, "full": 3600}）时按 tier 取上限；
+    请求里指定的 seconds 只能缩短，不能超过该上限
+
+    Raises:
+        ValueError: tier 未配置，或 seconds 不是正数
+    """
+    try:
+        value = os.getenv(env)
+        limit = float(value) if value else default
+    except Exception:
+        limit = default
+    if tier:
+        try:
+            tiers = json.loads(os.getenv("TRACE_DEADLINE_TIERS") or "{}")
+        except ValueError:
+            tiers = {}
+        if tier not in tiers:
+            raise ValueError(f"未知的 tier: {tier}")
+        limit = float(tiers[tier])
+    if seconds is not None:
+        if seconds <= 0:
+            raise ValueError("deadline_seconds 必须为正数")
+        limit = min(seconds, limit) if limit > 0 else seconds
+    return Deadline(limit)
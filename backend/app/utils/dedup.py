@@ -0,0 +1,84 @@
+"""
+片段近似去重
+基于 bottom-k MinHash 草图 + LSH 分桶，在调用 LLM 之前识别完全重复与高度相似的片段
+（作者的话、"本章未完"、广告段落、重复上传的章节等）
+"""
+
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+SHINGLE_SIZE = 3
+
+
+def minhash_sketch(text: str, k: int = 64, shingle: int = SHINGLE_SIZE) -> Tuple[int, ...]:
+    """
+    取所有字符 n-gram 哈希值中最小的 k 个（升序）
+
+    同一进程内 hash() 是稳定的，足以在一次分析内比较片段
+    """
+    if len(text) < shingle:
+        return (hash(text),) if text else ()
+    hashes = {hash(text[i:i + shingle]) for i in range(len(text) - shingle + 1)}
+    return tuple(heapq.nsmallest(k, hashes))
+
+
+def estimate_jaccard(a: Tuple[int, ...], b: Tuple[int, ...], k: int = 64) -> float:
+    """用两份 bottom-k 草图估计原集合的 Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    sa, sb = set(a), set(b)
+    union_bottom = heapq.nsmallest(k, sa | sb)
+    shared = sa & sb
+    return sum(1 for v in union_bottom if v in shared) / len(union_bottom)
+
+
+class DuplicateDetector:
+    """
+    按顺序登记片段，返回其应当复用的代表片段
+
+    Args:
+        threshold: 估计 Jaccard 相似度达到该值即视为近似重复
+        k: 草图大小
+        bands: 用草图中最小的若干个值作为 LSH 桶键
+        min_chars: 短于此长度的片段只做完全重复判断（短文本的草图不可靠）
+    """
+
+    def __init__(self, threshold: float = 0.9, k: int = 64, bands: int = 8, min_chars: int = 50):
+        self.threshold = threshold
+        self.k = k
+        self.bands = bands
+        self.min_chars = min_chars
+        self._by_digest: Dict[str, str] = {}
+        self._sketches: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[int, List[str]] = {}
+        self.exact = 0
+        self.near = 0
+
+    def find(self, key: str, digest: str, text: str) -> Optional[str]:
+        """
+        Returns:
+            代表片段的 key；如果该片段是新内容则登记并返回 None
+        """
+        rep = self._by_digest.get(digest)
+        if rep is not None:
+            self.exact += 1
+            return rep
+
+        sketch = minhash_sketch(text, self.k) if len(text) >= self.min_chars else ()
+        if sketch:
+            seen = set()
+            for band in sketch[:self.bands]:
+                for cand in self._buckets.get(band, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    if estimate_jaccard(sketch, self._sketches[cand], self.k) >= self.threshold:
+                        self.near += 1
+                        return cand
+
+        self._by_digest[digest] = key
+        if sketch:
+            self._sketches[key] = sketch
+            for band in sketch[:self.bands]:
+                self._buckets.setdefault(band, []).append(key)
+        return None
@@ -0,0 +1,207 @@
+"""
+LLM 端点池
+把多个 (base_url, api_key, model) 端点按权重、并发上限做最少在途请求负载均衡；
+鉴权失败的端点自动摘除，429 限流的端点冷却一段时间后再用
+"""
+
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from openai import OpenAI
+
+from ..config import Config
+from .http_pool import get_shared_http_client
+from .logger import get_logger
+from .retry import retry_after_seconds
+
+logger = get_logger('footprints.endpoint_pool')
+
+# 鉴权/权限错误：该端点的 key 不可用，直接摘除
+_AUTH_STATUS = {401, 403}
+_RATE_LIMIT_STATUS = 429
+
+
+class NoEndpointAvailable(RuntimeError):
+    """指定层级没有可用端点（全部被摘除，或等待超时）"""
+
+
+class Endpoint:
+    """
+    Args:
+        tier: "main" 主模型 / "boost" 加速模型
+        weight: 权重，越大分到的请求越多
+        max_concurrency: 该端点同时在途的请求上限
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        api_key: str,
+        model: str,
+        tier: str = "main",
+        weight: float = 1.0,
+        max_concurrency: int = 32,
+        client: Any = None
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.tier = tier
+        self.weight = max(float(weight), 0.01)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.client = client or OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=300.0,
+            # 重试统一由 LLMClient 按错误分类与重试预算处理，SDK 不再自行重试
+            max_retries=0,
+            http_client=get_shared_http_client()
+        )
+        self.outstanding = 0
+        self.served = 0
+        self.errors = 0
+        self.disabled_reason: Optional[str] = None
+        self.cooldown_until = 0.0
+
+
+class EndpointPool:
+    """
+    Args:
+        endpoints: 端点列表
+        cooldown: 429 限流且服务端未给出 Retry-After 时的冷却时间（秒）
+    """
+
+    def __init__(self, endpoints: List[Endpoint], cooldown: float = 30.0):
+        self.endpoints = list(endpoints)
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+
+    def has_tier(self, tier: str) -> bool:
+        return any(e.tier == tier and not e.disabled_reason for e in self.endpoints)
+
+    def acquire(self, tier: str = "main", timeout: Optional[float] = None) -> Endpoint:
+        """
+        取一个在途请求最少（按权重折算）的端点；全部满载或冷却中时阻塞等待，
+        timeout=0 时不等待，没有立即可用的端点直接抛出
+
+        Raises:
+            NoEndpointAvailable: 该层级没有未摘除的端点，或等待超过 timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                candidates = [e for e in self.endpoints if e.tier == tier and not e.disabled_reason]
+                if not candidates:
+                    raise NoEndpointAvailable(f"没有可用的 {tier} 端点")
+                ready = [e for e in candidates if e.cooldown_until <= now and e.outstanding < e.max_concurrency]
+                if ready:
+                    endpoint = min(ready, key=lambda e: (e.outstanding + 1) / e.weight)
+                    endpoint.outstanding += 1
+                    return endpoint
+
+                wait: Optional[float] = None
+                cooling = [e.cooldown_until - now for e in candidates if e.cooldown_until > now]
+                if cooling:
+                    wait = min(cooling)
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise NoEndpointAvailable(f"等待 {tier} 端点超时")
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(timeout=wait)
+
+    def release(self, endpoint: Endpoint, error: Optional[BaseException] = None) -> None:
+        """归还端点；根据错误类型摘除或冷却该端点"""
+        with self._cond:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.served += 1
+            else:
+                endpoint.errors += 1
+                status = getattr(error, "status_code", None)
+                if status in _AUTH_STATUS:
+                    endpoint.disabled_reason = f"HTTP {status}"
+                    logger.error(f"端点 {endpoint.name} 鉴权失败，已从池中摘除: {error}")
+                elif status == _RATE_LIMIT_STATUS:
+                    # 服务端给了 Retry-After 就按它冷却，否则用默认冷却时间
+                    wait = retry_after_seconds(error)
+                    if wait is None:
+                        wait = self.cooldown
+                    endpoint.cooldown_until = time.monotonic() + wait
+                    logger.warning(f"端点 {endpoint.name} 被限流，冷却 {wait:.0f} 秒")
+            self._cond.notify_all()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._cond:
+            return [{
+                "name": e.name,
+                "tier": e.tier,
+                "model": e.model,
+                "weight": e.weight,
+                "max_concurrency": e.max_concurrency,
+                "outstanding": e.outstanding,
+                "served": e.served,
+                "errors": e.errors,
+                "disabled": e.disabled_reason,
+                "cooldown_remaining": round(max(0.0, e.cooldown_until - now), 1)
+            } for e in self.endpoints]
+
+
+def endpoints_from_config() -> List[Endpoint]:
+    """
+    LLM_ENDPOINTS 为 JSON 数组时按其配置端点，例如：
+        [{"base_url": "...", "api_key": "...", "model": "...", "tier": "main", "weight": 2, "max_concurrency": 32}]
+    否则沿用 LLM_API_KEY / LLM_BOOST_API_KEY 的单主模型 + 可选加速模型配置
+    """
+    endpoints: List[Endpoint] = []
+    if Config.LLM_ENDPOINTS:
+        specs = json.loads(Config.LLM_ENDPOINTS)
+        for i, spec in enumerate(specs, start=1):
+            tier = spec.get("tier") or "main"
+            default_model = Config.LLM_BOOST_MODEL_NAME if tier == "boost" else Config.LLM_MODEL_NAME
+            endpoints.append(Endpoint(
+                name=spec.get("name") or f"{tier}-{i}",
+                base_url=spec.get("base_url") or Config.LLM_BASE_URL,
+                api_key=spec["api_key"],
+                model=spec.get("model") or default_model,
+                tier=tier,
+                weight=spec.get("weight", 1.0),
+                max_concurrency=spec.get("max_concurrency", 32)
+            ))
+        return endpoints
+
+    if Config.LLM_API_KEY:
+        endpoints.append(Endpoint("main", Config.LLM_BASE_URL, Config.LLM_API_KEY, Config.LLM_MODEL_NAME, max_concurrency=64))
+    endpoints.extend(boost_endpoints_from_config())
+    return endpoints
+
+
+def boost_endpoints_from_config() -> List[Endpoint]:
+    if Config.LLM_ENDPOINTS or not Config.LLM_BOOST_API_KEY:
+        return []
+    return [Endpoint(
+        "boost",
+        Config.LLM_BOOST_BASE_URL or Config.LLM_BASE_URL,
+        Config.LLM_BOOST_API_KEY,
+        Config.LLM_BOOST_MODEL_NAME,
+        tier="boost",
+        max_concurrency=64
+    )]
+
+
+_shared_pool: Optional[EndpointPool] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_pool() -> EndpointPool:
+    """进程内共享的端点池，TraceService 与 RelationshipService 的 LLMClient 共用"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = EndpointPool(endpoints_from_config(), cooldown=Config.LLM_ENDPOINT_COOLDOWN)
+        return _shared_pool
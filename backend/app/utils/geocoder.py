@@ -49,7 +49,7 @@ class NominatimGeocoder:
         with self._lock:
             self._save_cache(force=True)
 
-    def geocode(self, query: str) -> Optional[Dict[str, Any]]:
+    def geocode(self, query: str, timeout: float = 15.0) -> Optional[Dict[str, Any]]:
         query = (query or '').strip()
         if not query:
             return None
@@ -82,7 +82,7 @@ class NominatimGeocoder:
                 "User-Agent": "footprints/0.1 (local project)"
             }
             try:
-                resp = requests.get(url, params=params, headers=headers, timeout=15)
+                resp = requests.get(url, params=params, headers=headers, timeout=timeout)
                 self._last_request_ts = time.time()
                 resp.raise_for_status()
                 data = resp.json()
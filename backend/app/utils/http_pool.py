@@ -0,0 +1,163 @@
+"""
+进程内共享的 HTTP 连接池
+所有 OpenAI 客户端（各端点、各服务的 LLMClient、Batch 客户端）复用同一个 httpx.Client，
+避免几十个并发线程反复建连与 TLS 握手；安装了 h2 时启用 HTTP/2
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from ..config import Config
+from .logger import get_logger
+
+logger = get_logger('footprints.http_pool')
+
+_client: Any = None
+_http2_enabled = False
+_client_lock = threading.Lock()
+_counters: Dict[str, int] = {"requests": 0, "responses": 0, "errors": 0, "in_flight": 0, "prewarmed": 0}
+_versions: Dict[str, int] = {}
+_counter_lock = threading.Lock()
+
+
+def _bump(key: str, n: int = 1) -> None:
+    with _counter_lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def _record_response(response: Any) -> None:
+    _bump("responses")
+    version = getattr(response, "http_version", None) or "unknown"
+    with _counter_lock:
+        _versions[version] = _versions.get(version, 0) + 1
+
+
+def _counting_client_class(httpx: Any) -> Any:
+    """
+    在 send 外层计数的 httpx.Client 子类：in_flight 在 finally 里归还，
+    建连失败、超时、连接被重置等没有响应的请求也不会让它只增不减
+    """
+
+    class CountingClient(httpx.Client):
+        def send(self, request: Any, **kwargs: Any) -> Any:
+            _bump("requests")
+            _bump("in_flight")
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                _bump("errors")
+                raise
+            finally:
+                _bump("in_flight", -1)
+            _record_response(response)
+            return response
+
+    return CountingClient
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_shared_http_client() -> Optional[Any]:
+    """
+    Returns:
+        共享的 httpx.Client；未安装 httpx 或 LLM_HTTP_SHARED=false 时返回 None（各客户端使用 SDK 默认连接池）
+    """
+    global _client, _http2_enabled
+    if not Config.LLM_HTTP_SHARED:
+        return None
+    with _client_lock:
+        if _client is not None:
+            return _client
+        try:
+            import httpx
+        except ImportError:
+            logger.warning("未安装 httpx，LLM 客户端将使用各自的默认连接池")
+            return None
+
+        http2 = Config.LLM_HTTP2 and _http2_available()
+        _http2_enabled = http2
+        _client = _counting_client_class(httpx)(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=Config.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.LLM_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=Config.LLM_HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(300.0, connect=10.0),
+            follow_redirects=True
+        )
+        logger.info(
+            f"共享 HTTP 连接池已创建: max_connections={Config.LLM_HTTP_MAX_CONNECTIONS}, "
+            f"keepalive={Config.LLM_HTTP_MAX_KEEPALIVE}, http2={http2}"
+        )
+        return _client
+
+
+def prewarm(base_urls: Iterable[str], connections_per_host: Optional[int] = None) -> int:
+    """
+    对每个服务商域名预先建立若干条连接（完成 DNS、TCP 与 TLS 握手），首批请求不再付建连开销
+
+    请求失败（如 404、鉴权错误）不影响连接复用，一律忽略
+
+    Returns:
+        成功预热的连接数
+    """
+    client = get_shared_http_client()
+    if client is None:
+        return 0
+    per_host = Config.LLM_HTTP_PREWARM if connections_per_host is None else connections_per_host
+    origins = sorted({f"{p.scheme}://{p.netloc}" for p in (urlsplit(u) for u in base_urls if u) if p.netloc})
+    targets = [o for o in origins for _ in range(max(0, per_host))]
+    if not targets:
+        return 0
+
+    def touch(origin: str) -> bool:
+        try:
+            client.head(origin, timeout=10.0)
+            return True
+        except Exception as e:
+            logger.debug(f"预热 {origin} 失败: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=min(len(targets), 16)) as executor:
+        warmed = sum(1 for ok in executor.map(touch, targets) if ok)
+    _bump("prewarmed", warmed)
+    logger.info(f"已预热 {warmed}/{len(targets)} 条连接: {', '.join(origins)}")
+    return warmed
+
+
+def pool_stats() -> Dict[str, Any]:
+    """请求计数（含未拿到响应的失败数）、HTTP 版本分布，以及 httpcore 连接池中的连接状态"""
+    with _counter_lock:
+        stats: Dict[str, Any] = dict(_counters)
+        stats["http_versions"] = dict(_versions)
+    stats["shared"] = _client is not None
+    if _client is None:
+        return stats
+
+    stats["http2"] = _http2_enabled
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = 0
+    for conn in connections:
+        try:
+            idle += 1 if conn.is_idle() else 0
+        except Exception:
+            pass
+    stats["connections"] = len(connections)
+    stats["idle_connections"] = idle
+    stats["active_connections"] = len(connections) - idle
+    stats["limits"] = {
+        "max_connections": Config.LLM_HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": Config.LLM_HTTP_MAX_KEEPALIVE,
+        "keepalive_expiry": Config.LLM_HTTP_KEEPALIVE_EXPIRY
+    }
+    return stats
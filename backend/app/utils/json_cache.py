@@ -0,0 +1,87 @@
+"""
+落盘的 JSON 键值缓存
+跨会话复用结果（如地点分类），按最近使用淘汰，累计若干次写入后才保存一次
+"""
+
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class JsonFileCache:
+    """
+    Args:
+        cache_path: 缓存文件路径，为空时只在内存中缓存
+        max_entries: 最多保留的条目数
+        save_every: 累计多少次写入后落盘一次（flush 时总会落盘）；为 0 时只在 flush 时落盘
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, max_entries: int = 50000, save_every: int = 20):
+        self.cache_path = cache_path
+        self.max_entries = max(1, max_entries)
+        self.save_every = max(0, save_every)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._unsaved_changes = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _load(self) -> None:
+        if not self.cache_path:
+            return
+        try:
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self._data = OrderedDict((k, v) for k, v in data.items() if isinstance(v, dict))
+                    self._evict()
+        except Exception:
+            self._data = OrderedDict()
+
+    def _evict(self) -> None:
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def _save(self, force: bool = False) -> None:
+        if not self.cache_path:
+            return
+        if not force and (not self.save_every or self._unsaved_changes < self.save_every):
+            return
+        if not self._unsaved_changes:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            # 先写临时文件再替换，进程中途退出也不会留下半个文件
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+            self._unsaved_changes = 0
+        except Exception:
+            pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                return None
+            self._data.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = copy.deepcopy(value)
+            self._data.move_to_end(key)
+            self._evict()
+            self._unsaved_changes += 1
+            self._save()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._save(force=True)
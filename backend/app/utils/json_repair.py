@@ -0,0 +1,169 @@
+"""
+容错 JSON 解析
+模型输出常见的小毛病（代码块包裹、前后说明文字、多余逗号、注释、输出被截断）在本地修复，
+不必为一个括号再付一次完整请求的费用
+"""
+
+import json
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+_FENCE_PATTERN = re.compile(r'```(?:json|JSON)?\s*\n?(.*?)(?:```|$)', re.DOTALL)
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_MAX_STARTS = 5
+
+_stats: Dict[str, int] = {"strict": 0, "extracted": 0, "repaired": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def _bump(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def repair_stats() -> Dict[str, int]:
+    """进程内累计：strict 直接解析 / extracted 去掉包裹文字 / repaired 修补结构 / failed 无法修复"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _repair(text: str, start: int) -> str:
+    """
+    从 start 处的 { 或 [ 开始逐字符扫描：去掉注释与多余逗号，顶层值结束后的文字一律丢弃；
+    文本在中途截断时，退回到最后一个完整元素之后，再补齐未闭合的括号
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # 各层括号在输出中的起始位置
+    opens: List[int] = []
+    # 最近一个可以安全截断的位置：(输出长度, 当时的括号栈)
+    safe: Tuple[int, List[str]] = (0, [])
+    in_string = False
+    escaped = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                # 字符串里的裸换行
+                out[-1] = "\\n"
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append(ch)
+            opens.append(len(out))
+            out.append(ch)
+            safe = (len(out), list(stack))
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            while stack and _CLOSERS[stack[-1]] != ch:
+                # 括号不配对时按栈顶补齐
+                out.append(_CLOSERS[stack.pop()])
+                opens.pop()
+            if stack:
+                stack.pop()
+                opens.pop()
+            out.append(ch)
+            if not stack:
+                break
+            safe = (len(out), list(stack))
+        elif ch == ",":
+            _strip_trailing_comma(out)
+            safe = (len(out), list(stack))
+            out.append(ch)
+        elif ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        elif ch == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            continue
+        elif ch.isascii() and ch.isalpha():
+            m = re.match(r'[A-Za-z]+', text[i:])
+            word = m.group(0)
+            out.append(_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if stack:
+        # 截断：丢掉最后一个不完整的元素，再闭合剩余括号。
+        # 数组中未闭合的对象/数组元素整个丢弃，不保留只写了一半的条目
+        for k in range(1, len(stack)):
+            if stack[k - 1] == "[":
+                out = out[:opens[k]]
+                stack = stack[:k]
+                break
+        else:
+            length, stack = safe
+            out = out[:length]
+        _strip_trailing_comma(out)
+        for opener in reversed(stack):
+            out.append(_CLOSERS[opener])
+    return "".join(out)
+
+
+def parse_json(text: str) -> Tuple[Any, str]:
+    """
+    Returns:
+        (解析结果, 方式)；方式为 "strict" / "extracted" / "repaired"
+
+    Raises:
+        json.JSONDecodeError: 修复后仍无法解析
+    """
+    try:
+        value = json.loads(text)
+        _bump("strict")
+        return value, "strict"
+    except json.JSONDecodeError as e:
+        error = e
+
+    candidates = [m.group(1) for m in _FENCE_PATTERN.finditer(text)] + [text]
+    for candidate in candidates:
+        m = re.search(r'[\[{].*[\]}]', candidate, re.DOTALL)
+        if not m:
+            continue
+        try:
+            value = json.loads(m.group(0))
+            _bump("extracted")
+            return value, "extracted"
+        except json.JSONDecodeError:
+            pass
+
+    for candidate in candidates:
+        # 说明文字里也可能有括号，依次尝试前几个起点
+        starts = [m.start() for m in re.finditer(r'[\[{]', candidate)][:_MAX_STARTS]
+        for start in starts:
+            try:
+                value = json.loads(_repair(candidate, start))
+                _bump("repaired")
+                return value, "repaired"
+            except json.JSONDecodeError:
+                pass
+
+    _bump("failed")
+    raise error
@@ -3,12 +3,16 @@ LLM客户端封装
 统一使用OpenAI格式调用
 """
 
-import json
 from typing import Optional, Dict, Any, List
-from openai import OpenAI
 
 from ..config import Config
-from .retry import retry_with_backoff
+from .endpoint_pool import Endpoint, EndpointPool, NoEndpointAvailable, boost_endpoints_from_config, get_shared_pool
+from .deadline import Deadline
+from .json_repair import parse_json
+from .retry import RetryBudget, RetryableAPIClient
+
+# 单次请求的超时上限（秒），与各端点客户端的默认值一致
+REQUEST_TIMEOUT = 300.0
 
 
 class LLMClient:
@@ -18,60 +22,113 @@ class LLMClient:
         self,
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        pool: Optional[EndpointPool] = None
     ):
         self.api_key = api_key or Config.LLM_API_KEY
         self.base_url = base_url or Config.LLM_BASE_URL
         self.model = model or Config.LLM_MODEL_NAME
         
-        if not self.api_key:
-            raise ValueError("LLM_API_KEY 未配置")
-        
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            timeout=300.0
-        )
+        if pool is not None:
+            self.pool = pool
+        elif api_key or base_url or model:
+            # 显式指定了主模型：单独建池，加速模型仍沿用全局配置
+            if not self.api_key:
+                raise ValueError("LLM_API_KEY 未配置")
+            main = Endpoint("main", self.base_url, self.api_key, self.model, max_concurrency=64)
+            self.pool = EndpointPool([main] + boost_endpoints_from_config(), cooldown=Config.LLM_ENDPOINT_COOLDOWN)
+        else:
+            self.pool = get_shared_pool()
         
-        # 初始化加速模型客户端（如果有配置）
-        self.boost_client = None
-        if Config.LLM_BOOST_API_KEY:
-            boost_base_url = Config.LLM_BOOST_BASE_URL or self.base_url
-            self.boost_client = OpenAI(
-                api_key=Config.LLM_BOOST_API_KEY,
-                base_url=boost_base_url,
-                timeout=300.0
-            )
+        if not self.pool.has_tier("main"):
+            raise ValueError("LLM_API_KEY 未配置")
+    
+    def _complete(
+        self,
+        tier: str,
+        kwargs: Dict[str, Any],
+        usage: Optional[Dict[str, int]],
+        deadline: Optional[Deadline] = None,
+        wait: bool = True
+    ) -> str:
+        """
+        从端点池取一个端点完成一次请求；有截止时间时，排队与请求超时都不超过剩余时间；
+        wait=False 时不排队，没有立即可用的端点直接抛出 NoEndpointAvailable
+        """
+        if deadline is not None:
+            deadline.check()
+        if not wait:
+            endpoint = self.pool.acquire(tier, timeout=0)
+        elif deadline is not None:
+            endpoint = self.pool.acquire(tier, timeout=deadline.remaining())
+        else:
+            endpoint = self.pool.acquire(tier)
+        try:
+            if deadline is not None:
+                kwargs = dict(kwargs, timeout=deadline.timeout(REQUEST_TIMEOUT))
+            response = endpoint.client.chat.completions.create(model=endpoint.model, **kwargs)
+        except Exception as e:
+            self.pool.release(endpoint, e)
+            raise
+        self.pool.release(endpoint)
+        self._record_usage(response, usage)
+        return response.choices[0].message.content
     
-    @retry_with_backoff(max_retries=3, initial_delay=2.0, max_delay=60.0, exceptions=(Exception,))
     def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.7,
         max_tokens: int = 4096,
         response_format: Optional[Dict] = None,
-        use_boost: bool = False
+        use_boost: bool = False,
+        usage: Optional[Dict[str, int]] = None,
+        max_retries: int = 3,
+        retry_budget: Optional[RetryBudget] = None,
+        deadline: Optional[Deadline] = None
     ) -> str:
         """
         发送聊天请求
+
+        传入 usage 字典时，会把本次调用的 prompt_tokens / completion_tokens 累加进去。
+        只重试连接错误、超时、429 与 5xx，并遵循服务端的 Retry-After；
+        max_retries=0 时失败直接抛出，由调用方（如分块调度器）决定何时重试；
+        传入 deadline 时，请求超时与重试等待都不会超过剩余时间，到期抛出 DeadlineExceeded
         """
+        retrier = RetryableAPIClient(max_retries=max_retries, initial_delay=2.0, max_delay=60.0)
+        return retrier.call_with_retry(
+            self._chat_once, messages, temperature, max_tokens, response_format, use_boost, usage, deadline,
+            budget=retry_budget, deadline=deadline
+        )
+    
+    def _chat_once(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        response_format: Optional[Dict],
+        use_boost: bool,
+        usage: Optional[Dict[str, int]],
+        deadline: Optional[Deadline] = None
+    ) -> str:
         from openai import APIConnectionError, APITimeoutError
         
-        # 如果指定使用加速模型且配置了加速模型，则尝试切换
-        if use_boost and self.boost_client:
+        kwargs = {
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if response_format:
+            kwargs["response_format"] = response_format
+        
+        # 如果指定使用加速模型且池中有加速端点，则尝试切换
+        if use_boost and self.pool.has_tier("boost"):
             try:
-                kwargs = {
-                    "model": Config.LLM_BOOST_MODEL_NAME,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                }
-                if response_format:
-                    kwargs["response_format"] = response_format
-                
-                # 加速模型使用更短的超时，如果慢就不用了
-                response = self.boost_client.chat.completions.create(**kwargs)
-                return response.choices[0].message.content
+                # 加速端点全在冷却或满载时不等待，直接改用主模型
+                return self._complete("boost", kwargs, usage, deadline, wait=False)
+            except NoEndpointAvailable as e:
+                from .logger import get_logger
+                logger = get_logger('silverfish.llm')
+                logger.debug(f"加速模型暂无可用端点，改用主模型: {str(e)}")
             except (APIConnectionError, APITimeoutError) as e:
                 from .logger import get_logger
                 logger = get_logger('silverfish.llm')
@@ -81,24 +138,13 @@ class LLMClient:
                 logger = get_logger('silverfish.llm')
                 logger.warning(f"加速模型调用异常，正在退回到主模型: {str(e)}")
                 # 失败后继续向下执行，使用主模型
-
-        kwargs = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-        }
-        
-        if response_format:
-            kwargs["response_format"] = response_format
         
         try:
             from .logger import get_logger
             logger = get_logger('silverfish.llm')
-            logger.debug(f"LLM Request: model={kwargs['model']}, temp={temperature}")
+            logger.debug(f"LLM Request: tier=main, temp={temperature}")
             
-            response = self.client.chat.completions.create(**kwargs)
-            content = response.choices[0].message.content
+            content = self._complete("main", kwargs, usage, deadline)
             
             logger.debug(f"LLM Response received: {len(content)} chars")
             return content
@@ -109,12 +155,31 @@ class LLMClient:
             # 对于连接错误，重试可能没用，直接抛出以便上层触发 fallback
             raise
     
+    @staticmethod
+    def _record_usage(response: Any, usage: Optional[Dict[str, int]]) -> None:
+        if usage is None:
+            return
+        info = getattr(response, "usage", None)
+        if info is None:
+            return
+        for key in ("prompt_tokens", "completion_tokens"):
+            usage[key] = usage.get(key, 0) + int(getattr(info, key, 0) or 0)
+
+    @staticmethod
+    def parse_json_content(response: str) -> Dict[str, Any]:
+        """解析模型返回的 JSON 文本（兼容代码块包裹、前后多余文字、多余逗号与截断）"""
+        return parse_json(response)[0]
+
     def chat_json(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.3,
         max_tokens: int = 4096,
-        use_boost: bool = False
+        use_boost: bool = False,
+        usage: Optional[Dict[str, int]] = None,
+        max_retries: int = 3,
+        retry_budget: Optional[RetryBudget] = None,
+        deadline: Optional[Deadline] = None
     ) -> Dict[str, Any]:
         """
         发送聊天请求并返回JSON
@@ -124,6 +189,10 @@ class LLMClient:
             temperature: 温度参数
             max_tokens: 最大token数
             use_boost: 是否使用加速模型
+            usage: 可选，用于累计 token 用量与本地修复的 JSON 响应数（json_salvaged）
+            max_retries: 请求失败时的最大重试次数
+            retry_budget: 可选的会话级重试预算
+            deadline: 可选的会话截止时间
             
         Returns:
             解析后的JSON对象
@@ -134,25 +203,21 @@ class LLMClient:
                 temperature=temperature,
                 max_tokens=max_tokens,
                 response_format={"type": "json_object"},
-                use_boost=use_boost
+                use_boost=use_boost,
+                usage=usage,
+                max_retries=max_retries,
+                retry_budget=retry_budget,
+                deadline=deadline
             )
             
-            # 尝试直接解析
-            try:
-                return json.loads(response)
-            except json.JSONDecodeError:
-                # 如果解析失败，尝试提取代码块中的JSON
-                import re
-                json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                
-                # 尝试提取最外层的 { }
-                json_match = re.search(r'(\{.*\})', response, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                
-                raise
+            value, how = parse_json(response)
+            if how == "repaired":
+                # 修补后可用的响应不再重新请求
+                from .logger import get_logger
+                get_logger('wannian.llm').info(f"LLM JSON 已本地修复（{len(response)} 字符）")
+                if usage is not None:
+                    usage["json_salvaged"] = usage.get("json_salvaged", 0) + 1
+            return value
         except Exception as e:
             from .logger import get_logger
             logger = get_logger('wannian.llm')
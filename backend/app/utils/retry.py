@@ -6,11 +6,97 @@ API调用重试机制
 import time
 import random
 import functools
-from typing import Callable, Any, Optional, Type, Tuple
+import heapq
+import threading
+import concurrent.futures
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Callable, Any, Dict, Iterable, Iterator, List, Optional, Set, Type, Tuple
 from ..utils.logger import get_logger
+from .deadline import Deadline, DeadlineExceeded
 
 logger = get_logger('wannian.retry')
 
+# 可重试的 HTTP 状态码：超时、冲突、限流与服务端错误
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """读取错误响应中的 Retry-After / retry-after-ms 头（秒）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return max(0.0, float(ms) / 1000)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def classify_error(error: BaseException) -> Tuple[bool, Optional[float]]:
+    """
+    判断一次失败是否值得重试
+
+    Returns:
+        (是否可重试, 服务端建议的等待秒数)；
+        400/401/403/404/422 等请求本身的问题、JSON 解析失败都不重试
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False, None
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS, retry_after_seconds(error)
+    try:
+        from openai import APIConnectionError
+        if isinstance(error, APIConnectionError):
+            return True, None
+    except ImportError:
+        pass
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True, None
+    return False, None
+
+
+class RetryBudget:
+    """
+    重试预算：重试次数不超过 min_retries + ratio × 调用次数
+
+    一个分析会话共用一个预算，服务端大面积故障时不会因为重试把请求量放大数倍
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 5):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.calls = 0
+        self.retries = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def record_call(self, n: int = 1) -> None:
+        with self._lock:
+            self.calls += n
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.retries < self.min_retries + self.ratio * self.calls:
+                self.retries += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "retries": self.retries, "denied": self.denied, "ratio": self.ratio}
+
 
 def retry_with_backoff(
     max_retries: int = 3,
@@ -139,27 +225,37 @@ class RetryableAPIClient:
         max_retries: int = 3,
         initial_delay: float = 1.0,
         max_delay: float = 30.0,
-        backoff_factor: float = 2.0
+        backoff_factor: float = 2.0,
+        max_retry_after: float = 120.0
     ):
         self.max_retries = max_retries
         self.initial_delay = initial_delay
         self.max_delay = max_delay
         self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
     
     def call_with_retry(
         self,
         func: Callable,
         *args,
         exceptions: Tuple[Type[Exception], ...] = (Exception,),
+        budget: Optional[RetryBudget] = None,
+        deadline: Optional[Deadline] = None,
         **kwargs
     ) -> Any:
         """
         执行函数调用并在失败时重试
         
+        只重试 classify_error 判定为可重试的错误；服务端给出 Retry-After 时按其等待，
+        传入 budget 时每次重试都要先从预算中扣除，预算耗尽即放弃；
+        传入 deadline 时，等待后会超过截止时间的重试直接放弃
+        
         Args:
             func: 要调用的函数
             *args: 函数参数
             exceptions: 需要重试的异常类型
+            budget: 可选的重试预算
+            deadline: 可选的截止时间
             **kwargs: 函数关键字参数
             
         Returns:
@@ -167,20 +263,39 @@ class RetryableAPIClient:
         """
         last_exception = None
         delay = self.initial_delay
+        if budget is not None:
+            budget.record_call()
         
         for attempt in range(self.max_retries + 1):
+            if deadline is not None:
+                deadline.check()
             try:
                 return func(*args, **kwargs)
                 
             except exceptions as e:
                 last_exception = e
+                retryable, hint = classify_error(e)
+                
+                if not retryable:
+                    raise
                 
                 if attempt == self.max_retries:
-                    logger.error(f"API调用在 {self.max_retries} 次重试后仍失败: {str(e)}")
+                    if self.max_retries:
+                        logger.error(f"API调用在 {self.max_retries} 次重试后仍失败: {str(e)}")
+                    raise
+                
+                if budget is not None and not budget.try_spend():
+                    logger.warning(f"重试预算已用尽，放弃重试: {str(e)}")
                     raise
                 
                 current_delay = min(delay, self.max_delay)
                 current_delay = current_delay * (0.5 + random.random())
+                if hint is not None:
+                    current_delay = min(hint, self.max_retry_after)
+                
+                if deadline is not None and not deadline.allows(current_delay):
+                    logger.warning(f"等待 {current_delay:.1f} 秒后将超过截止时间，放弃重试: {str(e)}")
+                    raise
                 
                 logger.warning(
                     f"API调用第 {attempt + 1} 次尝试失败: {str(e)}, "
@@ -192,47 +307,190 @@ class RetryableAPIClient:
         
         raise last_exception
     
+    def iter_batch(
+        self,
+        items: Iterable[Any],
+        process_func: Callable[[Any], Any],
+        max_workers: int = 4,
+        exceptions: Tuple[Type[Exception], ...] = (Exception,),
+        item_timeout: Optional[float] = None,
+        budget: Optional[RetryBudget] = None,
+        on_retry: Optional[Callable[[int, Exception, int], None]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> Iterator[Tuple[int, Any, Optional[Exception]]]:
+        """
+        并发处理一批项目，按完成顺序逐个产出 (下标, 结果, 异常)
+
+        - 最多 max_workers 个项目同时执行
+        - 失败项按 classify_error 判断是否重试，最多 max_retries 次；重试不在工作线程里睡眠，
+          而是到期后重新排队，且排在尚未开始的新项目之后
+        - item_timeout 为单个项目（含所有重试）自首次开始执行起的最长耗时，超时产出 DeadlineExceeded；
+          已在执行的调用无法中断，它结束前仍占着一个工作线程（计入 max_workers），迟到的结果被丢弃；
+          只有真有空闲线程时才派发新项目，所以新项目的计时不会被卡住的调用吃掉
+        - 传入 budget 时，首次调用计入预算，每次重试从预算中扣除
+        - 传入 deadline 时，截止后尚未开始的项目不再执行，直接产出 DeadlineExceeded；
+          在途项目最多等到截止时间
+
+        Args:
+            items: 要处理的项目
+            process_func: 处理函数，接收单个项目
+            max_workers: 最大并发数
+            exceptions: 允许重试的异常类型
+            item_timeout: 单个项目的截止时间（秒）
+            budget: 可选的重试预算
+            on_retry: 重试时的回调 (下标, 异常, 第几次重试)
+            deadline: 整批的截止时间
+        """
+        items = list(items)
+        if not items:
+            return
+
+        batch_limit = deadline.expires_at if deadline is not None else None
+        # 单项截止时间从该项首次派发时起算；尚未派发的项只受整批截止时间约束
+        deadlines: List[Optional[float]] = [batch_limit] * len(items)
+
+        def timed_out(idx: int) -> DeadlineExceeded:
+            if deadline is not None and deadline.expired():
+                return DeadlineExceeded(f"第 {idx + 1} 项未能在 {deadline.seconds:.0f} 秒截止时间内完成")
+            return DeadlineExceeded(f"第 {idx + 1} 项超过 {item_timeout:.0f} 秒截止时间")
+
+        attempts = [0] * len(items)
+        fresh = deque(range(len(items)))
+        delayed: List[Tuple[float, int]] = []
+        running: Dict[concurrent.futures.Future, int] = {}
+        # 已超时产出、但调用仍在工作线程里执行的 future
+        abandoned: Set[concurrent.futures.Future] = set()
+        workers = max(1, max_workers)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            while fresh or delayed or running:
+                now = time.monotonic()
+                while len(running) + len(abandoned) < workers:
+                    if fresh:
+                        idx = fresh.popleft()
+                        if deadlines[idx] is not None and now >= deadlines[idx]:
+                            yield idx, None, timed_out(idx)
+                            continue
+                        if item_timeout:
+                            limit = now + item_timeout
+                            deadlines[idx] = limit if batch_limit is None else min(limit, batch_limit)
+                        if budget is not None:
+                            budget.record_call()
+                    elif delayed and delayed[0][0] <= now:
+                        idx = heapq.heappop(delayed)[1]
+                    else:
+                        break
+                    running[executor.submit(process_func, items[idx])] = idx
+
+                if not running and not abandoned:
+                    if delayed:
+                        time.sleep(max(0.0, delayed[0][0] - now))
+                    continue
+
+                wake = [d for d in (deadlines[i] for i in running.values()) if d is not None]
+                if delayed:
+                    wake.append(delayed[0][0])
+                if fresh and batch_limit is not None:
+                    wake.append(batch_limit)
+                timeout = max(0.0, min(wake) - now) if wake else None
+                done, _ = concurrent.futures.wait(
+                    set(running) | abandoned, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    if future in abandoned:
+                        # 超时项终于结束，腾出工作线程；结果已无人等待
+                        abandoned.discard(future)
+                        continue
+                    idx = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        retryable, hint = classify_error(e)
+                        if isinstance(e, exceptions) and retryable and attempts[idx] < self.max_retries:
+                            delay = min(self.initial_delay * (self.backoff_factor ** attempts[idx]), self.max_delay)
+                            delay = delay * (0.5 + random.random())
+                            if hint is not None:
+                                delay = min(hint, self.max_retry_after)
+                            ready_at = time.monotonic() + delay
+                            within_deadline = deadlines[idx] is None or ready_at < deadlines[idx]
+                            if within_deadline and (budget is None or budget.try_spend()):
+                                attempts[idx] += 1
+                                if on_retry:
+                                    on_retry(idx, e, attempts[idx])
+                                heapq.heappush(delayed, (ready_at, idx))
+                                continue
+                        yield idx, None, e
+                        continue
+                    yield idx, result, None
+
+                now = time.monotonic()
+                for future, idx in list(running.items()):
+                    if deadlines[idx] is not None and now >= deadlines[idx]:
+                        running.pop(future)
+                        if not future.cancel():
+                            abandoned.add(future)
+                        yield idx, None, timed_out(idx)
+                expired = [(t, i) for t, i in delayed if deadlines[i] is not None and now >= deadlines[i]]
+                for entry in expired:
+                    delayed.remove(entry)
+                    yield entry[1], None, timed_out(entry[1])
+                if expired:
+                    heapq.heapify(delayed)
+                # 工作线程都被卡住时，整批截止后尚未派发的项目也要及时产出
+                if deadline is not None and deadline.expired():
+                    while fresh:
+                        idx = fresh.popleft()
+                        yield idx, None, timed_out(idx)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def call_batch_with_retry(
         self,
         items: list,
         process_func: Callable,
         exceptions: Tuple[Type[Exception], ...] = (Exception,),
-        continue_on_failure: bool = True
+        continue_on_failure: bool = True,
+        max_workers: int = 4,
+        item_timeout: Optional[float] = None,
+        budget: Optional[RetryBudget] = None,
+        deadline: Optional[Deadline] = None
     ) -> Tuple[list, list]:
         """
-        批量调用并对每个失败项单独重试
+        并发批量调用，对每个失败项单独重试
         
         Args:
             items: 要处理的项目列表
             process_func: 处理函数，接收单个item作为参数
             exceptions: 需要重试的异常类型
             continue_on_failure: 单项失败后是否继续处理其他项
+            max_workers: 最大并发数
+            item_timeout: 单个项目（含重试）的截止时间（秒）
+            budget: 可选的重试预算
+            deadline: 整批的截止时间
             
         Returns:
-            (成功结果列表, 失败项列表)
+            (按原顺序排列的成功结果列表, 失败项列表)
         """
-        results = []
+        successes: Dict[int, Any] = {}
         failures = []
         
-        for idx, item in enumerate(items):
-            try:
-                result = self.call_with_retry(
-                    process_func,
-                    item,
-                    exceptions=exceptions
-                )
-                results.append(result)
-                
-            except Exception as e:
-                logger.error(f"处理第 {idx + 1} 项失败: {str(e)}")
-                failures.append({
-                    "index": idx,
-                    "item": item,
-                    "error": str(e)
-                })
-                
-                if not continue_on_failure:
-                    raise
+        for idx, result, error in self.iter_batch(
+            items, process_func, max_workers=max_workers, exceptions=exceptions,
+            item_timeout=item_timeout, budget=budget, deadline=deadline
+        ):
+            if error is None:
+                successes[idx] = result
+                continue
+            logger.error(f"处理第 {idx + 1} 项失败: {str(error)}")
+            failures.append({
+                "index": idx,
+                "item": items[idx],
+                "error": str(error)
+            })
+            if not continue_on_failure:
+                raise error
         
-        return results, failures
-
+        failures.sort(key=lambda f: f["index"])
+        return [successes[i] for i in sorted(successes)], failures
@@ -0,0 +1,143 @@
+"""
+上传文本流式读取
+基于前缀样本识别编码，随后一次性增量解码，支持 .txt.gz 压缩上传
+"""
+
+import codecs
+import gzip
+from typing import BinaryIO, List, Optional, Tuple
+
+from .logger import get_logger
+
+logger = get_logger('footprints.text_ingest')
+
+# 编码识别只看文件开头的这一段样本
+SAMPLE_BYTES = 64 * 1024
+READ_BLOCK_BYTES = 256 * 1024
+
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 简繁体中文高频字，用于区分 GB18030 与 Big5 的"解码成功但全是生僻字"的情况
+_COMMON_HAN = frozenset(
+    "的一是不了人我在有他这這个個们們中来來上大为為和国國地到以说說时時要就出会會"
+    "可也你对對生能而子那得于於着著下自之年过過发發后後作里裡用道行所然家事成方多"
+    "经經么麼去法学學如都同现現当當没沒动動面起看定天分还還进進好小部其些主样樣心"
+    "她本前开開但因只从從想实實日者意无無力它与與长長把十第此已使情明知全三又两兩"
+    "高间間问問很最重见見被什二等身新己手头頭话話回门門声聲走路山水风風眼笑道"
+)
+
+
+class UploadRejected(ValueError):
+    """上传内容不符合要求（格式、长度等），应以 400 返回给调用方"""
+
+
+def is_supported_upload(filename: Optional[str]) -> bool:
+    name = (filename or '').lower()
+    return name.endswith('.txt') or name.endswith('.txt.gz')
+
+
+def _score_decoding(sample: bytes, encoding: str) -> float:
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    if not text:
+        return 0.0
+    bad = text.count('�')
+    han = 0
+    common = 0
+    for ch in text:
+        if '一' <= ch <= '鿿':
+            han += 1
+            if ch in _COMMON_HAN:
+                common += 1
+    if han == 0:
+        return -bad / len(text)
+    return common / han - 5.0 * bad / len(text)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    根据文件开头的样本判断编码
+
+    顺序：BOM -> 严格 UTF-8 -> GB18030 / Big5 统计打分
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    try:
+        # final=False：样本末尾被截断的多字节字符不算错误
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    scores = {enc: _score_decoding(sample, enc) for enc in ('gb18030', 'big5')}
+    best = max(scores, key=lambda enc: scores[enc])
+    if scores[best] < 0:
+        # 两者都很差时退回 UTF-8 (replace)，至少保证程序不崩
+        return 'utf-8'
+    return best
+
+
+def read_text_upload(
+    stream: BinaryIO,
+    filename: Optional[str],
+    max_chars: int,
+    max_bytes: Optional[int] = None
+) -> Tuple[str, str]:
+    """
+    流式读取上传文件并解码
+
+    Args:
+        stream: 上传文件的二进制流
+        filename: 文件名（以 .gz 结尾时按 gzip 解压）
+        max_chars: 解码后允许的最大字符数，超出立即拒绝
+        max_bytes: 解压后允许读取的最大字节数（防止压缩炸弹）
+
+    Returns:
+        (文本内容, 使用的编码)
+    """
+    if (filename or '').lower().endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    if max_bytes is None:
+        # UTF-8 下中文每字 3 字节，再留一些余量给 BOM/空白
+        max_bytes = max_chars * 4
+
+    def read_block(size: int) -> bytes:
+        try:
+            return stream.read(size)
+        except (OSError, EOFError) as e:
+            raise UploadRejected(f"压缩文件损坏或格式不正确: {e}")
+
+    sample = read_block(SAMPLE_BYTES)
+    encoding = detect_encoding(sample)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    parts: List[str] = []
+    total_bytes = 0
+    total_chars = 0
+    bad_chars = 0
+    block = sample
+    while True:
+        total_bytes += len(block)
+        if total_bytes > max_bytes:
+            raise UploadRejected("文件过大，解压后超出允许的大小")
+        final = not block
+        piece = decoder.decode(block, final=final)
+        if piece:
+            total_chars += len(piece)
+            if total_chars > max_chars:
+                raise UploadRejected(f"文本过长，目前仅支持 {max_chars // 10000} 万字以内的文本")
+            bad_chars += piece.count('�')
+            parts.append(piece)
+        if final:
+            break
+        block = read_block(READ_BLOCK_BYTES)
+
+    if total_chars and bad_chars > total_chars * 0.1:
+        logger.warning(f"文件 {filename} 使用 {encoding} 解码后仍有 {bad_chars} 个无法识别的字符")
+    logger.info(f"成功使用 {encoding} 编码读取文件: {filename}")
+    return ''.join(parts), encoding
@@ -0,0 +1,80 @@
+"""
+文本缓冲区与只读视图
+整本小说只保留一份规范化后的字符串，章节与片段都以偏移量表示，
+只有在拼装 Prompt 时才真正切出子串
+"""
+
+import re
+from typing import Optional
+
+# 一次扫描完成：去掉首尾空白、统一换行符、去掉行首行尾空白、压缩连续空行
+_WHITESPACE_RUN = re.compile(r'(\A\s+)|(\s+\Z)|([^\S\r\n]*(?:\r\n?|\n)\s*)')
+
+
+def _collapse_whitespace(m: re.Match) -> str:
+    if m.lastindex != 3:
+        return ''
+    run = m.group(3)
+    newlines = run.count('\n') + run.count('\r') - run.count('\r\n')
+    return '\n' if newlines == 1 else '\n\n'
+
+
+def normalize_text(text: str) -> str:
+    """
+    单遍规范化文本
+
+    - \\r\\n / \\r 统一为 \\n
+    - 去掉每一行首尾空白
+    - 连续空行（包括只有空白的行）最多保留一个
+    - 去掉全文首尾空白
+    """
+    return _WHITESPACE_RUN.sub(_collapse_whitespace, text)
+
+
+class TextView:
+    """原文缓冲区上的一段只读视图"""
+
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source: str, start: int = 0, end: Optional[int] = None):
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        return self.source[self.start:self.end]
+
+    def __repr__(self) -> str:
+        return f"TextView({self.start}, {self.end})"
+
+    @property
+    def text(self) -> str:
+        """切出实际字符串（会产生一次拷贝，仅在构建 Prompt 等场景调用）"""
+        return self.source[self.start:self.end]
+
+    def view(self, start: int, end: Optional[int] = None) -> 'TextView':
+        """以相对偏移取子视图"""
+        end = len(self) if end is None else min(end, len(self))
+        return TextView(self.source, self.start + start, self.start + end)
+
+    def strip(self) -> 'TextView':
+        source = self.source
+        start, end = self.start, self.end
+        while start < end and source[start].isspace():
+            start += 1
+        while end > start and source[end - 1].isspace():
+            end -= 1
+        return TextView(source, start, end)
+
+    def find(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        end = len(self) if end is None else end
+        idx = self.source.find(sub, self.start + start, self.start + end)
+        return idx - self.start if idx != -1 else -1
+
+    def rfind(self, sub: str, start: int = 0, end: Optional[int] = None) -> int:
+        end = len(self) if end is None else end
+        idx = self.source.rfind(sub, self.start + start, self.start + end)
+        return idx - self.start if idx != -1 else -1
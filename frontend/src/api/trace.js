@@ -8,3 +8,7 @@ export const analyzeTrace = (data) => api.post('/analyze', data).then(res => res
 export const getTraceStatus = (sessionId) => api.get(`/status/${sessionId}`).then(res => res.data)
 export const getSampleData = () => api.get('/sample').then(res => res.data)
 
+export const uploadDocument = (data) => api.post('/documents', data).then(res => res.data)
+export const listChapters = (documentId) => api.get(`/documents/${documentId}/chapters`).then(res => res.data)
+export const analyzeChapters = (documentId, chapterStart, chapterEnd) =>
+  api.post(`/documents/${documentId}/analyze`, { chapter_start: chapterStart, chapter_end: chapterEnd }).then(res => res.data)
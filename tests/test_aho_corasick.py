@@ -0,0 +1,115 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services import trace_service
+from app.services.trace_service import TraceService, _PARENT_EVIDENCE_SCORES
+from app.utils.aho_corasick import AhoCorasick
+
+
+class NoLLM:
+    pass
+
+
+def _naive(patterns, text):
+    found = []
+    for p in set(patterns):
+        start = text.find(p)
+        while start >= 0:
+            found.append((start, start + len(p), p))
+            start = text.find(p, start + 1)
+    return sorted(found, key=lambda m: (m[1], -len(m[2])))
+
+
+def test_finds_all_overlapping_matches():
+    ac = AhoCorasick(["青云", "青云门", "云门", "门", "", "青云"])
+    assert len(ac) == 4
+    assert ac.find_all("去青云门大殿") == [(1, 3, "青云"), (1, 4, "青云门"), (2, 4, "云门"), (3, 4, "门")]
+    assert ac.find_all("") == []
+
+    rnd = random.Random(7)
+    alphabet = "天剑宗门山青云城内"
+    for _ in range(200):
+        patterns = ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 4))) for _ in range(rnd.randint(1, 12))]
+        text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40)))
+        got = sorted(AhoCorasick(patterns).find_all(text), key=lambda m: (m[1], -len(m[2])))
+        assert got == _naive(patterns, text)
+
+
+def _reference_rule_b(cid, text):
+    score = 0
+    if f"位于{cid}" in text or f"在{cid}" in text: score += 15
+    if f"属于{cid}" in text or f"inside {cid}" in text: score += 15
+    if f"{cid}的" in text: score += 10
+    if f"位于{cid}内" in text or f"在{cid}内" in text: score += 15
+    if f"在{cid}之中" in text or f"在{cid}里面" in text or f"在{cid}内部" in text: score += 15
+    if f"{cid}内" in text or f"{cid}中" in text: score += 8
+    return score
+
+
+def test_evidence_rules_match_substring_patterns():
+    rnd = random.Random(3)
+    pieces = ["位于", "在", "属于", "inside ", "的", "内", "之中", "里面", "内部", "中", "，", "天剑宗", "山下"]
+    cid = "天剑宗"
+    ac = AhoCorasick([cid])
+    for _ in range(500):
+        text = "".join(rnd.choice(pieces) for _ in range(rnd.randint(1, 8)))
+        rules = set()
+        for start, end, _ in ac.iter_matches(text):
+            rules |= TraceService._parent_evidence_rules(text, start, end)
+        assert sum(_PARENT_EVIDENCE_SCORES[r] for r in rules) == _reference_rule_b(cid, text), text
+
+
+def test_parent_fallback_uses_name_containment_and_evidence():
+    service = TraceService(llm_client=NoLLM())
+    locations = [
+        {"id": "天剑宗", "scope": "world", "kind": "sect"},
+        {"id": "天剑宗偏殿", "scope": "sub", "kind": "hall"},
+        {"id": "藏剑洞", "scope": "sub", "kind": "cave", "description": "位于落霞峰内的山洞"},
+        {"id": "落霞峰", "scope": "world", "kind": "mountain"},
+    ]
+    service._assign_parent_fallback(locations, {}, {})
+    parents = {l["id"]: l.get("parent_id") for l in locations}
+    assert parents["天剑宗偏殿"] == "天剑宗"
+    assert parents["藏剑洞"] == "落霞峰"
+    assert parents["天剑宗"] is None
+
+
+class CountingMatcher(AhoCorasick):
+    built = 0
+    scans = 0
+    chars = 0
+
+    def __init__(self, patterns):
+        CountingMatcher.built += 1
+        super().__init__(patterns)
+
+    def iter_matches(self, text):
+        CountingMatcher.scans += 1
+        CountingMatcher.chars += len(text)
+        return super().iter_matches(text)
+
+
+def test_parent_fallback_scans_each_location_text_once(monkeypatch):
+    monkeypatch.setattr(trace_service, "AhoCorasick", CountingMatcher)
+    service = TraceService(llm_client=NoLLM())
+    rnd = random.Random(5)
+    sects = [f"宗门{i}号" for i in range(400)]
+    locations = [{"id": s, "scope": "world", "kind": "sect"} for s in sects]
+    for i in range(1600):
+        parent = rnd.choice(sects)
+        locations.append({
+            "id": f"{parent}偏殿{i}",
+            "scope": "sub",
+            "kind": "hall",
+            "description": f"位于{parent}内，{rnd.choice(sects)}的弟子常来"
+        })
+    texts = [f"{l['id']} {l.get('description', '')} {l.get('evidence', '')}" for l in locations]
+    service._assign_parent_fallback(locations, {}, {})
+    assert all(l["parent_id"] and l["id"].startswith(l["parent_id"]) for l in locations[400:])
+    # 400 个候选父级只建一个自动机；每个地点的文本扫描一遍，不随候选父级数增长
+    assert CountingMatcher.built == 1
+    assert CountingMatcher.scans == len(locations)
+    assert CountingMatcher.chars == sum(len(t) for t in texts)
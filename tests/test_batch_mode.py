@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+from app.utils.batch_client import BatchClient
+
+os.environ["GEOCODE_DISABLE"] = "1"
+
+
+class StubBatchServer:
+    """
+    本地 OpenAI 兼容 Batch 接口替身（/files、/batches）
+
+    每个批任务第一次查询返回 in_progress，之后返回 completed；
+    responder(body) 返回模型文本，返回 None 表示该条请求失败
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.files = {}
+        self.batches = {}
+        self.polls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload, status=200, raw=False):
+                data = payload if raw else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path == "/v1/files":
+                    header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                    message = BytesParser().parsebytes(header + body)
+                    part = next(p for p in message.get_payload() if p.get_filename())
+                    self._send(stub.add_file(part.get_payload(decode=True)))
+                elif self.path == "/v1/batches":
+                    self._send(stub.create_batch(json.loads(body)))
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if parts[1] == "batches":
+                    stub.polls += 1
+                    batch = stub.batches[parts[2]]
+                    view = dict(batch, status="in_progress") if batch.pop("_first", False) else batch
+                    self._send(view)
+                elif parts[1] == "files" and parts[-1] == "content":
+                    self._send(stub.files[parts[2]], raw=True)
+                else:
+                    self._send({"error": "not found"}, 404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_file(self, data):
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": 0,
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed"}
+
+    def create_batch(self, req):
+        out_lines, failed = [], 0
+        for line in self.files[req["input_file_id"]].decode("utf-8").splitlines():
+            item = json.loads(line)
+            content = self.responder(item["body"])
+            if content is None:
+                failed += 1
+                response = {"status_code": 500, "body": {"error": {"message": "boom"}}}
+            else:
+                response = {"status_code": 200, "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}}
+            out_lines.append(json.dumps({"id": f"r{len(out_lines)}", "custom_id": item["custom_id"], "response": response, "error": None}))
+        output = self.add_file("\n".join(out_lines).encode("utf-8"))["id"]
+        batch_id = f"batch-{len(self.batches) + 1}"
+        total = len(out_lines)
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": req["endpoint"], "input_file_id": req["input_file_id"],
+            "completion_window": req["completion_window"], "status": "completed", "created_at": 0,
+            "output_file_id": output, "error_file_id": None,
+            "request_counts": {"total": total, "completed": total - failed, "failed": failed},
+            "_first": True,
+        }
+        return {k: v for k, v in self.batches[batch_id].items() if k != "_first"}
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _respond(body):
+    content = body["messages"][-1]["content"]
+    if "第3章" in content:
+        return None
+    return json.dumps({
+        "locations": [{"id": "青云门", "place_type": "fictional"}],
+        "events": [{"order_in_chunk": 1, "location": "青云门", "characters": ["张小凡"], "summary": content[-12:]}]
+    }, ensure_ascii=False)
+
+
+class NoSyncLLM:
+    """批量模式下提取不应走同步调用；分类/关系推断返回空结果"""
+
+    def __init__(self):
+        self.extract_calls = 0
+
+    def chat_json(self, messages, **kwargs):
+        if "请分析以下文本片段" in messages[-1]["content"]:
+            self.extract_calls += 1
+        return {}
+
+
+def test_batch_client_round_trip():
+    server = StubBatchServer(lambda body: '{"ok": true}')
+    try:
+        client = BatchClient(api_key="x", base_url=server.base_url, model="m", poll_interval=0.01)
+        results = client.run({"a": [{"role": "user", "content": "hi"}], "b": [{"role": "user", "content": "yo"}]})
+        assert results == {"a": '{"ok": true}', "b": '{"ok": true}'}
+        assert server.polls == 2
+    finally:
+        server.close()
+
+
+def test_batch_execution_mode_feeds_merge_pipeline(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_EXECUTION_MODE", "batch")
+    server = StubBatchServer(_respond)
+    try:
+        llm = NoSyncLLM()
+        batch = BatchClient(api_key="x", base_url=server.base_url, model="m", poll_interval=0.01)
+        service = TraceService(llm_client=llm, batch_client=batch)
+        text = "".join(f"第{i}章 标题{i}\n张小凡在青云门修炼，第{i}日。\n\n" for i in range(1, 5))
+
+        res = service.analyze_text(text, run_async=False)
+        status = service.get_session_status(res["session_id"])
+        assert status["status"] == "completed"
+        assert llm.extract_calls == 0
+        assert status["stats"]["batch_requests"] == 4
+        assert status["stats"]["batch_failed"] == 1
+        assert status["data"]["overview"]["event_count"] == 3
+    finally:
+        server.close()
+
+
+class StalledBatchServer(StubBatchServer):
+    """批任务一直处于 in_progress"""
+
+    def create_batch(self, req):
+        batch = super().create_batch(req)
+        self.batches[batch["id"]].update(status="in_progress", _first=False)
+        return batch
+
+
+def test_batch_deadline_keeps_remote_batch_id(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.delenv("TRACE_DEADLINE", raising=False)
+    monkeypatch.setenv("TRACE_EXECUTION_MODE", "batch")
+    server = StalledBatchServer(_respond)
+    try:
+        batch = BatchClient(api_key="x", base_url=server.base_url, model="m", poll_interval=0.01)
+        service = TraceService(llm_client=NoSyncLLM(), batch_client=batch)
+        # 未配置截止时间时不限时
+        assert service._resolve_deadline().unlimited
+
+        text = "第1章 开端\n张小凡在青云门修炼。\n\n"
+        res = service.analyze_text(text, run_async=False, deadline_seconds=0.3)
+        session = service.sessions[res["session_id"]]
+        assert session["batch_pending_id"] == "batch-1"
+        assert session["status"] == "failed" and "batch-1" in session["error"]
+        # 远端任务没有被取消，完成后仍能按 id 取回
+        server.batches["batch-1"]["status"] = "completed"
+        outputs = batch.fetch_results(batch.wait("batch-1"))
+        assert len(outputs) == 1 and next(iter(outputs.values()))
+    finally:
+        server.close()
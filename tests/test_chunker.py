@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.utils.chunker import BoundaryIndex, TextChunker, chunk_digest
+from app.utils.text_view import TextView
+
+
+def test_chunks_end_on_paragraph_or_sentence_boundaries():
+    text = ("张三走到了青云山。李四说：“好！”" * 5 + "\n\n") * 40
+    chunks = TextChunker(chunk_size=300, overlap=50).chunk(text)
+    assert len(chunks) > 5
+    for view in chunks[:-1]:
+        assert view.text.endswith(("”", "。"))
+        assert len(view) <= 300
+
+
+def test_chunker_uses_shared_index_for_sub_views():
+    text = "序。" + "甲乙丙丁。" * 200 + "尾。"
+    body = TextView(text, 2, len(text) - 2)
+    index = BoundaryIndex(text)
+    chunks = TextChunker(chunk_size=100, overlap=0).chunk(body, index)
+    assert chunks[0].start == 2
+    assert chunks[-1].end == len(text) - 2
+    assert "".join(c.text for c in chunks) == body.text
+
+
+def test_chunker_always_makes_progress_with_large_overlap():
+    text = "无标点的长文本" * 100
+    chunks = TextChunker(chunk_size=50, overlap=80).chunk(text)
+    assert chunks and chunks[-1].end == len(text)
+
+
+def test_chunk_digest_depends_only_on_content():
+    a = TextView("前言。张三下山。", 3)
+    b = TextView("完全不同的前言，长度也不一样。张三下山。", 15)
+    assert a.text == b.text
+    assert chunk_digest(a) == chunk_digest(b) == chunk_digest("张三下山。")
@@ -0,0 +1,183 @@
+import json
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.location_cooccurrence import CooccurrenceMatrix, group_by_neighborhood
+from app.services.trace_service import TraceService
+from app.utils.json_cache import JsonFileCache
+
+
+class FakeLLM:
+    """按请求里的地点逐个返回分类；名称含 "殿" 的归到同批里的宗门下"""
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def chat_json(self, messages, **kwargs):
+        payload = json.loads(messages[-1]["content"].split("\n", 1)[1])
+        ids = [item["id"] for item in payload["locations"]]
+        with self._lock:
+            self.batches.append(ids)
+        sects = [i for i in ids if i.endswith("宗")]
+        out = []
+        for lid in ids:
+            if "殿" in lid:
+                parent = next((s for s in sects if lid.startswith(s)), None)
+                out.append({"id": lid, "scope": "sub", "kind": "hall", "parent_id": parent, "place_type": "fictional"})
+            else:
+                out.append({"id": lid, "scope": "world", "kind": "sect", "parent_id": None, "place_type": "fictional"})
+        # 不在本批的 id 会被忽略
+        out.append({"id": "不存在", "scope": "world"})
+        return {"locations": out}
+
+
+def _world(n_sects=40, halls=9):
+    locations, results = [], []
+    for s in range(n_sects):
+        sect = f"宗门{s:02d}宗"
+        locations.append({"id": sect, "place_type": "fictional"})
+        for h in range(halls):
+            hall = f"{sect}偏殿{h}"
+            locations.append({"id": hall, "place_type": "fictional"})
+            results.append({"events": [{"location": sect, "characters": []}, {"location": hall, "characters": []}]})
+    return locations, results
+
+
+def _classify(service, locations, results):
+    matrix = CooccurrenceMatrix.build([l["id"] for l in locations], results, {})
+    context = service._compute_location_context(locations, results, {}, matrix)
+    return service._classify_locations_with_llm(locations, context_map=context, cooccurrence=matrix)
+
+
+def test_shards_cover_every_location_and_keep_neighborhoods(monkeypatch, tmp_path):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE_PATH", str(tmp_path / "cls.json"))
+    monkeypatch.setenv("TRACE_RULE_CONFIDENCE", "2")  # 宗门也交给 LLM
+    monkeypatch.setenv("TRACE_CLASSIFY_BATCH_SIZE", "25")
+    llm = FakeLLM()
+    locations, results = _world()
+    assert len(locations) == 400  # 原先只分类前 300 个
+
+    _classify(TraceService(llm_client=llm), locations, results)
+    assert all(l.get("kind") for l in locations)
+    assert all(len(b) <= 25 for b in llm.batches)
+    assert sorted(i for b in llm.batches for i in b) == sorted(l["id"] for l in locations)
+    # 宗门与其偏殿在同一批，父级得以指认
+    halls = [l for l in locations if "殿" in l["id"]]
+    assert all(l["parent_id"] and l["id"].startswith(l["parent_id"]) for l in halls)
+
+
+def test_cache_is_reused_across_sessions(monkeypatch, tmp_path):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE_PATH", str(tmp_path / "cls.json"))
+    monkeypatch.setenv("TRACE_RULE_CONFIDENCE", "2")
+    first = FakeLLM()
+    locations, results = _world(5, 3)
+    _classify(TraceService(llm_client=first), locations, results)
+    assert first.batches
+
+    second = FakeLLM()
+    fresh, _ = _world(5, 3)
+    fresh.append({"id": "新城", "place_type": "fictional"})
+    _classify(TraceService(llm_client=second), fresh, results)
+    assert second.batches == [["新城"]]
+    assert {l["id"]: l["parent_id"] for l in fresh} == {l["id"]: l["parent_id"] for l in locations} | {"新城": None}
+
+
+def test_failed_batches_leave_rules_applied(monkeypatch):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE", "0")
+
+    class Broken:
+        def chat_json(self, messages, **kwargs):
+            raise ValueError("bad json")
+
+    service = TraceService(llm_client=Broken())
+    service.sessions["s"] = {"stats": {}}
+    locations = [{"id": "观星台", "scope": "world"}]
+    service._classify_locations_with_llm(locations, session_id="s")
+    assert locations[0]["scope"] == "sub"
+    assert service.sessions["s"]["stats"]["classify_failed_batches"] == 1
+
+
+def test_group_by_neighborhood_packs_small_groups():
+    graph = {"a": ["b", "c"], "b": ["a"], "c": ["a", "d"], "d": ["c"], "x": [], "y": []}
+    assert group_by_neighborhood(["a", "x", "y", "b", "c", "d"], graph.get, 3) == [["a", "b", "c"], ["x", "y", "d"]]
+
+
+def test_json_file_cache_persists_and_evicts(tmp_path):
+    path = str(tmp_path / "sub" / "cache.json")
+    cache = JsonFileCache(path, max_entries=2, save_every=100)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    cache.get("a")
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+    assert not os.path.exists(path)
+    cache.flush()
+    reloaded = JsonFileCache(path)
+    assert reloaded.get("a") == {"v": 1} and reloaded.get("c") == {"v": 3} and len(reloaded) == 2
+
+
+def test_rule_confident_locations_skip_llm(monkeypatch):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE", "0")
+    llm = FakeLLM()
+    service = TraceService(llm_client=llm)
+    service.sessions["s"] = {"stats": {}}
+    locations = [
+        {"id": "藏经阁", "scope": "world"},
+        {"id": "凤凰城", "scope": "sub"},
+        {"id": "落星坪"},
+        {"id": "观星台", "scope": "world"},
+    ]
+    service._classify_locations_with_llm(locations, session_id="s")
+    assert llm.batches == [["落星坪", "观星台"]]
+    scopes = {l["id"]: l["scope"] for l in locations}
+    assert scopes["藏经阁"] == "sub" and scopes["凤凰城"] == "world"
+    stats = service.sessions["s"]["stats"]
+    assert stats["classify_local"] == 2
+    # 观星台只命中后缀 "台"（0.75），规则判 sub，FakeLLM 判 world
+    assert stats["rule_agreement"]["buckets"] == {"0.75": {"total": 1, "agree": 0, "rate": 0.0}}
+    assert stats["rule_agreement"]["disagreements"] == {"sub_suffix:sub->world": 1}
+
+
+def test_audit_mode_sends_everything_and_reports_agreement(monkeypatch):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE", "0")
+    monkeypatch.setenv("TRACE_RULE_AUDIT", "1")
+    llm = FakeLLM()
+    service = TraceService(llm_client=llm)
+    service.sessions["s"] = {"stats": {}}
+    locations = [{"id": "青云宗"}, {"id": "青云宗大殿"}, {"id": "天剑宗"}]
+    service._classify_locations_with_llm(locations, session_id="s")
+    assert sorted(i for b in llm.batches for i in b) == ["天剑宗", "青云宗", "青云宗大殿"]
+    report = service.sessions["s"]["stats"]["rule_agreement"]
+    # 宗门靠排除后缀、大殿靠关键词，都在 0.9 档
+    assert report["buckets"] == {"0.90": {"total": 3, "agree": 3, "rate": 1.0}}
+    assert {l["id"]: l["scope"] for l in locations} == {"青云宗": "world", "青云宗大殿": "sub", "天剑宗": "world"}
+
+
+def test_cache_is_keyed_by_model_and_only_written_on_flush(monkeypatch, tmp_path):
+    path = tmp_path / "cls.json"
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE_PATH", str(path))
+    monkeypatch.setenv("TRACE_RULE_CONFIDENCE", "2")
+    locations, results = _world(3, 2)
+
+    first = FakeLLM()
+    first.model = "model-a"
+    service = TraceService(llm_client=first)
+    cache = service._get_classification_cache()
+    cache.put("x", {"v": 1})
+    assert not path.exists()  # 写入只在分类结束后的 flush 时落盘
+    _classify(service, locations, results)
+    assert path.exists()
+
+    same = FakeLLM()
+    same.model = "model-a"
+    _classify(TraceService(llm_client=same), _world(3, 2)[0], results)
+    assert same.batches == []
+
+    switched = FakeLLM()
+    switched.model = "model-b"
+    _classify(TraceService(llm_client=switched), _world(3, 2)[0], results)
+    assert sorted(i for b in switched.batches for i in b) == sorted(l["id"] for l in locations)
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.location_cooccurrence import CooccurrenceMatrix
+from app.services.trace_service import TraceService
+
+
+class NoLLM:
+    pass
+
+
+def _chunk(*events):
+    return {"events": [{"location": loc, "characters": chars} for loc, chars in events]}
+
+
+def test_weights_count_chunks_and_shared_characters():
+    results = [
+        _chunk(("青云门", ["张小凡"]), ("大竹峰", ["张小凡", "田灵儿"]), ("河阳城", [])),
+        _chunk(("青云门", ["张小凡"]), ("大竹峰", ["张小凡"])),
+        _chunk(("青云门", ["陆雪琪"]), ("小竹峰", ["陆雪琪"])),
+        _chunk(("草庙村", ["张小凡"])),
+    ]
+    matrix = CooccurrenceMatrix.build(["青云门", "大竹峰", "小竹峰", "河阳城", "草庙村"], results, {})
+    assert matrix.weight("青云门", "大竹峰") == 3.0  # 两个片段 + 两次共同人物
+    assert matrix.weight("大竹峰", "青云门") == 3.0
+    assert matrix.weight("青云门", "小竹峰") == 1.5
+    assert matrix.weight("青云门", "河阳城") == 1.0
+    assert matrix.weight("青云门", "草庙村") == 0.0
+    assert matrix.neighbors("青云门", 2) == [("大竹峰", 3.0), ("小竹峰", 1.5)]
+    assert matrix.top_characters("青云门", 1) == ["张小凡"]
+    assert matrix.chunk_counts[matrix.index["青云门"]] == 3
+    assert sorted(matrix.edges(min_weight=1.5)) == [("大竹峰", "青云门", 3.0), ("小竹峰", "青云门", 1.5)]
+    assert matrix.edges(restrict=["青云门", "河阳城"]) == [("河阳城", "青云门", 1.0)]
+
+
+def test_location_context_ranks_by_weight_and_resolves_aliases():
+    service = TraceService(llm_client=NoLLM())
+    locations = [{"id": x} for x in ["甲城", "乙镇", "丙村", "丁谷"]]
+    results = [_chunk(("甲城", []), ("丁谷", []))] * 3 + [_chunk(("甲城", []), ("乙镇", []), ("丙庄", []))]
+    context = service._compute_location_context(locations, results, {"丙庄": "丙村"})
+    # 按权重排序，不再是字母序
+    assert context["甲城"]["related_locations"] == ["丁谷", "丙村", "乙镇"]
+    assert context["丙村"]["related_locations"] == ["乙镇", "甲城"]
+
+
+class CountingRow(dict):
+    """共现矩阵的一行：统计写入次数与整行遍历次数"""
+
+    counts = {"writes": 0, "scans": 0}
+
+    def __setitem__(self, key, value):
+        CountingRow.counts["writes"] += 1
+        super().__setitem__(key, value)
+
+    def items(self):
+        CountingRow.counts["scans"] += 1
+        return super().items()
+
+
+def test_location_context_work_is_linear_in_chunk_pairs(monkeypatch):
+    original_init = CooccurrenceMatrix.__init__
+
+    def counting_init(self, location_ids):
+        original_init(self, location_ids)
+        self.rows = [CountingRow() for _ in self.ids]
+
+    monkeypatch.setattr(CooccurrenceMatrix, "__init__", counting_init)
+    service = TraceService(llm_client=NoLLM())
+    rnd = random.Random(4)
+    locations = [{"id": f"地点{i}"} for i in range(3000)]
+    for n_chunks in (2500, 10000):
+        CountingRow.counts.update(writes=0, scans=0)
+        results = [
+            _chunk(*[(f"地点{rnd.randrange(3000)}", [f"人物{rnd.randrange(200)}"]) for _ in range(8)])
+            for _ in range(n_chunks)
+        ]
+        context = service._compute_location_context(locations, results, {})
+        assert all(len(c["related_locations"]) <= 6 and len(c["common_characters"]) <= 4 for c in context.values())
+
+        # 每个片段内的每对不同地点恰好写两次（对称），与地点总数无关
+        pairs = 0
+        for res in results:
+            m = len({e["location"] for e in res["events"]})
+            pairs += m * (m - 1) // 2
+        assert CountingRow.counts["writes"] == 2 * pairs
+        # 取前 k 个邻居时每个地点的行只遍历一次，不做地点两两比较
+        assert CountingRow.counts["scans"] == len(locations)
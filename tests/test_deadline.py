@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+from app.utils.deadline import Deadline, DeadlineExceeded
+from app.utils.retry import RetryableAPIClient, classify_error
+
+os.environ["GEOCODE_DISABLE"] = "1"
+
+
+def test_deadline_basics():
+    unlimited = Deadline(None)
+    assert unlimited.unlimited and unlimited.remaining() is None
+    assert unlimited.timeout(300) == 300 and unlimited.allows(1e9)
+
+    d = Deadline(0.2)
+    assert 0 < d.timeout(300) <= 0.2
+    assert d.reserve(0.15).remaining() <= 0.05
+    time.sleep(0.21)
+    assert d.expired() and not d.allows(0)
+    with pytest.raises(DeadlineExceeded):
+        d.timeout(300)
+    # 截止时间到了不应被当作普通超时重试
+    assert classify_error(DeadlineExceeded("x")) == (False, None)
+
+
+def test_retry_gives_up_when_wait_would_pass_deadline():
+    retrier = RetryableAPIClient(max_retries=5, initial_delay=10.0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        raise ConnectionError("reset")
+
+    started = time.monotonic()
+    with pytest.raises(ConnectionError):
+        retrier.call_with_retry(flaky, deadline=Deadline(1.0))
+    assert len(calls) == 1
+    assert time.monotonic() - started < 0.5
+
+
+def test_iter_batch_skips_unstarted_items_after_deadline():
+    retrier = RetryableAPIClient(max_retries=0)
+
+    def slow(n):
+        time.sleep(0.15)
+        return n
+
+    results, failures = retrier.call_batch_with_retry(list(range(6)), slow, max_workers=1, deadline=Deadline(0.4))
+    assert results == [0, 1]
+    assert [f["index"] for f in failures] == [2, 3, 4, 5]
+
+
+class SlowLLM:
+    def __init__(self, delay):
+        self.delay = delay
+        self.deadlines = []
+
+    def chat_json(self, messages, **kwargs):
+        self.deadlines.append(kwargs.get("deadline"))
+        content = messages[-1]["content"]
+        if "请分析以下文本片段" not in content:
+            return {}
+        time.sleep(self.delay)
+        return {
+            "locations": [{"id": "青云门", "place_type": "fictional"}],
+            "events": [{"order_in_chunk": 1, "location": "青云门", "characters": ["张小凡"], "summary": "修炼"}]
+        }
+
+
+def test_session_deadline_returns_partial_result(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_EXTRACT_MAX_WORKERS", "1")
+    monkeypatch.setenv("TRACE_DEADLINE_RESERVE", "0.5")
+    llm = SlowLLM(0.2)
+    service = TraceService(llm_client=llm)
+    text = "".join(f"第{i}章 标题{i}\n张小凡在青云门修炼，第{i}日。\n\n" for i in range(1, 9))
+
+    started = time.monotonic()
+    res = service.analyze_text(text, run_async=False, deadline_seconds=1.0)
+    assert time.monotonic() - started < 1.5
+    assert res["deadline_seconds"] == 1.0
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert status["data"]["partial"] is True
+    stats = status["stats"]
+    assert 0 < stats["deadline_skipped"] < 8
+    assert 0 < status["data"]["overview"]["event_count"] < 8
+    assert all(isinstance(d, Deadline) for d in llm.deadlines)
+
+
+def test_deadline_tiers_and_request_override(monkeypatch):
+    monkeypatch.setenv("TRACE_DEADLINE", "600")
+    monkeypatch.setenv("TRACE_DEADLINE_TIERS", '{"fast": 60, "unlimited": 0}')
+    service = TraceService(llm_client=SlowLLM(0))
+    assert service._resolve_deadline().seconds == 600
+    assert service._resolve_deadline(tier="fast").seconds == 60
+    # 请求只能缩短档位上限
+    assert service._resolve_deadline(seconds=30, tier="fast").seconds == 30
+    assert service._resolve_deadline(seconds=120, tier="fast").seconds == 60
+    assert service._resolve_deadline(tier="unlimited").unlimited
+    with pytest.raises(ValueError):
+        service._resolve_deadline(tier="gold")
+
+    doc = service.register_document("第1章 开端\n张小凡在青云门。\n")
+    res = service.analyze_document(doc["document_id"], run_async=False, tier="gold")
+    assert res["success"] is False
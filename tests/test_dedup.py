@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.utils.chunker import chunk_digest
+from app.utils.dedup import DuplicateDetector
+
+BASE = "张小凡离开草庙村，一路向北走到青云山下，拜入大竹峰门下，师父田不易只教他砍竹子。" * 3
+
+
+def test_exact_and_near_duplicates_are_aliased():
+    detector = DuplicateDetector(threshold=0.8)
+    near = BASE.replace("砍竹子", "劈竹子", 1)
+    other = "林惊羽在龙首峰修炼诛仙剑阵，苍松道人从旁指点，两人谈到了魔教鬼王宗的动向。" * 3
+
+    assert detector.find("a", chunk_digest(BASE), BASE) is None
+    assert detector.find("b", chunk_digest(BASE), BASE) == "a"
+    assert detector.find("c", chunk_digest(near), near) == "a"
+    assert detector.find("d", chunk_digest(other), other) is None
+    assert (detector.exact, detector.near) == (1, 1)
+
+
+def test_short_chunks_only_match_exactly():
+    detector = DuplicateDetector(threshold=0.5)
+    assert detector.find("a", chunk_digest("本章未完，请翻页"), "本章未完，请翻页") is None
+    assert detector.find("b", chunk_digest("本章未完，请翻页。"), "本章未完，请翻页。") is None
+    assert detector.find("c", chunk_digest("本章未完，请翻页"), "本章未完，请翻页") == "a"
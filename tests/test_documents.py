@@ -0,0 +1,292 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+
+os.environ["GEOCODE_DISABLE"] = "1"
+
+
+class FakeLLM:
+    """按片段返回固定提取结果的 LLM 替身，记录调用次数"""
+
+    def __init__(self):
+        self.extract_calls = 0
+        self._lock = threading.Lock()
+
+    def chat_json(self, messages, **kwargs):
+        content = messages[-1]["content"]
+        if "请分析以下文本片段" not in content:
+            return {}
+        with self._lock:
+            self.extract_calls += 1
+        return {
+            "locations": [{"id": "青云门", "place_type": "fictional"}],
+            "events": [{"order_in_chunk": 1, "location": "青云门", "characters": ["张小凡"], "summary": content[-20:]}]
+        }
+
+
+def _novel(chapters: int) -> str:
+    return "".join(f"第{i}章 标题{i}\n张小凡在青云门修炼，第{i}日。\n\n" for i in range(1, chapters + 1))
+
+
+def test_register_document_builds_chapter_index():
+    service = TraceService(llm_client=FakeLLM())
+    doc = service.register_document(_novel(5))
+    listing = service.list_chapters(doc["document_id"])
+    assert listing["chapter_count"] == 5
+    first = listing["chapters"][0]
+    assert first["title"] == "第1章 标题1"
+    assert doc["text"][first["start"]:first["end"]] == "张小凡在青云门修炼，第1日。"
+    # 相同内容重复登记得到同一个文档
+    assert service.register_document(_novel(5))["document_id"] == doc["document_id"]
+
+
+def test_chapter_range_analysis_reuses_cached_chunks(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    llm = FakeLLM()
+    service = TraceService(llm_client=llm)
+    doc = service.register_document(_novel(10))
+
+    res = service.analyze_document(doc["document_id"], chapter_start=3, chapter_end=5, run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert status["chapter_range"] == [3, 5]
+    assert status["stats"]["llm_calls"] == 3
+    assert llm.extract_calls == 3
+
+    res = service.analyze_document(doc["document_id"], run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["stats"]["cache_hits"] == 3
+    assert status["stats"]["llm_calls"] == 7
+    assert llm.extract_calls == 10
+
+
+def test_invalid_chapter_range_is_rejected():
+    service = TraceService(llm_client=FakeLLM())
+    doc = service.register_document(_novel(4))
+    assert service.analyze_document(doc["document_id"], chapter_start=3, chapter_end=9)["success"] is False
+    assert service.analyze_document("doc_missing")["success"] is False
+
+
+def test_duplicate_chapters_reuse_representative_result(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    llm = FakeLLM()
+    service = TraceService(llm_client=llm)
+    body = "张小凡在青云门修炼，每日砍竹挑水，师父田不易从不多言，只让他把大竹峰的竹子砍完。"
+    text = "".join(f"第{i}章 标题{i}\n{body}\n\n" for i in range(1, 5))
+
+    res = service.analyze_text(text, run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert status["stats"]["dedup_saved_calls"] == 3
+    assert llm.extract_calls == 1
+
+
+class DialogueAwareLLM(FakeLLM):
+    """只对包含地名的片段返回结果"""
+
+    def chat_json(self, messages, **kwargs):
+        result = super().chat_json(messages, **kwargs)
+        if result and "青云门" not in messages[-1]["content"]:
+            return {"locations": [], "events": []}
+        return result
+
+
+def _mixed_novel() -> str:
+    parts = []
+    for i in range(1, 7):
+        if i % 2:
+            parts.append(f"第{i}章 出行{i}\n张小凡离开草庙村，赶往青云门，第{i}日。\n\n")
+        else:
+            parts.append(f"第{i}章 闲谈{i}\n“你怎么看？”“我觉得不妥，第{i}回了。”\n\n")
+    return "".join(parts)
+
+
+def test_prefilter_skips_chunks_without_location_signal(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_PREFILTER_THRESHOLD", "1")
+    llm = DialogueAwareLLM()
+    service = TraceService(llm_client=llm)
+
+    res = service.analyze_text(_mixed_novel(), run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert status["stats"]["prefilter_skipped"] == 3
+    assert llm.extract_calls == 3
+
+
+def test_prefilter_audit_reports_without_skipping(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_PREFILTER_AUDIT", "1")
+    llm = DialogueAwareLLM()
+    service = TraceService(llm_client=llm)
+
+    res = service.analyze_text(_mixed_novel(), run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert llm.extract_calls == 6
+    report = status["stats"]["prefilter_report"]["1"]
+    assert report["recall"] == 1.0
+    assert report["savings"] == 0.5
+
+
+def test_focus_windows_send_only_location_paragraphs(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_FOCUS_WINDOWS", "1")
+    monkeypatch.setenv("TRACE_FOCUS_NEIGHBORS", "0")
+    llm = DialogueAwareLLM()
+    service = TraceService(llm_client=llm)
+    filler = "“你怎么看？”“我觉得不妥。”" * 5
+    text = f"第1章 出行\n{filler}\n\n张小凡离开草庙村，赶往青云门。\n\n{filler}\n\n第2章 闲谈\n{filler}\n\n"
+
+    res = service.analyze_text(text, run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert llm.extract_calls == 1
+    assert status["stats"]["focus_empty"] == 1
+    assert status["stats"]["focus_ratio"] < 0.2
+
+
+def test_focus_events_are_renumbered_in_original_order():
+    service = TraceService(llm_client=FakeLLM())
+    text = "甲地发生一事。" * 10 + "乙地又发生一事。"
+    windows = [(0, 7), (70, len(text))]
+    raw = {"events": [
+        {"order_in_chunk": 1, "window": 70, "summary": "后"},
+        {"order_in_chunk": 1, "window": 0, "summary": "前"},
+        {"order_in_chunk": 2, "evidence": "乙地又发生", "summary": "后2"},
+    ]}
+    service._order_focus_events(raw, windows, text)
+    assert [e["summary"] for e in raw["events"]] == ["前", "后", "后2"]
+    assert [e["order_in_chunk"] for e in raw["events"]] == [1, 2, 3]
+
+
+class RecordingLLM(FakeLLM):
+    """记录提取 Prompt，并按片段中出现的地名返回事件"""
+
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def chat_json(self, messages, **kwargs):
+        result = super().chat_json(messages, **kwargs)
+        if result:
+            content = messages[-1]["content"]
+            self.prompts.append(content)
+            body = content.split("：\n\n")[-1]
+            place = "大竹峰" if "大竹峰" in body else "青云门"
+            result["locations"][0]["id"] = place
+            result["events"][0]["location"] = place
+        return result
+
+
+def test_running_context_replaces_overlap(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_CONTEXT_MODE", "running")
+    monkeypatch.setenv("TRACE_CHUNK_SIZE", "60")
+    llm = RecordingLLM()
+    service = TraceService(llm_client=llm)
+    para_a = "张小凡在青云门修炼，每日砍竹挑水，不敢懈怠。"
+    para_b = "后来张小凡回到大竹峰，见过了师父田不易。"
+    text = f"第1章 修炼\n{para_a}\n\n{para_a[:-1]}，日复一日。\n\n{para_b}\n\n"
+
+    res = service.analyze_text(text, run_async=False)
+    stats = service.get_session_status(res["session_id"])["stats"]
+    assert stats["context_mode"] == "running"
+    assert stats["overlap_chars"] == 0
+    assert stats["llm_calls"] == 2
+    assert "本章前文提要" not in llm.prompts[0]
+    later = [p for p in llm.prompts if "大竹峰" in p.split("：\n\n")[-1]]
+    assert "- 张小凡：青云门" in later[0]
+    assert "duplicate_event_rate" in stats
+
+
+def test_build_running_context_keeps_latest_location_per_character():
+    service = TraceService(llm_client=FakeLLM())
+    previous = [
+        {"events": [{"order_in_chunk": 2, "location": "大竹峰", "characters": ["张小凡"]},
+                    {"order_in_chunk": 1, "location": "草庙村", "characters": ["张小凡", "林惊羽"]}]},
+        {"events": [{"order_in_chunk": 1, "location": "通天峰", "characters": ["陆雪琪"]}]},
+    ]
+    context = service._build_running_context(previous)
+    lines = [l for l in context.splitlines() if l.startswith("- ")]
+    assert lines == ["- 陆雪琪：通天峰", "- 张小凡：大竹峰", "- 林惊羽：草庙村"]
+    assert service._build_running_context([]) == ""
+
+
+class EntityRefLLM(FakeLLM):
+    """Prompt 中带有已知实体词典时，按编号引用已知地点"""
+
+    def __init__(self):
+        super().__init__()
+        self.dictionary_prompts = 0
+
+    def chat_json(self, messages, **kwargs):
+        result = super().chat_json(messages, **kwargs)
+        if result and "已知实体" in messages[-1]["content"]:
+            self.dictionary_prompts += 1
+            result["locations"] = [{"ref": "L1"}]
+            result["events"][0]["location"] = "L1"
+            result["events"][0]["characters"] = ["C1"]
+        return result
+
+
+def test_entity_dictionary_is_injected_into_later_waves(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_ENTITY_DICT", "1")
+    monkeypatch.setenv("TRACE_ENTITY_FIRST_WAVE", "2")
+    llm = EntityRefLLM()
+    service = TraceService(llm_client=llm)
+
+    res = service.analyze_text(_novel(6), run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert llm.extract_calls == 6
+    assert llm.dictionary_prompts == 4
+    assert status["stats"]["entity_refs"] == 12
+    data = status["data"]
+    assert [l["id"] for l in data["locations"]] == ["青云门"]
+    assert all(e["location_id"] == "青云门" and e["characters"] == ["张小凡"] for e in data["events"])
+
+
+class RoutingLLM(FakeLLM):
+    """记录每次提取调用使用的模型；加速模型对含"草庙村"的片段返回空结果"""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = []
+
+    def chat_json(self, messages, use_boost=False, **kwargs):
+        result = super().chat_json(messages, **kwargs)
+        if result:
+            content = messages[-1]["content"]
+            self.routes.append(("boost" if use_boost else "main", content.split("\n")[0]))
+            if use_boost and "草庙村" in content:
+                return {"locations": [], "events": []}
+        return result
+
+
+def test_routing_sends_dense_chunks_to_main_and_reroutes_failures(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_ROUTING", "1")
+    llm = RoutingLLM()
+    service = TraceService(llm_client=llm)
+    text = (
+        "第1章 闲谈\n张小凡在青云门里与师兄闲谈，说了些琐事。\n\n"
+        "第2章 远行\n张小凡离开青云门，前往河阳城，经过空桑山，赶到流波山，又回到狐岐山。\n\n"
+        "第3章 回乡\n张小凡，离开青云门，回到草庙村，旧地重游。\n\n"
+    )
+
+    res = service.analyze_text(text, run_async=False)
+    status = service.get_session_status(res["session_id"])
+    routes = sorted(llm.routes, key=lambda r: r[1])
+    assert routes == [
+        ("boost", "章节信息：第1章 闲谈"),
+        ("main", "章节信息：第2章 远行"),
+        ("boost", "章节信息：第3章 回乡"),
+        ("main", "章节信息：第3章 回乡"),
+    ]
+    routing = status["stats"]["routing"]
+    assert routing == {"boost": 2, "main": 1, "rerouted": 1, "reasons": {"empty_with_signal": 1}}
@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.utils.endpoint_pool import Endpoint, EndpointPool, NoEndpointAvailable
+from app.utils.llm_client import LLMClient
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeCompletions:
+    def __init__(self, name, fail_with=None):
+        self.name = name
+        self.fail_with = fail_with
+        self.models = []
+
+    def create(self, model, **kwargs):
+        self.models.append(model)
+        if self.fail_with is not None:
+            raise self.fail_with
+        message = SimpleNamespace(content=f'{{"from": "{self.name}"}}')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def _endpoint(name, tier="main", weight=1.0, max_concurrency=8, fail_with=None):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(name, fail_with)))
+    return Endpoint(name, "http://x", "k", f"model-{name}", tier=tier, weight=weight,
+                    max_concurrency=max_concurrency, client=client)
+
+
+def test_least_outstanding_respects_weights():
+    a, b = _endpoint("a", weight=1), _endpoint("b", weight=3)
+    pool = EndpointPool([a, b])
+    picked = [pool.acquire().name for _ in range(4)]
+    assert picked.count("b") == 3 and picked.count("a") == 1
+
+
+def test_concurrency_limit_blocks_until_release():
+    a = _endpoint("a", max_concurrency=1)
+    pool = EndpointPool([a])
+    first = pool.acquire()
+    with pytest.raises(NoEndpointAvailable):
+        pool.acquire(timeout=0.05)
+    threading.Timer(0.05, pool.release, args=(first,)).start()
+    assert pool.acquire(timeout=2).name == "a"
+
+
+def test_auth_errors_remove_endpoint_and_rate_limits_cool_down():
+    a, b = _endpoint("a"), _endpoint("b")
+    pool = EndpointPool([a, b], cooldown=60)
+    pool.release(pool.acquire(), StatusError(401))
+    assert a.disabled_reason == "HTTP 401"
+    pool.release(pool.acquire(), StatusError(429))
+    assert b.cooldown_until > 0
+    with pytest.raises(NoEndpointAvailable):
+        pool.acquire(timeout=0.05)
+    b.cooldown_until = 0
+    assert pool.acquire().name == "b"
+    pool.release(b, StatusError(403))
+    with pytest.raises(NoEndpointAvailable):
+        pool.acquire()
+
+
+def test_llm_client_uses_pool_tiers():
+    main, boost = _endpoint("main"), _endpoint("boost", tier="boost")
+    client = LLMClient(pool=EndpointPool([main, boost]))
+    assert client.chat_json([{"role": "user", "content": "hi"}], use_boost=True) == {"from": "boost"}
+    assert client.chat_json([{"role": "user", "content": "hi"}]) == {"from": "main"}
+    assert main.client.chat.completions.models == ["model-main"]
+    stats = {s["name"]: s for s in client.pool.stats()}
+    assert stats["boost"]["served"] == 1 and stats["main"]["outstanding"] == 0
+
+
+def test_rate_limit_cooldown_follows_retry_after():
+    a = _endpoint("a")
+    pool = EndpointPool([a], cooldown=60)
+    error = StatusError(429)
+    error.response = SimpleNamespace(headers={"retry-after": "2"})
+    pool.release(pool.acquire(), error)
+    remaining = pool.stats()[0]["cooldown_remaining"]
+    assert 1 <= remaining <= 2
+    a.cooldown_until = 0
+    pool.release(pool.acquire(), StatusError(429))
+    assert pool.stats()[0]["cooldown_remaining"] > 50
+
+
+def test_cooling_boost_falls_back_to_main_without_waiting():
+    main, boost = _endpoint("main"), _endpoint("boost", tier="boost")
+    pool = EndpointPool([main, boost], cooldown=60)
+    pool.release(pool.acquire("boost"), StatusError(429))
+    client = LLMClient(pool=pool)
+    start = time.monotonic()
+    assert client.chat_json([{"role": "user", "content": "hi"}], use_boost=True) == {"from": "main"}
+    assert time.monotonic() - start < 1
+    assert boost.client.chat.completions.models == []
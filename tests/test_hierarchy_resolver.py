@@ -0,0 +1,178 @@
+import itertools
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services import hierarchy
+from app.services.hierarchy import HierarchyResolver
+from app.services.trace_service import TraceService
+
+
+class NoLLM:
+    pass
+
+
+def test_strongest_source_wins_and_ties_are_stable():
+    edges = [
+        ("偏殿", "天剑宗", "extractor"),
+        ("偏殿", "落霞峰", "classifier"),
+        ("丹房", "天剑宗", "fallback"),
+        ("丹房", "青云宗", "fallback"),
+        ("密室", "偏殿", "community"),
+    ]
+    results = set()
+    for perm in itertools.permutations(edges):
+        resolver = HierarchyResolver()
+        for child, parent, source in perm:
+            resolver.add(child, parent, source)
+        results.add(tuple(sorted(resolver.resolve().items())))
+    assert results == {(("丹房", "天剑宗"), ("偏殿", "落霞峰"), ("密室", "偏殿"))}
+
+
+def test_cycles_drop_the_weakest_edge():
+    for order in itertools.permutations([("A", "B", "extractor"), ("B", "C", "classifier"), ("C", "A", "fallback")]):
+        resolver = HierarchyResolver()
+        for child, parent, source in order:
+            resolver.add(child, parent, source)
+        assert resolver.resolve() == {"A": "B", "B": "C"}
+        assert resolver.cycles == [("C", "A", "fallback")]
+        assert resolver.sources == {"A": "extractor", "B": "classifier"}
+
+    resolver = HierarchyResolver()
+    resolver.add("A", "B", "extractor")
+    resolver.add("B", "A", "extractor")
+    resolver.add("A", "A", "relation")
+    assert resolver.resolve() == {"A": "B"}
+    assert resolver.stats() == {
+        "candidates": 2, "resolved": 1, "cycles_broken": 1, "rejected": 0, "sources": {"extractor": 1}
+    }
+
+
+def test_rejected_candidates_only_yield_to_stronger_sources():
+    for order in itertools.permutations(["add", "reject", "fallback"]):
+        resolver = HierarchyResolver()
+        for step in order:
+            if step == "add":
+                resolver.add("偏殿", "天剑宗", "extractor")
+            elif step == "reject":
+                resolver.reject("偏殿", "天剑宗", "classifier")
+            else:
+                resolver.add("偏殿", "天剑宗", "fallback")
+        assert resolver.resolve() == {}
+    resolver.add("偏殿", "落霞峰", "fallback")
+    resolver.add("偏殿", "天剑宗", "relation")
+    assert resolver.resolve() == {"偏殿": "天剑宗"} and resolver.sources == {"偏殿": "relation"}
+
+
+def test_classifier_null_overrides_extractor_hint(monkeypatch):
+    monkeypatch.setenv("TRACE_CLASSIFY_CACHE", "0")
+
+    class NullParentLLM:
+        def chat_json(self, messages, **kwargs):
+            return {"locations": [
+                {"id": "观星台", "scope": "world", "kind": "landmark", "parent_id": None},
+                {"id": "天剑宗", "scope": "world", "kind": "sect", "parent_id": None},
+            ]}
+
+    service = TraceService(llm_client=NullParentLLM())
+    locations = [
+        {"id": "天剑宗", "place_type": "fictional"},
+        {"id": "观星台", "place_type": "fictional", "parent_id": "天剑宗"},
+    ]
+    resolver = HierarchyResolver()
+    resolver.add_locations(locations, "extractor")
+    service._classify_locations_with_llm(locations)
+    assert locations[1]["parent_id"] is None
+    assert locations[1]["rejected_parents"] == {"天剑宗": "classifier"}
+    resolver.add_locations(locations, "extractor")
+    # 兜底再提同一父级也不能推翻分类的判断
+    resolver.add("观星台", "天剑宗", "fallback")
+    assert resolver.resolve() == {}
+    assert resolver.stats()["rejected"] == 1
+
+
+def test_nearest_anchor_and_node_filter():
+    resolver = HierarchyResolver()
+    for child, parent in [("房间", "院子"), ("院子", "城"), ("城", "国"), ("柜子", "房间"), ("孤岛", "海外")]:
+        resolver.add(child, parent, "extractor")
+    resolver.resolve(["房间", "院子", "城", "国", "柜子", "孤岛"])
+    assert "孤岛" not in resolver.parents
+    assert resolver.nearest_ancestor({"城", "国"}) == {"房间": "城", "院子": "城", "柜子": "城", "城": "国"}
+
+
+def test_map_reports_parent_source_and_relation_overrides(monkeypatch):
+    monkeypatch.setenv("TRACE_MOCK", "1")
+    service = TraceService(llm_client=NoLLM())
+    locations = [
+        {"id": "天剑宗", "place_type": "fictional", "scope": "world", "kind": "sect"},
+        {"id": "落霞峰", "place_type": "fictional", "scope": "world", "kind": "mountain"},
+        {"id": "偏殿", "place_type": "fictional", "scope": "sub", "kind": "hall",
+         "parent_id": "天剑宗", "parent_source": "fallback"},
+        {"id": "密室", "place_type": "fictional", "scope": "sub", "kind": "room",
+         "parent_id": "偏殿", "parent_source": "classifier"},
+    ]
+    resolver = HierarchyResolver()
+    resolver.add("偏殿", "落霞峰", "relation")
+    result = service._build_fictional_map(locations, tracks=[], events=[], hierarchy=resolver)
+    nodes = {n["location_id"]: n for n in result["nodes"]}
+    sub = {n["id"]: n for n in nodes["落霞峰"]["sub_map"]["nodes"]}
+    assert sub["偏殿"]["parent_source"] == "relation"
+    assert sub["密室"]["parent_id"] == "落霞峰" and sub["密室"]["parent_source"] == "classifier"
+
+
+class CountingRoots(dict):
+    reads = 0
+
+    def __getitem__(self, key):
+        CountingRoots.reads += 1
+        return super().__getitem__(key)
+
+
+class CountingParents(dict):
+    reads = 0
+
+    def get(self, *args):
+        CountingParents.reads += 1
+        return super().get(*args)
+
+
+class CountingDisjointSet(hierarchy._DisjointSet):
+    def __init__(self):
+        self.root = CountingRoots()
+
+
+def test_resolver_work_is_near_linear_in_candidates(monkeypatch):
+    monkeypatch.setattr(hierarchy, "_DisjointSet", CountingDisjointSet)
+    sources = ["relation", "classifier", "extractor", "fallback", "community"]
+    reads_per_edge = []
+    for n_names, n_edges in ((12500, 50000), (50000, 200000)):
+        rnd = random.Random(1)
+        names = [f"地点{i}" for i in range(n_names)]
+        resolver = HierarchyResolver()
+        for _ in range(n_edges):
+            resolver.add(rnd.choice(names), rnd.choice(names), rnd.choice(sources))
+        CountingRoots.reads = 0
+        parents = resolver.resolve()
+        reads_per_edge.append(CountingRoots.reads / len(resolver))
+
+        resolver.parents = CountingParents(resolver.parents)
+        CountingParents.reads = 0
+        anchors = resolver.nearest_ancestor(set(names[:500]))
+        # 祖先查询逐层记忆：每个地点的父级至多查一次，外加每条路径的终点
+        assert CountingParents.reads <= 2 * len(parents)
+        assert all(a in names[:500] for a in anchors.values())
+
+        # 结果是森林：沿父级向上必然终止
+        for child in parents:
+            seen = {child}
+            cur = child
+            while cur in parents:
+                cur = parents[cur]
+                assert cur not in seen
+                seen.add(cur)
+
+    # 并查集的访问次数只与候选边数成正比（路径减半），不随规模变陡；除此之外只有一次排序
+    assert all(r < 3 for r in reads_per_edge)
+    assert reads_per_edge[1] < 1.5 * reads_per_edge[0]
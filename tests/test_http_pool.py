@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app import create_app
+from app.utils import http_pool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_prewarm_opens_reusable_connections():
+    pytest.importorskip("httpx")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        assert http_pool.prewarm([base_url, base_url + "/other"], connections_per_host=2) == 2
+        stats = http_pool.pool_stats()
+        assert stats["shared"] is True
+        assert stats["prewarmed"] >= 2
+        assert stats["idle_connections"] >= 1
+        assert http_pool.get_shared_http_client() is http_pool.get_shared_http_client()
+    finally:
+        server.shutdown()
+
+
+def test_llm_stats_endpoint_reports_pools():
+    client = create_app().test_client()
+    data = client.get("/api/trace/llm/stats").get_json()
+    assert data["success"] is True
+    assert any(e["tier"] == "main" for e in data["endpoints"])
+    assert "requests" in data["http"]
+
+
+def test_in_flight_is_released_when_request_fails():
+    httpx = pytest.importorskip("httpx")
+    client = http_pool.get_shared_http_client()
+    before = http_pool.pool_stats()
+    # 端口 1 上没有服务，建连直接失败，不会有响应
+    with pytest.raises(httpx.HTTPError):
+        client.get("http://127.0.0.1:1/", timeout=2.0)
+    after = http_pool.pool_stats()
+    assert after["in_flight"] == before["in_flight"]
+    assert after["errors"] == before["errors"] + 1
+    assert after["requests"] == before["requests"] + 1
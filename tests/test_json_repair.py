@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.utils.endpoint_pool import Endpoint, EndpointPool
+from app.utils.json_repair import parse_json, repair_stats
+from app.utils.llm_client import LLMClient
+
+
+@pytest.mark.parametrize("text, expected, how", [
+    ('{"a": 1}', {"a": 1}, "strict"),
+    ('好的：\n```json\n{"a": [1, 2]}\n```\n以上。', {"a": [1, 2]}, "extracted"),
+    ('{"a": [1, 2,], "b": {"c": 3,},}', {"a": [1, 2], "b": {"c": 3}}, "repaired"),
+    ('结果如下 {"a": true} 希望有帮助 {"b"}', {"a": True}, "repaired"),
+    ('[注] 输出：{"a": True, // 注释\n "b": None /* 空 */}', {"a": True, "b": None}, "repaired"),
+    ('{"summary": "第一行\n第二行"}', {"summary": "第一行\n第二行"}, "repaired"),
+    # 截断：丢掉最后一个不完整的元素，补齐括号
+    ('```json\n{"locations": [{"id": "青云门"}, {"id": "河阳', {"locations": [{"id": "青云门"}]}, "repaired"),
+    ('{"locations": [{"id": "青云门", "aliases": ["青云"', {"locations": []}, "repaired"),
+    ('{"world": {"name": "诛仙", "width": 10', {"world": {"name": "诛仙"}}, "repaired"),
+    ('{"events": [], "locations": [{"id', {"events": [], "locations": []}, "repaired"),
+    ('[[1, 2], [3', [[1, 2]], "repaired"),
+])
+def test_parse_json_repairs_common_defects(text, expected, how):
+    assert parse_json(text) == (expected, how)
+
+
+def test_parse_json_gives_up_without_structure():
+    before = repair_stats()["failed"]
+    with pytest.raises(json.JSONDecodeError):
+        parse_json("抱歉，我无法完成这个请求。")
+    assert repair_stats()["failed"] == before + 1
+
+
+class TruncatedCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, **kwargs):
+        self.calls += 1
+        content = '{"locations": [{"id": "青云门"}], "events": [{"order_in_chunk": 1, "summary": "未完'
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_chat_json_salvages_truncated_response_without_recall():
+    completions = TruncatedCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    llm = LLMClient(pool=EndpointPool([Endpoint("main", "http://x", "k", "m", client=client)]))
+    usage = {}
+    result = llm.chat_json([{"role": "user", "content": "hi"}], usage=usage)
+    assert result == {"locations": [{"id": "青云门"}], "events": []}
+    assert usage["json_salvaged"] == 1
+    assert completions.calls == 1
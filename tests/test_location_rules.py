@@ -0,0 +1,163 @@
+import copy
+import os
+import random
+import re
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services import location_rules
+from app.services.location_rules import (
+    EXCLUSION_SUFFIXES, LOCATION_RULES, LocationRuleEngine, REAL_PLACE_SUFFIXES, SUB_KEYWORDS, SUB_KINDS, SUB_SUFFIXES
+)
+
+
+def _naive_is_sub_name(name):
+    """原先逐个 endswith / in 的判定"""
+    for s in SUB_SUFFIXES:
+        if name.endswith(s):
+            if s == "门" and len(name) > 2: continue
+            if s == "院" and ("书院" in name or "学院" in name or "研究院" in name): continue
+            if s == "场" and ("广场" not in name and "市场" not in name and "操场" not in name): continue
+            return True
+    return any(k in name for k in SUB_KEYWORDS)
+
+
+def _naive_apply_scope(loc):
+    kind = (loc.get("kind") or "").strip().lower()
+    scope = (loc.get("scope") or "").strip().lower()
+    name = (loc.get("id") or "").strip()
+    if kind in SUB_KINDS and scope == "world":
+        loc["scope"] = "sub"
+    if kind in {"item", "furniture", "decoration", "device", "weapon", "tool"}:
+        loc["scope"] = "poi"
+    if kind in {"country", "state", "province", "continent", "ocean", "planet", "galaxy", "universe"} and scope != "world":
+        loc["scope"] = "world"
+    if name and _naive_is_sub_name(name) and scope == "world":
+        loc["scope"] = "sub"
+
+
+def _names(n, seed=11):
+    rnd = random.Random(seed)
+    heads = ["天剑", "青云", "落霞", "凤凰", "大", "后", "书", "研究", "广", "操", "市", "战", "东", "小"]
+    tails = list(SUB_SUFFIXES) + list(EXCLUSION_SUFFIXES) + list(SUB_KEYWORDS[:40]) + ["学院", "广场", "机场", "街道", "殿", "宫"]
+    return ["".join(rnd.choice(heads) for _ in range(rnd.randint(0, 2))) + rnd.choice(tails) for _ in range(n)]
+
+
+def test_engine_matches_keyword_by_keyword_rules():
+    for name in _names(5000):
+        rules = LOCATION_RULES.name_rules(name)
+        assert rules.sub_like == _naive_is_sub_name(name), name
+        assert rules.excluded == any(name.endswith(ex) for ex in EXCLUSION_SUFFIXES), name
+        expected_real = "real" if re.search(r'(省|市|县|区|街道|站|机场|港|大学|学院|医院|公园|广场)$', name) else None
+        assert LOCATION_RULES.place_type(name) == expected_real, name
+
+    rnd = random.Random(2)
+    kinds = ["hall", "item", "country", "sect", "city", "", "Room "]
+    for name in _names(2000, seed=3):
+        loc = {"id": name, "kind": rnd.choice(kinds), "scope": rnd.choice(["world", "sub", "poi", None])}
+        expected = copy.deepcopy(loc)
+        _naive_apply_scope(expected)
+        LOCATION_RULES.apply_scope(loc)
+        assert loc == expected
+
+
+def test_ambiguous_suffixes():
+    assert not LOCATION_RULES.name_rules("天剑门").sub_like
+    assert LOCATION_RULES.name_rules("大门").sub_like
+    assert not LOCATION_RULES.name_rules("白鹿书院").sub_suffix
+    assert LOCATION_RULES.name_rules("后院").sub_suffix
+    assert not LOCATION_RULES.name_rules("古战场").sub_like
+    assert LOCATION_RULES.name_rules("中心广场").sub_like
+    assert LOCATION_RULES.is_sub_location({"id": "后山"}) is False
+    assert LOCATION_RULES.is_sub_location({"id": "凤凰山", "kind": "cave"}) is True
+
+
+class CountingNode(dict):
+    lookups = 0
+
+    def get(self, *args):
+        CountingNode.lookups += 1
+        return super().get(*args)
+
+
+class CountingSuffixTrie(location_rules.SuffixTrie):
+    def __init__(self):
+        self._root = CountingNode()
+
+    def add(self, suffix, tag):
+        node = self._root
+        for ch in reversed(suffix):
+            node = node.setdefault(ch, CountingNode())
+        node.setdefault(None, set()).add(tag)
+
+
+class CountingKeywords(location_rules.AhoCorasick):
+    scans = 0
+    chars = 0
+
+    def iter_matches(self, text):
+        CountingKeywords.scans += 1
+        CountingKeywords.chars += len(text)
+        return super().iter_matches(text)
+
+
+def test_rule_engine_work_per_location(monkeypatch):
+    monkeypatch.setattr(location_rules, "SuffixTrie", CountingSuffixTrie)
+    monkeypatch.setattr(location_rules, "AhoCorasick", CountingKeywords)
+    engine = LocationRuleEngine()  # 不共用缓存，每个名称都走一遍实际判定
+    longest = max(len(s) for s in list(SUB_SUFFIXES) + list(EXCLUSION_SUFFIXES) + list(REAL_PLACE_SUFFIXES))
+    names = _names(20000, seed=5)
+    for name in names:
+        CountingNode.lookups = 0
+        engine.name_rules.__wrapped__(name)
+        # 后缀只从名称末尾倒着走一遍，步数受最长后缀限制，与后缀个数无关
+        assert CountingNode.lookups <= 2 * (min(len(name), longest) + 1), name
+    # 关键词与歧义词共用一个自动机，每个名称只扫描一遍
+    assert CountingKeywords.scans == len(names)
+    assert CountingKeywords.chars == sum(len(n) for n in names)
+
+
+@pytest.mark.skipif(not os.getenv("RUN_BENCHMARKS"), reason="基准测试，设置 RUN_BENCHMARKS=1 时运行")
+def test_rule_engine_per_location_benchmark():
+    names = _names(20000, seed=5)
+    engine = LocationRuleEngine()
+    started = time.perf_counter()
+    for name in names:
+        engine.name_rules(name)
+    per_location = (time.perf_counter() - started) / len(names)
+
+    started = time.perf_counter()
+    for name in names:
+        _naive_is_sub_name(name)
+        any(name.endswith(ex) for ex in EXCLUSION_SUFFIXES)
+    naive_per_location = (time.perf_counter() - started) / len(names)
+    print(f"\nrule engine: {per_location * 1e6:.2f} µs/location, keyword-by-keyword: {naive_per_location * 1e6:.2f} µs/location")
+
+
+def test_verdict_confidence_follows_rule_strength():
+    cases = {
+        ("藏经阁", ""): ("sub", 0.95),
+        ("书房", ""): ("sub", 0.95),
+        ("凤凰城", ""): ("world", 0.9),
+        ("观星台", ""): ("sub", 0.75),
+        ("山门", ""): ("sub", 0.5),  # 关键词 "山门" 与排除后缀 "门" 冲突
+        ("某地", "cave"): ("sub", 0.7),
+        ("某地", "country"): ("world", 0.95),
+        ("某地", ""): (None, 0.0),
+    }
+    for (name, kind), expected in cases.items():
+        v = LOCATION_RULES.verdict({"id": name, "kind": kind})
+        assert (v.scope, v.confidence) == expected, name
+    # 判断方向与 apply_scope 一致
+    for name in _names(2000, seed=9):
+        v = LOCATION_RULES.verdict({"id": name})
+        loc = {"id": name, "scope": "world"}
+        LOCATION_RULES.apply_scope(loc)
+        if v.scope == "sub":
+            assert loc["scope"] == "sub", name
+        elif v.scope == "world":
+            assert loc["scope"] == "world", name
@@ -0,0 +1,111 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.map_graph import MapGraph, WORLD_GROUP
+from app.services.trace_service import TraceService
+
+
+class NoLLM:
+    pass
+
+
+def test_graph_counts_and_groups():
+    graph = MapGraph(["甲", "乙", "丙"])
+    graph.add_tracks([
+        {"character": "张三", "segments": [
+            {"from_location": "甲", "to_location": "乙", "evidence": "e1"},
+            {"from_location": "乙", "to_location": "乙"},
+            {"from_location": "乙", "to_location": "未知"},
+            {"from_location": "乙", "to_location": "丙"},
+        ]},
+        {"character": "李四", "segments": [{"from_location": "丙", "to_location": "甲"}]},
+    ])
+    assert [graph.degree_of(x) for x in ["甲", "乙", "丙", "未知"]] == [2, 2, 2, 0]
+    assert sorted(graph.neighbors("乙")) == ["丙", "甲"]
+    assert list(graph.iter_segments()) == [("甲", "乙", "张三"), ("乙", "丙", "张三"), ("丙", "甲", "李四")]
+    assert graph.route_edges({"甲", "乙"}) == [{"a": "甲", "b": "乙", "type": "route_to", "evidence": "e1"}]
+
+    edges = [{"a": "甲", "b": "乙"}, {"a": "乙", "b": "丙"}, {"a": "丙", "b": "丁"}, {"a": "甲", "b": "甲"}]
+    grouped = MapGraph.group_edges(edges, {"甲": WORLD_GROUP, "乙": WORLD_GROUP, "丙": "乙"})
+    assert grouped == {WORLD_GROUP: [edges[0], edges[3]]}
+
+
+def _world(n_groups, children, n_segments, seed=3):
+    rnd = random.Random(seed)
+    locations, ids = [], []
+    for g in range(n_groups):
+        city = f"城{g}"
+        locations.append({"id": city, "place_type": "fictional", "scope": "world", "kind": "city"})
+        ids.append(city)
+        for c in range(children):
+            room = f"城{g}房{c}"
+            locations.append({"id": room, "place_type": "fictional", "scope": "sub", "kind": "room", "parent_id": city})
+            ids.append(room)
+    segments = []
+    for _ in range(n_segments):
+        g = rnd.randrange(n_groups)
+        # 多数移动发生在同一座城里
+        if rnd.random() < 0.8:
+            a, b = f"城{g}房{rnd.randrange(children)}", f"城{g}房{rnd.randrange(children)}"
+        else:
+            a, b = rnd.choice(ids), rnd.choice(ids)
+        segments.append({"from_location": a, "to_location": b, "evidence": ""})
+    events = [{"location_id": rnd.choice(ids), "summary": f"事件{i}"} for i in range(2000)]
+    return locations, [{"character": "甲", "segments": segments}], events
+
+
+def test_sub_maps_match_per_group_filters(monkeypatch):
+    monkeypatch.setenv("TRACE_MOCK", "1")
+    service = TraceService(llm_client=NoLLM())
+    locations, tracks, events = _world(20, 6, 800)
+    result = service._build_fictional_map(locations, tracks, events=events)
+
+    routes = [(s["from_location"], s["to_location"]) for s in tracks[0]["segments"]
+              if s["from_location"] != s["to_location"]]
+    world_ids = {n["location_id"] for n in result["nodes"]}
+    assert world_ids == {f"城{g}" for g in range(20)}
+    for node in result["nodes"]:
+        child_set = {n["id"] for n in node["sub_map"]["nodes"]}
+        expected = [(a, b) for a, b in routes if a in child_set and b in child_set]
+        # mock 模式下关系即路线，子地图边 = 关系 + 路线
+        assert [(e["source"], e["target"]) for e in node["sub_map"]["edges"]] == expected + expected
+        assert [e["summary"] for e in node["sub_map"]["events"]] == [
+            e["summary"] for e in events if e["location_id"] in child_set
+        ]
+    assert all(e["a"] in world_ids and e["b"] in world_ids for e in result["edges"])
+    assert len(result["polylines"]) == sum(1 for a, b in routes if a.split("房")[0] != b.split("房")[0])
+
+
+class CountingGroups(dict):
+    lookups = 0
+
+    def get(self, *args):
+        CountingGroups.lookups += 1
+        return super().get(*args)
+
+
+class CountingEdge(dict):
+    reads = 0
+
+    def __getitem__(self, key):
+        CountingEdge.reads += 1
+        return super().__getitem__(key)
+
+
+def test_grouping_visits_each_edge_once_whatever_the_group_count():
+    rnd = random.Random(9)
+    ids = [f"地点{i}" for i in range(20000)]
+    pairs = [(rnd.choice(ids), rnd.choice(ids)) for _ in range(200000)]
+    edges = [CountingEdge(a=a, b=b) for a, b in pairs]
+    for n_groups in (2, 2000):
+        plain = {lid: f"组{i % n_groups}" for i, lid in enumerate(ids)}
+        expected = sum(1 for a, b in pairs if plain[a] == plain[b])
+        CountingGroups.lookups = CountingEdge.reads = 0
+        grouped = MapGraph.group_edges(edges, CountingGroups(plain))
+        assert sum(len(v) for v in grouped.values()) == expected
+        # 每条边只看一遍：先查起点所在组，再查终点，与分组数无关
+        assert CountingEdge.reads == 2 * len(edges)
+        assert CountingGroups.lookups == 2 * len(edges)
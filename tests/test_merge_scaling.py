@@ -0,0 +1,82 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+
+
+class NoLLM:
+    pass
+
+
+def _results(n_chunks, seed=1):
+    """n 个片段的提取结果，乱序返回（模拟并发完成顺序）"""
+    rnd = random.Random(seed)
+    results, order = [], []
+    for i in range(n_chunks):
+        chunk_id = f"ch{i // 3:04d}_p{i % 3 + 1:03d}"
+        order.append(chunk_id)
+        locs = [{"id": f"地点{rnd.randrange(300)}", "place_type": "fictional"} for _ in range(3)]
+        events = [{
+            "order_in_chunk": 3 - k,
+            "location": locs[k]["id"],
+            "characters": [f"人物{rnd.randrange(100)}"],
+            "summary": f"事件{i}-{k}",
+            "evidence": f"证据{i}"
+        } for k in range(3)]
+        results.append({"_chunk_id": chunk_id, "locations": locs, "events": events})
+    rnd.shuffle(results)
+    return results, order
+
+
+class CountingList(list):
+    """记录被完整遍历的次数；按值查找（index / in / count）视为逐片段扫描，直接报错"""
+
+    def __init__(self, items):
+        super().__init__(items)
+        self.passes = 0
+
+    def __iter__(self):
+        self.passes += 1
+        return super().__iter__()
+
+    def index(self, *args):
+        raise AssertionError("按值查找片段位置是 O(n) 的")
+
+    def __contains__(self, item):
+        raise AssertionError("按值查找片段是 O(n) 的")
+
+    def count(self, item):
+        raise AssertionError("按值统计片段是 O(n) 的")
+
+
+def test_merge_events_keeps_chunk_order_and_first_result():
+    service = TraceService(llm_client=NoLLM())
+    results = [
+        {"_chunk_id": "b", "events": [{"order_in_chunk": 2, "location": "乙", "summary": "二"},
+                                      {"order_in_chunk": 1, "location": "乙", "summary": "一"}]},
+        {"_chunk_id": "a", "events": [{"order_in_chunk": 1, "location": "甲", "summary": "零"}]},
+        # 同一片段的第二份结果被忽略
+        {"_chunk_id": "a", "events": [{"order_in_chunk": 1, "location": "甲", "summary": "重复"}]},
+        {"_chunk_id": "zz", "events": [{"order_in_chunk": 1, "location": "丙", "summary": "不在顺序里"}]},
+    ]
+    events = service._merge_events(results, {}, ["a", "b"])
+    assert [(e["summary"], e["order"]) for e in events] == [("零", 1), ("一", 2), ("二", 3)]
+
+
+def test_merge_events_scans_inputs_a_constant_number_of_times():
+    service = TraceService(llm_client=NoLLM())
+    results, order = _results(10000)
+    _, alias_to_id = service._merge_locations(results)
+    results, order = CountingList(results), CountingList(order)
+    events = service._merge_events(results, alias_to_id, order)
+
+    assert len(events) == 30000
+    position = {cid: i for i, cid in enumerate(order)}
+    keys = [(position[e["_chunk_id"]], e["order_in_chunk"]) for e in events]
+    assert keys == sorted(keys)
+    # 输入各只遍历常数次（上面校验用的 enumerate 另算一次），与片段数无关
+    assert results.passes <= 2
+    assert order.passes <= 3
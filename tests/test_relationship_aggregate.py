@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.relationship_service import RelationshipService
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class ScriptedLLM:
+    """按顺序抛出给定的异常，之后返回合并结果；记录每次调用的 max_retries"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def chat_json(self, messages, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs.get("max_retries"))
+            if self.errors:
+                raise self.errors.pop(0)
+        return {"entities": [{"id": "合并", "type": "person"}], "relationships": []}
+
+
+def _results(n):
+    return [{"entities": [{"id": f"人物{i}", "type": "person"}], "relationships": []} for i in range(n)]
+
+
+def test_aggregation_failures_are_retried_by_the_batch_runner():
+    llm = ScriptedLLM([StatusError(503, {"retry-after": "0"})])
+    service = RelationshipService(llm_client=llm)
+    merged = service._recursive_aggregate(_results(3))
+    assert [e["id"] for e in merged["entities"]] == ["合并"]
+    assert llm.calls == [0, 0]
+
+
+def test_aggregation_falls_back_to_first_result_when_retries_run_out():
+    llm = ScriptedLLM([StatusError(400)])
+    service = RelationshipService(llm_client=llm)
+    merged = service._recursive_aggregate(_results(3))
+    assert [e["id"] for e in merged["entities"]] == ["人物0"]
+    assert llm.calls == [0]
+
+
+class SlowExtractLLM:
+    """提取每次耗时 delay 秒并返回一个人物；聚合请求直接返回合并结果"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.deadlines = []
+        self._lock = threading.Lock()
+        self._n = 0
+
+    def chat_json(self, messages, **kwargs):
+        with self._lock:
+            self.deadlines.append(kwargs.get("deadline"))
+        if messages[-1]["content"].startswith("请合并"):
+            return {"entities": [{"id": "合并", "type": "person"}], "relationships": []}
+        time.sleep(self.delay)
+        with self._lock:
+            self._n += 1
+            n = self._n
+        return {"entities": [{"id": f"人物{n}", "type": "person"}], "relationships": []}
+
+
+def test_deadline_returns_partial_results(monkeypatch):
+    monkeypatch.setenv("RELATION_CHUNK_SIZE", "200")
+    monkeypatch.setenv("RELATION_CHUNK_OVERLAP", "0")
+    monkeypatch.setenv("RELATION_EXTRACT_MAX_WORKERS", "1")
+    llm = SlowExtractLLM(0.15)
+    service = RelationshipService(llm_client=llm)
+    text = "。".join("某人走进了山门" for _ in range(400))
+    started = time.monotonic()
+    response = service.analyze_text(text, session_id="s", run_async=False, deadline_seconds=0.5)
+    assert response["deadline_seconds"] == 0.5
+    assert time.monotonic() - started < 2
+
+    status = service.get_session_status("s")
+    assert status["status"] == "completed"
+    data = status["data"]
+    assert data["partial"] is True
+    assert 0 < len(data["entities"]) < len(service._chunk_text(service.preprocess_text(text), 200, 0))
+    assert all(d is not None for d in llm.deadlines)
+
+
+def test_invalid_deadline_is_rejected():
+    service = RelationshipService(llm_client=ScriptedLLM([]))
+    assert service.analyze_text("某人", run_async=False, deadline_seconds=-1)["success"] is False
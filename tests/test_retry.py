@@ -0,0 +1,191 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+from app.utils.retry import RetryableAPIClient, RetryBudget, classify_error
+
+os.environ["GEOCODE_DISABLE"] = "1"
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def test_classify_error():
+    assert classify_error(StatusError(400)) == (False, None)
+    assert classify_error(StatusError(401)) == (False, None)
+    assert classify_error(StatusError(429, {"retry-after": "3"})) == (True, 3.0)
+    assert classify_error(StatusError(503, {"retry-after-ms": "250"})) == (True, 0.25)
+    assert classify_error(ConnectionError("reset")) == (True, None)
+    assert classify_error(ValueError("bad json")) == (False, None)
+
+
+def test_call_with_retry_skips_non_retryable_and_honors_budget():
+    retrier = RetryableAPIClient(max_retries=3, initial_delay=0.0)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        retrier.call_with_retry(bad_request)
+    assert len(calls) == 1
+
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise StatusError(503, {"retry-after": "0"})
+        return "ok"
+
+    assert retrier.call_with_retry(flaky) == "ok"
+
+    budget = RetryBudget(ratio=0.0, min_retries=1)
+    attempts.clear()
+    with pytest.raises(StatusError):
+        retrier.call_with_retry(flaky, budget=budget)
+    assert len(attempts) == 2
+    assert budget.stats() == {"calls": 1, "retries": 1, "denied": 1, "ratio": 0.0}
+
+
+def test_iter_batch_runs_concurrently_and_streams_results():
+    retrier = RetryableAPIClient(max_retries=2, initial_delay=0.0)
+    active = []
+    peak = []
+    lock = threading.Lock()
+    failed_once = set()
+
+    def work(n):
+        with lock:
+            active.append(n)
+            peak.append(len(active))
+        time.sleep(0.05 if n == 0 else 0.01)
+        with lock:
+            active.remove(n)
+        if n == 3 and n not in failed_once:
+            failed_once.add(n)
+            raise StatusError(503, {"retry-after": "0"})
+        if n == 5:
+            raise StatusError(400)
+        return n * 10
+
+    retried = []
+    events = list(retrier.iter_batch(range(6), work, max_workers=3, on_retry=lambda i, e, k: retried.append((i, k))))
+    assert max(peak) == 3
+    assert retried == [(3, 1)]
+    # 慢的第 0 项不阻塞后续结果的产出
+    assert events[0][0] != 0
+    assert sorted(i for i, _, _ in events) == list(range(6))
+    errors = {i: e for i, _, e in events if e is not None}
+    assert list(errors) == [5] and isinstance(errors[5], StatusError)
+
+    results, failures = retrier.call_batch_with_retry(list(range(5)), lambda n: n * 10, max_workers=3)
+    assert results == [0, 10, 20, 30, 40]
+    assert failures == []
+
+
+def test_call_batch_with_retry_item_timeout_and_budget():
+    retrier = RetryableAPIClient(max_retries=5, initial_delay=0.0)
+
+    def work(n):
+        if n == 0:
+            time.sleep(0.5)
+        if n == 1:
+            raise ConnectionError("reset")
+        return n
+
+    budget = RetryBudget(ratio=0.0, min_retries=2)
+    started = time.monotonic()
+    results, failures = retrier.call_batch_with_retry([0, 1, 2], work, max_workers=3, item_timeout=0.2, budget=budget)
+    assert time.monotonic() - started < 0.45
+    assert results == [2]
+    assert [(f["index"], f["error"][:4]) for f in failures] == [(0, "第 1 "), (1, "rese")]
+    assert budget.stats()["retries"] == 2
+
+    with pytest.raises(ConnectionError):
+        retrier.call_batch_with_retry([1, 2], work, continue_on_failure=False, budget=RetryBudget(ratio=0.0, min_retries=0))
+
+
+def test_item_timeout_starts_when_item_is_dispatched():
+    retrier = RetryableAPIClient(max_retries=0)
+    calls = []
+
+    def work(n):
+        calls.append(n)
+        time.sleep(0.1)
+        return n
+
+    # 8 项、2 个线程，整批约 0.4 秒；单项上限 0.25 秒只约束执行时长，排队时间不算
+    results, failures = retrier.call_batch_with_retry(list(range(8)), work, max_workers=2, item_timeout=0.25)
+    assert failures == []
+    assert results == list(range(8))
+    assert sorted(calls) == list(range(8))
+
+
+def test_stuck_item_keeps_its_worker_until_it_returns():
+    retrier = RetryableAPIClient(max_retries=0)
+
+    def work(n):
+        time.sleep(n)
+        return n
+
+    # 唯一的线程被 0.8 秒的调用占住：它超时，但后两项等线程空出来才开始计时，都能完成
+    started = time.monotonic()
+    outcomes = {}
+    for idx, result, error in retrier.iter_batch([0.8, 0, 0], work, max_workers=1, item_timeout=0.3):
+        outcomes[idx] = (result, type(error).__name__ if error else None, time.monotonic() - started)
+    assert outcomes[0][1] == "DeadlineExceeded" and outcomes[0][2] < 0.6
+    assert outcomes[1][:2] == (0, None) and outcomes[2][:2] == (0, None)
+    assert outcomes[1][2] >= 0.75
+
+
+class FlakyLLM:
+    """每个片段的第一次提取返回 503，记录调用顺序"""
+
+    def __init__(self):
+        self.order = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def chat_json(self, messages, **kwargs):
+        content = messages[-1]["content"]
+        if "请分析以下文本片段" not in content:
+            return {}
+        title = content.split("\n")[0]
+        with self._lock:
+            self.order.append(title)
+            if "第1章" in title and title not in self._seen:
+                self._seen.add(title)
+                raise StatusError(503, {"retry-after": "0"})
+        return {
+            "locations": [{"id": "青云门", "place_type": "fictional"}],
+            "events": [{"order_in_chunk": 1, "location": "青云门", "characters": ["张小凡"], "summary": title}]
+        }
+
+
+def test_failed_chunks_are_retried_after_fresh_work(monkeypatch):
+    monkeypatch.delenv("TRACE_MOCK", raising=False)
+    monkeypatch.setenv("TRACE_EXTRACT_MAX_WORKERS", "1")
+    llm = FlakyLLM()
+    service = TraceService(llm_client=llm)
+    text = "".join(f"第{i}章 标题{i}\n张小凡在青云门修炼，第{i}日。\n\n" for i in range(1, 4))
+
+    res = service.analyze_text(text, run_async=False)
+    status = service.get_session_status(res["session_id"])
+    assert status["status"] == "completed"
+    assert [t[-7:] for t in llm.order] == ["第1章 标题1", "第2章 标题2", "第3章 标题3", "第1章 标题1"]
+    assert status["stats"]["chunk_retries"] == 1
+    assert status["stats"]["retry_budget"]["retries"] == 1
+    assert status["data"]["overview"]["event_count"] == 3
@@ -0,0 +1,38 @@
+import gzip
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.utils.text_ingest import UploadRejected, detect_encoding, read_text_upload
+
+SAMPLE = "第一章 青云门\n\n张小凡说道：“我们明天一早就去青云门拜师。”他走出了草庙村。\n" * 50
+
+
+def test_detect_encoding():
+    assert detect_encoding(SAMPLE.encode('utf-8')) == 'utf-8'
+    assert detect_encoding(b'\xef\xbb\xbf' + SAMPLE.encode('utf-8')) == 'utf-8-sig'
+    assert detect_encoding(SAMPLE.encode('gb18030')) == 'gb18030'
+    assert detect_encoding("第一章 青雲門\n\n張小凡說道：「我們明天一早就去青雲門拜師。」".encode('big5') * 20) == 'big5'
+
+
+def test_read_text_upload_roundtrip_across_blocks():
+    data = (SAMPLE * 200).encode('gb18030')
+    text, encoding = read_text_upload(io.BytesIO(data), 'novel.txt', max_chars=10_000_000)
+    assert encoding == 'gb18030'
+    assert text == SAMPLE * 200
+
+
+def test_read_text_upload_gzip():
+    data = gzip.compress(SAMPLE.encode('utf-8'))
+    text, encoding = read_text_upload(io.BytesIO(data), 'novel.txt.gz', max_chars=10_000_000)
+    assert encoding == 'utf-8'
+    assert text == SAMPLE
+
+
+def test_read_text_upload_rejects_long_text():
+    with pytest.raises(UploadRejected):
+        read_text_upload(io.BytesIO(SAMPLE.encode('utf-8')), 'novel.txt', max_chars=100)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_service import TraceService
+from app.utils.text_view import TextView, normalize_text
+
+os.environ["TRACE_MOCK"] = "1"
+
+
+def test_normalize_text():
+    raw = "  \r\n第一章  \r\n\r\n\r\n　　张三走了。 \r  \n\n\n李四来了。\n \n\t\n"
+    assert normalize_text(raw) == "第一章\n\n张三走了。\n\n李四来了。"
+
+
+def test_text_view_is_offset_based():
+    source = "abc  hello world  xyz"
+    view = TextView(source, 3, 18).strip()
+    assert (view.start, view.end) == (5, 16)
+    assert view.text == "hello world"
+    assert view.rfind("o") == 7
+    assert view.view(6).text == "world"
+
+
+def test_split_chapters_returns_views_into_one_buffer():
+    service = TraceService()
+    text = service.preprocess_text("序言\n第一章 出山\n张三下山。\n\n第二章 入城\n张三进城。\n")
+    chapters = service._split_chapters(text)
+    assert [title for title, _ in chapters] == ["第一章 出山", "第二章 入城"]
+    assert all(view.source is text for _, view in chapters)
+    assert [view.text for _, view in chapters] == ["张三下山。", "张三进城。"]
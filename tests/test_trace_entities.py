@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_entities import EntityDictionary, expand_entity_refs
+
+
+def _dictionary():
+    locations = [
+        {"id": "青云门", "aliases": ["青云"], "place_type": "fictional"},
+        {"id": "大竹峰", "aliases": [], "place_type": "fictional"},
+    ]
+    results = [{"events": [{"characters": ["张小凡", "田不易"]}, {"characters": ["张小凡"]}]}]
+    return EntityDictionary.build(locations, results)
+
+
+def test_for_chunk_lists_only_entities_in_text():
+    text, refs = _dictionary().for_chunk("张小凡回到大竹峰。")
+    assert set(refs) == {"L1", "C1"}
+    assert refs["L1"]["name"] == "大竹峰"
+    assert "L1 大竹峰" in text and "C1 张小凡" in text
+    assert "青云门" not in text
+    assert _dictionary().for_chunk("无关的一段话。") == ("", {})
+
+
+def test_expand_entity_refs_restores_names():
+    _, refs = _dictionary().for_chunk("张小凡离开青云，回到大竹峰。")
+    raw = {
+        "locations": [{"ref": "L2"}, {"id": "草庙村", "place_type": "fictional"}],
+        "events": [{"location": "L1", "characters": ["C1", "林惊羽"], "summary": "回山"}],
+    }
+    assert expand_entity_refs(raw, refs) == 3
+    assert raw["locations"][0]["id"] == "青云门"
+    assert raw["locations"][0]["place_type"] == "fictional"
+    assert raw["locations"][1]["id"] == "草庙村"
+    assert raw["events"][0]["location"] == "大竹峰"
+    assert raw["events"][0]["characters"] == ["张小凡", "林惊羽"]
+
+
+def test_expand_entity_refs_ignores_non_string_refs():
+    _, refs = _dictionary().for_chunk("张小凡离开青云，回到大竹峰。")
+    raw = {"locations": [{"ref": ["L1"]}, {"id": {"name": "L1"}}, {"ref": " L2 "}], "events": [{"location": ["L1"]}]}
+    assert expand_entity_refs(raw, refs) == 1
+    assert raw["locations"][0] == {"ref": ["L1"]}
+    assert raw["locations"][2]["id"] == "青云门"
@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from app.services.trace_signals import (
+    FICTIONAL_LOCATION_PATTERN,
+    LocationSignalScorer,
+    find_location_candidates,
+    prefilter_report,
+    select_focus_windows,
+    validate_extraction,
+)
+
+
+def test_suffix_patterns_match_place_names():
+    assert FICTIONAL_LOCATION_PATTERN.search("他回到了，青云山。").group(1) == "青云山"
+    assert find_location_candidates("去，北京市；再去，青云山。") == ["北京市", "青云山"]
+
+
+def test_dialogue_scores_below_travel():
+    scorer = LocationSignalScorer()
+    dialogue = "“你怎么看？”“我觉得不妥。”“那就算了吧。”"
+    travel = "次日清晨，众人离开小镇，动身前往万剑宗。"
+    assert scorer.score(dialogue) == 0
+    assert scorer.score(travel) > 1
+
+
+def test_learned_names_raise_score():
+    scorer = LocationSignalScorer()
+    text = "她又想起了落霞那片竹林边的小屋。"
+    before = scorer.score(text)
+    scorer.learn({"locations": [{"id": "落霞小屋", "aliases": ["落霞"]}], "events": []})
+    assert scorer.score(text) == before + 1.5
+
+
+def test_prefilter_report_counts_recall_and_savings():
+    records = [
+        {"score": 0.0, "productive": False},
+        {"score": 0.5, "productive": True},
+        {"score": 2.0, "productive": True},
+        {"score": 3.0, "productive": False},
+    ]
+    report = prefilter_report(records, [1.0])
+    assert report["1"] == {"skipped": 2, "missed_productive": 1, "recall": 0.5, "savings": 0.5}
+
+
+def test_focus_windows_keep_signal_paragraphs_with_neighbors():
+    text = (
+        "“今天吃什么？”“随便。”\n\n"
+        "他想了很久。终于决定了。次日众人动身前往万剑宗。一路无话。\n\n"
+        "“累死了。”“再坚持一下。”"
+    )
+    windows = select_focus_windows(text, neighbors=1)
+    assert len(windows) == 1
+    a, b = windows[0]
+    assert text[a:b].startswith("“随便。”")
+    assert text[a:b].endswith("“累死了。”")
+    assert select_focus_windows(text.replace("动身前往万剑宗", "继续闲聊"), neighbors=0) == []
+
+
+def test_validate_extraction_flags_suspicious_results():
+    text = "张三离开，青云山，前往，万剑宗。"
+    assert validate_extraction({"events": []}, text) == "empty_with_signal"
+    assert validate_extraction({"events": []}, "“嗯。”“好。”") is None
+    invented = {"events": [{"location": "天音寺"}, {"location": "青云山"}, {"location": "焚香谷"}]}
+    assert validate_extraction(invented, text) == "locations_not_in_text"
+    assert validate_extraction({"events": [{"location": "青云山"}]}, text) is None
+    # 编号还原出的规范名不在原文里，但原文用的是它的别名
+    canonical = {"events": [{"location": "青云门"}, {"location": "青云门"}, {"location": "万剑宗"}]}
+    assert validate_extraction(canonical, text) == "locations_not_in_text"
+    assert validate_extraction(canonical, text, {"青云门": ["青云山"]}) is None